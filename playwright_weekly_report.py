@@ -33,6 +33,10 @@ AUTH_FILE = os.path.join(BASE_PATH, "auth.json")
 PROMPT_FILE = os.path.join(BASE_PATH, "提示词.md")
 OUTPUT_DIR = os.path.join(BASE_PATH, "周报")
 
+# 复用 tita-市场 的 LLM 调用（共享连接池 + 响应缓存）
+sys.path.append(os.path.join(BASE_PATH, "tita-市场"))
+from llm_client import DEFAULT_SUMMARY_TIMEOUT, chat_completion
+
 # 默认配置（user_id 和 org_id 会在首次登录后自动获取）
 DEFAULT_CONFIG = {
     "tita_base_url": "https://work-weixin.tita.com",
@@ -711,6 +715,10 @@ def generate_ai_summary(reports_text, config):
     api_url = config.get("ai_api_url")
     api_key = config.get("ai_api_key")
     model_id = config.get("ai_model_id")
+    # 配置了 llm.base_url（其他 OpenAI 兼容服务，如本地替身）时优先使用
+    base_url = config.get("llm", {}).get("base_url")
+    if base_url:
+        api_url = base_url.rstrip("/") + "/chat/completions"
     
     prompt_template = load_prompt_template()
     
@@ -719,30 +727,17 @@ def generate_ai_summary(reports_text, config):
         {"role": "user", "content": f"以下是本周的日报记录，请汇总生成周报：\n\n{reports_text}"}
     ]
     
-    payload = {
-        "model": model_id,
-        "messages": messages,
-        "temperature": 0.3
-    }
-    
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {api_key}"
-    }
-    
     try:
-        response = requests.post(api_url, headers=headers, json=payload, timeout=60)
-        response.raise_for_status()
-        result = response.json()
-        
-        if "choices" in result and len(result["choices"]) > 0:
-            summary = result["choices"][0]["message"]["content"]
-            print("(SUCCESS) AI 总结生成成功")
-            return summary
-        else:
-            print(f"(WARNING) AI 响应格式异常: {result}")
-            return None
-            
+        # 同一批日报与提示词的结果会被缓存，重复生成时不再请求
+        summary = chat_completion(messages, model=model_id, api_key=api_key, config=config,
+                                  temperature=0.3, timeout=DEFAULT_SUMMARY_TIMEOUT, url=api_url,
+                                  caller='weekly_summary')
+        print("(SUCCESS) AI 总结生成成功")
+        return summary
+            
+    except (KeyError, IndexError) as e:
+        print(f"(WARNING) AI 响应格式异常: {e}")
+        return None
     except requests.exceptions.Timeout:
         print("(ERROR) AI 接口请求超时")
         return None
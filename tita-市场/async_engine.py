@@ -0,0 +1,308 @@
+"""
+异步拉取分析引擎（asyncio + httpx）
+Tita 分页与火山引擎分析在同一个事件循环里并发推进：
+  - 每拉到一页就立即为其中的目标日报创建分析任务，不等全部页拉完
+  - Tita 页请求与 LLM 调用分别由 page_concurrency / llm_concurrency 限制并发
+  - 独立的写库任务持有 SQLite 连接，所有入库都经由它完成
+整体耗时取决于 LLM 并发上限，而不是日报数量。
+
+在 config.json 中启用：
+    "ingest_engine": "async",
+    "async_engine": { "page_concurrency": 4, "llm_concurrency": 8 }
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import daily_log_aggregator as aggregator
+from rate_limiter import get_shared_limiter
+
+try:
+    import httpx
+    HTTPX_AVAILABLE = True
+except ImportError:
+    HTTPX_AVAILABLE = False
+
+DEFAULT_LLM_CONCURRENCY = 8
+WRITE_QUEUE_SIZE = 100
+
+
+async def _fetch_page(client, config, page_num, start_time, end_time, department_ids, limiter, retry, stats):
+    """请求单页，失败时原页指数退避重试；返回 Data 字段，重试耗尽返回 None"""
+    payload = aggregator.build_search_payload(page_num, start_time, end_time,
+                                              department_ids=department_ids)
+    for attempt in range(retry['max_retries'] + 1):
+        await asyncio.to_thread(limiter.acquire)
+        try:
+            print(f"Fetching page {page_num}...")
+            response = await client.post(config['tita_api_url'], headers=config['headers'], json=payload)
+            if response.status_code in [401, 403]:
+                raise aggregator.CookieExpiredError(f"HTTP {response.status_code}")
+            response.raise_for_status()
+            data = response.json()
+            if data['Code'] != 1:
+                raise RuntimeError(f"Error from API: {data['Message']}")
+        except aggregator.CookieExpiredError:
+            raise
+        except Exception as e:
+            if aggregator._is_throttled(e):
+                limiter.on_throttled()
+            if attempt == retry['max_retries']:
+                print(f"Request failed (page {page_num}), giving up after {attempt + 1} attempts: {e}")
+                stats['pages_lost'].append(page_num)
+                return None
+            delay = aggregator._retry_delay(e, attempt, retry['backoff_base'], retry['backoff_max'])
+            print(f"Request failed (page {page_num}): {e}, retrying in {delay:.1f}s...")
+            stats['page_retries'] += 1
+            await asyncio.sleep(delay)
+            continue
+
+        limiter.on_success()
+        stats['pages_fetched'] += 1
+        return data.get('Data') or {}
+
+
+async def iter_pages(client, config, start_time, end_time, department_ids, known_feeds, stats):
+    """按页码顺序逐页产出日报列表，同一窗口内的页并发请求"""
+    fetch_config = config.get('fetch', {})
+    concurrency = config.get('async_engine', {}).get(
+        'page_concurrency', fetch_config.get('concurrency', aggregator.DEFAULT_FETCH_CONCURRENCY))
+    limiter = get_shared_limiter('tita', fetch_config.get('requests_per_second', aggregator.DEFAULT_FETCH_RPS),
+                                 adaptive=True)
+    retry = {
+        'max_retries': fetch_config.get('max_retries', aggregator.DEFAULT_FETCH_MAX_RETRIES),
+        'backoff_base': fetch_config.get('backoff_base', aggregator.DEFAULT_FETCH_BACKOFF_BASE),
+        'backoff_max': fetch_config.get('backoff_max', aggregator.DEFAULT_FETCH_BACKOFF_MAX),
+    }
+
+    def fetch(page_num):
+        return _fetch_page(client, config, page_num, start_time, end_time, department_ids,
+                           limiter, retry, stats)
+
+    first = await fetch(1)
+    if first is None:
+        return
+    feeds = first.get('feeds', [])
+    yield feeds
+    if aggregator._is_last_page(feeds, known_feeds):
+        return
+
+    total_pages = aggregator.get_total_pages(first)
+    next_page = 2
+    while total_pages is None or next_page <= total_pages:
+        last_page = total_pages if total_pages is not None else next_page + concurrency - 1
+        window = range(next_page, min(next_page + concurrency, last_page + 1))
+        results = await asyncio.gather(*(fetch(p) for p in window))
+
+        stop = all(data is None for data in results)
+        for data in results:
+            if data is None:
+                continue
+            feeds = data.get('feeds', [])
+            yield feeds
+            if aggregator._is_last_page(feeds, known_feeds):
+                stop = True
+        if stop:
+            return
+        next_page += concurrency
+
+
+async def _writer(conn, queue, date_str, stats):
+    """
+    唯一持有 SQLite 连接的写库任务，队列中积压的结果合并为一次提交
+    队列元素为 (行数据, 分析结果, 事件)；合并分析得到的事件按单跑（pending）写入 events_v3
+    """
+    done = False
+    while not done:
+        batch = [await queue.get()]
+        while not queue.empty():
+            batch.append(queue.get_nowait())
+        if None in batch:
+            done = True
+            batch = [item for item in batch if item is not None]
+        if batch:
+            aggregator.save_logs_to_db(conn, [(row, analysis) for row, analysis, _ in batch])
+            for row, _, events in batch:
+                if events:
+                    saved_events, _ = aggregator.extractor.save_events_v3(conn, str(row['feed_id']), date_str,
+                                                                          events, events, None, False)
+                    stats['events'] += saved_events
+
+
+async def ingest_day_async(config, date_str, incremental=None, on_progress=None):
+    """
+    ingest_day 的异步版本，返回值结构相同
+    config['analysis']['mode'] 与 ['batch'] 的含义同 iter_ingest_day：
+    combined 时每篇日报一次调用同时得到分类与 v3 事件；batch 时每页待分析的日报合并成少量请求
+    """
+    if incremental is None:
+        incremental = config.get('incremental', True)
+    llm_concurrency = config.get('async_engine', {}).get(
+        'llm_concurrency', config.get('analysis', {}).get('workers', DEFAULT_LLM_CONCURRENCY))
+
+    start_time = f"{date_str} 00:00:00"
+    end_time = f"{date_str} 23:59:59"
+
+    conn = aggregator.init_db()
+    # Cookie 失效等异常退出时也要关闭连接（写库任务先在内层 finally 中结束）
+    try:
+        known_feeds = aggregator.load_ledger(conn, date_str) if incremental else None
+        saved = aggregator.load_saved_analyses(conn, date_str)
+        department_ids = aggregator.resolve_department_ids(conn, config)
+        if department_ids is None:
+            print("Department IDs not resolved yet, fetching all departments and filtering by name")
+
+        analysis_config = config.get('analysis', {})
+        combined = analysis_config.get('mode', 'split') == 'combined'
+        if combined and not aggregator.extractor.events_table_exists(conn):
+            print("Warning: events_v3 table not found, run upgrade_schema_v3.py first; "
+                  "falling back to split analysis")
+            combined = False
+        batch = analysis_config.get('batch') and not combined
+        if combined:
+            # 提示词每天只构建一次，所有日报共用同一份前缀
+            combined_prompt = aggregator.extractor.build_combined_prompt(
+                aggregator.extractor.load_business_knowledge(), aggregator.extractor.load_taxonomy(conn),
+                config['analysis_categories'])
+
+        fetch_stats = aggregator.new_fetch_stats()
+        stats = {'analyzed': 0, 'skipped': 0, 'edited': 0, 'prefiltered': 0, 'events': 0}
+        progress = {'done': 0, 'total': 0}
+
+        write_queue = asyncio.Queue(maxsize=WRITE_QUEUE_SIZE)
+        writer = asyncio.create_task(_writer(conn, write_queue, date_str, stats))
+        llm_semaphore = asyncio.Semaphore(llm_concurrency)
+        # LLM 调用仍走同步的分析函数，放到独立线程池执行，避免受默认线程池大小限制
+        llm_executor = ThreadPoolExecutor(max_workers=max(1, llm_concurrency))
+        loop = asyncio.get_running_loop()
+
+        def prepare(log):
+            """整理正文；正文哈希未变且已有分析结果时复用，没有业务内容时记录全空结果"""
+            item = {'log': log, 'full_content': aggregator.build_log_content(log), 'events': None}
+            item['content_hash'] = aggregator.content_hash(item['full_content'])
+            item['analysis'], item['edited'] = aggregator.reusable_analysis(
+                saved, str(log.get('feedId', '')), item['content_hash'])
+            item['reused'] = item['analysis'] is not None
+            if not item['reused']:
+                item['analysis'] = aggregator.prefiltered_analysis(item['full_content'], config)
+                if item['analysis'] is not None:
+                    stats['prefiltered'] += 1
+            return item
+
+        async def finish(item):
+            log = item['log']
+            if item['reused']:
+                stats['skipped'] += 1
+            else:
+                stats['analyzed'] += 1
+                if item['edited']:
+                    stats['edited'] += 1
+                await write_queue.put((aggregator.feed_to_row(log, date_str, item['full_content'],
+                                                              item['content_hash']),
+                                       item['analysis'], item['events']))
+
+            progress['done'] += 1
+            if on_progress:
+                on_progress(progress['done'], progress['total'], log.get('publishUser', {}).get('name', 'Unknown'))
+            return {'original_log': log, 'full_content': item['full_content'], 'analysis': item['analysis']}
+
+        async def process(log):
+            item = prepare(log)
+            if item['analysis'] is None:
+                user_name = log.get('publishUser', {}).get('name', 'Unknown')
+                async with llm_semaphore:
+                    if combined:
+                        print(f"Analyzing log for {user_name} (combined)...")
+                        item['analysis'], item['events'] = await loop.run_in_executor(
+                            llm_executor, aggregator.analyze_log_combined, item['full_content'], config,
+                            combined_prompt)
+                    else:
+                        print(f"Analyzing log for {user_name}...")
+                        item['analysis'] = await loop.run_in_executor(
+                            llm_executor, aggregator.analyze_log_content, item['full_content'], config)
+            return [await finish(item)]
+
+        async def process_batch(page_logs):
+            # 批量模式：一页中待分析的日报合并成少量请求（按条数与 token 预算切分，见 analyze_log_batch）
+            items = [prepare(log) for log in page_logs]
+            todo = [item for item in items if item['analysis'] is None]
+            if todo:
+                print(f"Analyzing {len(todo)} logs in batch mode...")
+                docs = [(str(item['log'].get('feedId') or idx), item['full_content'])
+                        for idx, item in enumerate(todo)]
+                async with llm_semaphore:
+                    results = await loop.run_in_executor(llm_executor, aggregator.analyze_log_batch, docs, config)
+                for (doc_id, _), item in zip(docs, todo):
+                    item['analysis'] = results[doc_id]
+            return [await finish(item) for item in items]
+
+        all_logs = []
+        seen_ids = set()
+        tasks = []
+        try:
+            async with httpx.AsyncClient(timeout=httpx.Timeout(30, connect=5)) as client:
+                async for feeds in iter_pages(client, config, start_time, end_time, department_ids,
+                                              known_feeds, fetch_stats):
+                    page_logs = []
+                    for feed in feeds:
+                        feed_id = feed.get('feedId')
+                        if feed_id:
+                            if feed_id in seen_ids:
+                                continue
+                            seen_ids.add(feed_id)
+                        page_logs.append(feed)
+                    all_logs.extend(page_logs)
+
+                    # 本页的目标日报立即开始分析，与后续翻页并行
+                    targets = aggregator.filter_logs(page_logs, config['target_departments'])
+                    progress['total'] += len(targets)
+                    if batch:
+                        if targets:
+                            tasks.append(asyncio.create_task(process_batch(targets)))
+                    else:
+                        tasks.extend(asyncio.create_task(process(feed)) for feed in targets)
+
+            processed = [result for results in await asyncio.gather(*tasks) for result in results]
+        finally:
+            for task in tasks:
+                task.cancel()
+            await write_queue.put(None)
+            await writer
+            llm_executor.shutdown(wait=False)
+
+        aggregator.record_fetched_feeds(conn, date_str, all_logs)
+        stats.update({'fetched': len(all_logs), 'filtered': progress['total']})
+        fetch_stats['pages_lost'].sort()
+        stats.update(fetch_stats)
+        if incremental:
+            aggregator.append_earlier_logs(conn, date_str, processed, stats)
+    finally:
+        conn.close()
+
+    print(f"Pages fetched: {fetch_stats['pages_fetched']}, retries: {fetch_stats['page_retries']}, "
+          f"lost: {len(fetch_stats['pages_lost'])}")
+    if stats['events']:
+        print(f"v3 events saved in combined mode: {stats['events']}")
+    if stats['prefiltered']:
+        print(f"Template-only logs recorded without LLM: {stats['prefiltered']} "
+              f"({stats['prefiltered']} calls saved)")
+    return processed, stats
+
+
+def ingest_day(config, date_str, incremental=None, on_progress=None):
+    """
+    同步入口：在新的事件循环中运行异步引擎
+    httpx 未安装或 Cookie 失效时退回同步的 aggregator.ingest_day（后者负责刷新Cookie）
+    """
+    if HTTPX_AVAILABLE:
+        try:
+            return asyncio.run(ingest_day_async(config, date_str, incremental, on_progress))
+        except aggregator.CookieExpiredError:
+            print("[WARN] Cookie已失效，改用同步引擎处理（含Cookie刷新）")
+    else:
+        print("[WARN] 未安装 httpx，异步引擎不可用，改用同步引擎 (pip install httpx)")
+
+    conn = aggregator.init_db()
+    try:
+        return aggregator.ingest_day(config, date_str, conn, incremental=incremental, on_progress=on_progress)
+    finally:
+        conn.close()
@@ -0,0 +1,198 @@
+"""
+历史日报回填
+按天切分日期区间，有限并发地逐天拉取 + 分析 + 入库。
+每完成一天写入 backfill_checkpoints，中途崩溃后重新执行同一命令即可从断点继续。
+
+使用方式：
+python backfill.py 2025-10-01 2025-12-31
+python backfill.py 2025-10-01 2025-12-31 --workers 3
+python backfill.py 2025-10-01 2025-12-31 --force   # 忽略断点，全部重跑
+"""
+import argparse
+import datetime
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import daily_log_aggregator as aggregator
+
+DEFAULT_WORKERS = 2
+
+
+def init_checkpoint_table(conn):
+    c = conn.cursor()
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS backfill_checkpoints (
+            log_date TEXT PRIMARY KEY,
+            status TEXT,              -- running / done / failed
+            fetched INTEGER DEFAULT 0,
+            analyzed INTEGER DEFAULT 0,
+            skipped INTEGER DEFAULT 0,
+            error TEXT,
+            started_at TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    ''')
+    conn.commit()
+
+
+def split_days(start_date, end_date):
+    """将 [start_date, end_date] 拆成逐天的日期字符串"""
+    start = datetime.date.fromisoformat(str(start_date))
+    end = datetime.date.fromisoformat(str(end_date))
+    if end < start:
+        raise ValueError(f"结束日期 {end} 早于开始日期 {start}")
+    return [str(start + datetime.timedelta(days=i)) for i in range((end - start).days + 1)]
+
+
+def load_done_days(conn, days):
+    c = conn.cursor()
+    c.execute("SELECT log_date FROM backfill_checkpoints WHERE status = 'done'")
+    done = {row[0] for row in c.fetchall()}
+    return [d for d in days if d in done]
+
+
+def mark_day(conn, log_date, status, stats=None, error=None):
+    stats = stats or {}
+    c = conn.cursor()
+    if status == 'running':
+        c.execute('''
+            INSERT INTO backfill_checkpoints (log_date, status, started_at)
+            VALUES (?, 'running', CURRENT_TIMESTAMP)
+            ON CONFLICT(log_date) DO UPDATE SET
+                status = 'running', error = NULL, started_at = CURRENT_TIMESTAMP, finished_at = NULL
+        ''', (log_date,))
+    else:
+        c.execute('''
+            UPDATE backfill_checkpoints
+            SET status = ?, fetched = ?, analyzed = ?, skipped = ?, error = ?, finished_at = CURRENT_TIMESTAMP
+            WHERE log_date = ?
+        ''', (status, stats.get('fetched', 0), stats.get('analyzed', 0), stats.get('skipped', 0),
+              error, log_date))
+    conn.commit()
+
+
+def backfill_day(config, log_date):
+    """回填单天：每个线程使用独立的数据库连接"""
+    conn = aggregator.init_db()
+    init_checkpoint_table(conn)
+    mark_day(conn, log_date, 'running')
+    try:
+        _, stats = aggregator.ingest_day(config, log_date, conn)
+        # Cookie 失效或有页面重试耗尽时不记为完成，断点续跑会重新处理这一天
+        if stats.get('cookie_failed'):
+            raise aggregator.CookieExpiredError("Cookie已失效且刷新失败")
+        if stats['pages_lost']:
+            raise RuntimeError(f"{len(stats['pages_lost'])} 页拉取失败: {stats['pages_lost']}")
+        mark_day(conn, log_date, 'done', stats)
+        return stats
+    except Exception as e:
+        mark_day(conn, log_date, 'failed', error=str(e))
+        raise
+    finally:
+        conn.close()
+
+
+def run_backfill(config, start_date, end_date, workers=None, force=False, on_day_done=None):
+    """
+    回填日期区间
+    on_day_done(log_date, stats, error) 在每天完成（或失败）后回调
+    任一天 Cookie 失效且刷新失败时中止剩余日期（计入 failed_days，重新执行即可续跑）
+    返回汇总统计
+    """
+    if workers is None:
+        workers = config.get('backfill', {}).get('workers', DEFAULT_WORKERS)
+
+    days = split_days(start_date, end_date)
+
+    conn = aggregator.init_db()
+    init_checkpoint_table(conn)
+    done_days = set() if force else set(load_done_days(conn, days))
+    conn.close()
+
+    pending = [d for d in days if d not in done_days]
+    summary = {
+        'total_days': len(days),
+        'resumed_days': len(done_days),
+        'done_days': 0,
+        'failed_days': [],
+        'cookie_failed': False,
+        'fetched': 0,
+        'analyzed': 0,
+        'skipped': 0,
+    }
+    lock = threading.Lock()
+
+    print(f"回填 {days[0]} ~ {days[-1]}: 共 {len(days)} 天，已完成 {len(done_days)} 天，待处理 {len(pending)} 天"
+          f"（并发 {workers}）")
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = {executor.submit(backfill_day, config, d): d for d in pending}
+        for future in as_completed(futures):
+            log_date = futures[future]
+            error = None
+            stats = {}
+            if future.cancelled():
+                error = "Cookie失效，已中止"
+            else:
+                try:
+                    stats = future.result()
+                except aggregator.CookieExpiredError as e:
+                    error = f"Cookie失效: {e}"
+                    if not summary['cookie_failed']:
+                        summary['cookie_failed'] = True
+                        # 尚未开始的日期不再启动；已在运行的会复用同一次刷新结果并很快失败
+                        for other in futures:
+                            other.cancel()
+                except Exception as e:
+                    error = str(e)
+
+            with lock:
+                if error:
+                    summary['failed_days'].append(log_date)
+                    print(f"[FAIL] {log_date}: {error}")
+                else:
+                    summary['done_days'] += 1
+                    for key in ('fetched', 'analyzed', 'skipped'):
+                        summary[key] += stats.get(key, 0)
+                    print(f"[OK] {log_date}: 拉取 {stats.get('fetched', 0)} 条，"
+                          f"分析 {stats.get('analyzed', 0)} 条，跳过 {stats.get('skipped', 0)} 条 "
+                          f"({summary['done_days'] + len(summary['failed_days'])}/{len(pending)})")
+
+            if on_day_done:
+                on_day_done(log_date, stats, error)
+
+    summary['failed_days'].sort()
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='按日期区间回填历史日报')
+    parser.add_argument('start', help='开始日期 YYYY-MM-DD')
+    parser.add_argument('end', help='结束日期 YYYY-MM-DD（含）')
+    parser.add_argument('--workers', type=int, default=None, help=f'并行处理的天数（默认 {DEFAULT_WORKERS}）')
+    parser.add_argument('--force', action='store_true', help='忽略断点，已完成的日期也重新处理')
+    args = parser.parse_args()
+
+    if not os.path.exists(aggregator.CONFIG_FILE):
+        print(f"Config file {aggregator.CONFIG_FILE} not found!")
+        sys.exit(1)
+
+    config = aggregator.load_config()
+    summary = run_backfill(config, args.start, args.end, workers=args.workers, force=args.force)
+
+    print("\n" + "=" * 60)
+    print(f"  回填完成: {summary['done_days']} 天成功，{len(summary['failed_days'])} 天失败，"
+          f"{summary['resumed_days']} 天断点跳过")
+    print(f"  拉取 {summary['fetched']} 条，分析 {summary['analyzed']} 条，跳过 {summary['skipped']} 条")
+    if summary['cookie_failed']:
+        print("  Cookie已失效且刷新失败，剩余日期已中止，请刷新Cookie后重新执行")
+    if summary['failed_days']:
+        print(f"  失败日期: {', '.join(summary['failed_days'])}（重新执行同一命令即可重试）")
+    print("=" * 60)
+    sys.exit(1 if summary['failed_days'] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+线程安全的熔断器
+上游连续失败 failure_threshold 次后熔断（open）：cooldown 秒内的调用直接抛出 CircuitOpenError，
+不再逐个等待超时；冷却结束后放行一个试探请求（half_open），成功则恢复，失败则再熔断一个冷却期。
+"""
+import threading
+import time
+
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_COOLDOWN = 60
+
+
+class CircuitOpenError(RuntimeError):
+    """熔断期间拒绝调用"""
+
+
+class CircuitBreaker:
+
+    def __init__(self, name, failure_threshold=DEFAULT_FAILURE_THRESHOLD, cooldown=DEFAULT_COOLDOWN):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state(time.monotonic())
+
+    def _state(self, now):
+        if self.opened_at is None:
+            return 'closed'
+        if now - self.opened_at < self.cooldown:
+            return 'open'
+        return 'half_open'
+
+    def before_call(self):
+        """熔断中抛出 CircuitOpenError；冷却结束后只放行一个试探请求"""
+        with self._lock:
+            state = self._state(time.monotonic())
+            if state == 'closed':
+                return
+            if state == 'half_open' and not self._probing:
+                self._probing = True
+                return
+            remaining = max(0, self.cooldown - (time.monotonic() - self.opened_at))
+        raise CircuitOpenError(f"{self.name} 熔断中（连续失败 {self.failures} 次），约 {remaining:.0f}s 后重试")
+
+    def on_success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                print(f"[circuit] {self.name} 已恢复")
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def on_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._probing or (self.opened_at is None and self.failures >= self.failure_threshold):
+                if self.opened_at is None:
+                    print(f"[circuit] {self.name} 连续失败 {self.failures} 次，熔断 {self.cooldown}s")
+                self.opened_at = time.monotonic()
+            self._probing = False
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(name, failure_threshold=DEFAULT_FAILURE_THRESHOLD, cooldown=DEFAULT_COOLDOWN):
+    """按名称获取进程内共享的熔断器，参数变化时就地更新"""
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = _breakers[name] = CircuitBreaker(name, failure_threshold, cooldown)
+        else:
+            breaker.failure_threshold = failure_threshold
+            breaker.cooldown = cooldown
+        return breaker
@@ -0,0 +1,61 @@
+"""
+日报预过滤
+只有 OKR 进展模板、或各板块几乎为空的日报，在调用模型之前直接判定为「无业务内容」：
+分类分析记录为全空结果，v3 抽取跳过，不再花一次（双跑两次）模型调用。
+
+判定规则（正文为 daily_log_aggregator.build_log_content 的输出）：
+  - 去掉「今日 OKR 进展」板块（只含 OKR 名称，是模板内容）
+  - 其余板块按标点、空白和数字切成片段，整段只由 generate_dashboard.TEMPLATE_STOP_WORDS
+    中的模板词与占位词拼成的片段去掉（「拜访」「跟进」等业务动词不在其中，也不会从句子中间删词）
+  - 剩余字符数少于 min_chars 即视为无业务内容（默认 1：「签约」这样两个字的日报也照常分析）
+
+配置（config.json，可选）：
+    "prefilter": { "enabled": true, "min_chars": 1 }
+"""
+import re
+
+from generate_dashboard import TEMPLATE_STOP_WORDS
+
+DEFAULT_MIN_CHARS = 1
+
+# build_log_content 中每个板块以 "**标题**:" 单独成行开头
+_SECTION_RE = re.compile(r'^\*\*(.+?)\*\*:$', re.M)
+# 只含模板内容的板块
+TEMPLATE_SECTIONS = {'今日 OKR 进展'}
+# 模板词之外常见的占位写法
+PLACEHOLDERS = ['同上', '见上', '如上', '略', 'OKR', 'N/A', 'n/a', 'null', 'none', 'None']
+_TEMPLATE_RE = re.compile('(?:' + '|'.join(re.escape(w) for w in sorted(set(TEMPLATE_STOP_WORDS) | set(PLACEHOLDERS),
+                                                                         key=len, reverse=True)) + ')+')
+_SPLIT_RE = re.compile(r'[\W\d_]+')
+
+
+def split_sections(content):
+    """返回 [(标题, 正文)]；没有板块标题的正文标题为空串"""
+    parts = _SECTION_RE.split(content or '')
+    sections = [('', parts[0])] if parts[0].strip() else []
+    sections.extend(zip(parts[1::2], parts[2::2]))
+    return sections
+
+
+def business_chars(content):
+    """非模板板块中，去掉标点、数字和纯模板片段之后剩余的字符数"""
+    total = 0
+    for title, body in split_sections(content):
+        if title.strip() in TEMPLATE_SECTIONS:
+            continue
+        total += sum(len(token) for token in _SPLIT_RE.split(body)
+                     if token and not _TEMPLATE_RE.fullmatch(token))
+    return total
+
+
+def is_template_only(content, config=None):
+    """日报没有业务内容（空或只有模板）时返回 True；prefilter.enabled 为 false 时总是 False"""
+    prefilter = (config or {}).get('prefilter', {})
+    if not prefilter.get('enabled', True):
+        return False
+    return business_chars(content) < prefilter.get('min_chars', DEFAULT_MIN_CHARS)
+
+
+def empty_analysis(categories):
+    """无业务内容日报的分类结果：每个类别为空串"""
+    return {cat: '' for cat in categories}
@@ -1,20 +1,58 @@
 import sqlite3
-import requests
 import json
 import datetime
 import os
+import math
+import hashlib
+import zlib
+import random
+import shutil
+import threading
 import time
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+
+from http_client import get_session
+from circuit_breaker import CircuitOpenError
+from content_filter import empty_analysis, is_template_only
+import extract_events_v3 as extractor
+from llm_client import chat_completion, cache_stats
+from model_router import (TIER_CHEAP, TIER_STRONG, endpoint_for, escalate, format_routing_stats, low_confidence,
+                          routing_enabled, select_tier)
+from failure_queue import STAGE_ANALYSIS, enqueue as enqueue_failure, init_failure_queue, resolve as resolve_failures
+from pipeline import run_pipeline, DEFAULT_QUEUE_SIZE
+from response_validator import category_schema, conform, parse_structured, repair_json
+from rate_limiter import get_shared_limiter
 
 # Configuration
 CONFIG_FILE = 'config.json'
 DB_FILE = 'tita_logs.db'
 
+# 分页拉取
+PAGE_SIZE = 20
+DEFAULT_FETCH_CONCURRENCY = 4
+DEFAULT_FETCH_RPS = 2
+DEFAULT_FETCH_MAX_RETRIES = 4
+DEFAULT_FETCH_BACKOFF_BASE = 1.0
+DEFAULT_FETCH_BACKOFF_MAX = 30.0
+MAX_CONSECUTIVE_LOST_PAGES = 3
+
+# LLM 分析的并行 worker 数（每秒请求上限见 llm_client）
+DEFAULT_ANALYSIS_WORKERS = 4
+# 批量分析：一次请求最多合并的日报数与正文的估算 token 上限
+DEFAULT_BATCH_MAX_LOGS = 8
+DEFAULT_BATCH_TOKEN_BUDGET = 6000
+
+# 发布人信息中可能承载部门ID的字段
+DEPARTMENT_ID_KEYS = ('departmentId', 'deptId', 'departmentID')
+
 def load_config():
     with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
         return json.load(f)
 
 def init_db():
-    conn = sqlite3.connect(DB_FILE)
+    # 回填等场景会有多个线程各自持有连接写库，放宽锁等待时间
+    conn = sqlite3.connect(DB_FILE, timeout=30)
     c = conn.cursor()
     c.execute('''
         CREATE TABLE IF NOT EXISTS daily_logs (
@@ -28,29 +66,235 @@ def init_db():
             crawled_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     ''')
+    migrate_daily_logs(c)
+    # 增量拉取台账：记录每天见过的 feedId 及其内容指纹
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS ingest_ledger (
+            log_date TEXT,
+            feed_id TEXT,
+            fingerprint TEXT,
+            first_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (log_date, feed_id)
+        )
+    ''')
+    # 部门名称 -> Tita部门ID 缓存，用于服务端按部门过滤
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS department_ids (
+            department_name TEXT PRIMARY KEY,
+            department_id TEXT NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    # 原始日报归档（zlib压缩的完整JSON），用于不访问Tita的离线重放
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS raw_feeds (
+            feed_id TEXT PRIMARY KEY,
+            log_date TEXT,
+            fingerprint TEXT,
+            raw_json BLOB,
+            fetched_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_raw_feeds_date ON raw_feeds(log_date)')
+    # 分析失败队列，由 tita_service 在早高峰之外重试
+    init_failure_queue(c)
     conn.commit()
     return conn
 
+def migrate_daily_logs(c):
+    """
+    为旧库补充内容哈希相关列：
+      content_hash        规范化正文哈希，未变化的日报不再调用 LLM
+      prev_analysis_json  正文被修改后，修改前那一版的分析结果
+      edited_at           检测到正文修改的时间
+    已有记录按现存正文补算哈希，升级后不会触发全量重新分析
+    """
+    c.execute('PRAGMA table_info(daily_logs)')
+    columns = {row[1] for row in c.fetchall()}
+    for name, ddl in (('content_hash', 'TEXT'), ('prev_analysis_json', 'TEXT'), ('edited_at', 'TIMESTAMP')):
+        if name not in columns:
+            c.execute(f'ALTER TABLE daily_logs ADD COLUMN {name} {ddl}')
+
+    c.execute('SELECT feed_id, content FROM daily_logs WHERE content_hash IS NULL')
+    rows = c.fetchall()
+    if rows:
+        c.executemany('UPDATE daily_logs SET content_hash = ? WHERE feed_id = ?',
+                      [(content_hash(content), feed_id) for feed_id, content in rows])
+
+def content_hash(content):
+    """正文的规范化哈希：统一全角/半角并合并空白，仅排版上的差异不算修改"""
+    normalized = ' '.join(unicodedata.normalize('NFKC', content or '').split())
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+
+# 正文哈希变化且分析结果也更新时，把旧分析移入 prev_analysis_json
+UPSERT_LOG_SQL = '''
+    INSERT INTO daily_logs
+    (feed_id, user_id, user_name, department, log_date, content, analysis_json, content_hash)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(feed_id) DO UPDATE SET
+        user_id = excluded.user_id,
+        user_name = excluded.user_name,
+        department = excluded.department,
+        log_date = excluded.log_date,
+        content = excluded.content,
+        analysis_json = excluded.analysis_json,
+        content_hash = excluded.content_hash,
+        prev_analysis_json = CASE
+            WHEN daily_logs.content_hash IS NOT excluded.content_hash
+                 AND daily_logs.analysis_json IS NOT excluded.analysis_json
+            THEN daily_logs.analysis_json ELSE daily_logs.prev_analysis_json END,
+        edited_at = CASE
+            WHEN daily_logs.content_hash IS NOT excluded.content_hash THEN CURRENT_TIMESTAMP
+            ELSE daily_logs.edited_at END,
+        crawled_at = CURRENT_TIMESTAMP
+'''
+
+def _log_row_params(log_data, analysis_result):
+    return (
+        log_data['feed_id'],
+        log_data['user_id'],
+        log_data['user_name'],
+        log_data['department'],
+        log_data['log_date'],
+        log_data['content'],
+        json.dumps(analysis_result, ensure_ascii=False),
+        log_data.get('content_hash') or content_hash(log_data['content'])
+    )
+
+def _record_analysis_outcomes(c, items):
+    """分析失败的日报登记到失败队列，成功的关闭队列中的旧记录"""
+    succeeded = []
+    for log_data, analysis_result in items:
+        if is_failed_analysis(analysis_result):
+            enqueue_failure(c, log_data['feed_id'], STAGE_ANALYSIS, ANALYSIS_FAILED, log_data['log_date'])
+        else:
+            succeeded.append(log_data['feed_id'])
+    if succeeded:
+        resolve_failures(c, succeeded, STAGE_ANALYSIS)
+
 def save_log_to_db(conn, log_data, analysis_result):
+    save_logs_to_db(conn, [(log_data, analysis_result)])
+
+def save_logs_to_db(conn, items):
+    """批量写入 [(log_data, analysis_result), ...]，只提交一次"""
     c = conn.cursor()
     try:
-        c.execute('''
-            INSERT OR REPLACE INTO daily_logs 
-            (feed_id, user_id, user_name, department, log_date, content, analysis_json)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            log_data['feed_id'],
-            log_data['user_id'],
-            log_data['user_name'],
-            log_data['department'],
-            log_data['log_date'],
-            log_data['content'],
-            json.dumps(analysis_result, ensure_ascii=False)
-        ))
+        c.executemany(UPSERT_LOG_SQL, [_log_row_params(log_data, analysis_result)
+                                       for log_data, analysis_result in items])
+        _record_analysis_outcomes(c, items)
         conn.commit()
     except Exception as e:
         print(f"Error saving to DB: {e}")
 
+def feed_fingerprint(feed):
+    """日报正文的内容指纹，只取 dailyContent，点赞/评论数变化不影响"""
+    raw = json.dumps(feed.get('dailyContent', []), ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+def load_ledger(conn, log_date):
+    """读取某天已见过的 feedId -> 指纹"""
+    c = conn.cursor()
+    c.execute('SELECT feed_id, fingerprint FROM ingest_ledger WHERE log_date = ?', (log_date,))
+    return dict(c.fetchall())
+
+def record_ledger(conn, log_date, feeds):
+    c = conn.cursor()
+    c.executemany('''
+        INSERT INTO ingest_ledger (log_date, feed_id, fingerprint) VALUES (?, ?, ?)
+        ON CONFLICT(log_date, feed_id) DO UPDATE SET
+            fingerprint = excluded.fingerprint,
+            last_seen = CURRENT_TIMESTAMP
+    ''', [(log_date, str(f.get('feedId')), feed_fingerprint(f)) for f in feeds if f.get('feedId')])
+    conn.commit()
+
+ANALYSIS_FAILED = "分析失败"
+
+def is_failed_analysis(analysis):
+    """任一类别分析失败即视为失败，下次运行时重新分析"""
+    return isinstance(analysis, dict) and any(v == ANALYSIS_FAILED for v in analysis.values())
+
+def load_saved_analyses(conn, log_date):
+    """
+    批量读取某天已入库日报的正文哈希与分析结果：feed_id -> (content_hash, analysis)
+    分析失败或无法解析的记录 analysis 为 None
+    """
+    c = conn.cursor()
+    c.execute('SELECT feed_id, content_hash, analysis_json FROM daily_logs WHERE log_date = ?', (log_date,))
+    saved = {}
+    for feed_id, saved_hash, analysis_json in c.fetchall():
+        try:
+            analysis = json.loads(analysis_json) if analysis_json else None
+        except json.JSONDecodeError:
+            analysis = None
+        if is_failed_analysis(analysis):
+            analysis = None
+        saved[str(feed_id)] = (saved_hash, analysis)
+    return saved
+
+def reusable_analysis(saved, feed_id, new_hash):
+    """
+    判断是否可以复用已保存的分析
+    返回 (analysis, edited)：正文哈希一致且分析有效时 analysis 为已保存结果；
+    edited 表示该日报已入库但正文被修改过
+    """
+    saved_hash, analysis = saved.get(str(feed_id), (None, None))
+    if saved_hash is not None and saved_hash == new_hash and analysis is not None:
+        return analysis, False
+    return None, saved_hash is not None and saved_hash != new_hash
+
+def archive_feeds(conn, log_date, feeds):
+    """压缩保存原始日报JSON，内容未变化的不重复写入"""
+    rows = []
+    for feed in feeds:
+        if not feed.get('feedId'):
+            continue
+        raw = json.dumps(feed, ensure_ascii=False).encode('utf-8')
+        rows.append((str(feed['feedId']), log_date, feed_fingerprint(feed), zlib.compress(raw, 6)))
+
+    c = conn.cursor()
+    c.executemany('''
+        INSERT INTO raw_feeds (feed_id, log_date, fingerprint, raw_json) VALUES (?, ?, ?, ?)
+        ON CONFLICT(feed_id) DO UPDATE SET
+            log_date = excluded.log_date,
+            fingerprint = excluded.fingerprint,
+            raw_json = excluded.raw_json,
+            fetched_at = CURRENT_TIMESTAMP
+        WHERE raw_feeds.fingerprint IS NOT excluded.fingerprint
+    ''', rows)
+    conn.commit()
+
+def load_archived_feeds(conn, log_date):
+    """读取某天归档的原始日报"""
+    c = conn.cursor()
+    c.execute('SELECT raw_json FROM raw_feeds WHERE log_date = ? ORDER BY rowid', (log_date,))
+    return [json.loads(zlib.decompress(row[0]).decode('utf-8')) for row in c.fetchall()]
+
+def load_saved_logs(conn, log_date, exclude_feed_ids=()):
+    """读取某天已入库的日报，整理成与 ingest_day 返回值相同的结构"""
+    c = conn.cursor()
+    c.execute('''
+        SELECT feed_id, user_id, user_name, department, content, analysis_json
+        FROM daily_logs WHERE log_date = ? ORDER BY user_name
+    ''', (log_date,))
+    saved = []
+    for feed_id, user_id, user_name, department, content, analysis_json in c.fetchall():
+        if feed_id in exclude_feed_ids:
+            continue
+        try:
+            analysis = json.loads(analysis_json) if analysis_json else {}
+        except json.JSONDecodeError:
+            analysis = {}
+        saved.append({
+            'original_log': {
+                'feedId': feed_id,
+                'publishUser': {'userId': user_id, 'name': user_name, 'departmentName': department}
+            },
+            'full_content': content,
+            'analysis': analysis
+        })
+    return saved
+
 def get_yesterday_time_range():
     today = datetime.date.today()
     yesterday = today - datetime.timedelta(days=1)
@@ -60,93 +304,373 @@ def get_yesterday_time_range():
     end_time = f"{yesterday} 23:59:59"
     return start_time, end_time, yesterday
 
-def fetch_logs(config, start_time, end_time, auto_refresh_cookie=True):
-    url = config['tita_api_url']
-    headers = config['headers']
-    
-    all_logs = []
+class CookieExpiredError(Exception):
+    """Tita接口返回401/403，Cookie已失效"""
+
+
+def build_search_payload(page_num, start_time, end_time, page_size=PAGE_SIZE, department_ids=None):
+    return {
+        "pageNum": page_num,
+        "pageSize": page_size,
+        "relation": 0,
+        "summaryType": 0,
+        "startTime": start_time,
+        "endTime": end_time,
+        "searchDepartmentIds": list(department_ids) if department_ids else [""],
+        "searchUserIds": [""],
+        "searchGroupIds": [""]
+    }
+
+def fetch_page(config, page_num, start_time, end_time, page_size=PAGE_SIZE, department_ids=None):
+    """请求单页日报，返回接口的 Data 字段"""
+    payload = build_search_payload(page_num, start_time, end_time, page_size, department_ids)
+
+    print(f"Fetching page {page_num}...")
+    response = get_session('tita', config).post(config['tita_api_url'], headers=config['headers'], json=payload)
+
+    # Cookie失效检测
+    if response.status_code in [401, 403]:
+        raise CookieExpiredError(f"HTTP {response.status_code}")
+
+    response.raise_for_status()
+    data = response.json()
+
+    if data['Code'] != 1:
+        raise RuntimeError(f"Error from API: {data['Message']}")
+
+    return data.get('Data') or {}
+
+def get_total_pages(data, page_size=PAGE_SIZE):
+    """从第一页响应中推算总页数，接口未返回总数时返回 None"""
+    for key in ('pageCount', 'totalPage', 'totalPages'):
+        if isinstance(data.get(key), int):
+            return data[key]
+    for key in ('total', 'totalCount', 'count', 'rowCount'):
+        if isinstance(data.get(key), int):
+            return max(1, math.ceil(data[key] / page_size))
+    return None
+
+def _is_last_page(feeds, known_feeds):
+    """
+    不满一页，或（增量模式下）整页都是已见过且内容指纹未变的日报时停止翻页
+    known_feeds 为 load_ledger 返回的 feedId -> 指纹；有日报被修改过的页继续往后翻
+    """
+    if len(feeds) < PAGE_SIZE:
+        return True
+    if known_feeds is not None and all(known_feeds.get(str(f.get('feedId'))) == feed_fingerprint(f)
+                                       for f in feeds):
+        print("Page contains only known, unchanged feeds, stop paging.")
+        return True
+    return False
+
+def _is_throttled(error):
+    """429 / 5xx 视为上游限流或过载，需要降低请求速率"""
+    response = getattr(error, 'response', None)
+    status = getattr(response, 'status_code', None)
+    return status is not None and (status == 429 or status >= 500)
+
+def _retry_delay(error, attempt, base_delay, max_delay):
+    """带抖动的指数退避；服务端给出 Retry-After 时以其为准"""
+    response = getattr(error, 'response', None)
+    retry_after = response.headers.get('Retry-After') if response is not None else None
+    if retry_after and retry_after.isdigit():
+        return min(max_delay, float(retry_after))
+    return min(max_delay, base_delay * (2 ** attempt)) * random.uniform(0.5, 1.5)
+
+def new_fetch_stats():
+    return {'pages_fetched': 0, 'page_retries': 0, 'pages_lost': [], 'cookie_failed': False}
+
+def _make_page_loader(load_page, limiter, stats, max_retries, base_delay, max_delay):
+    """
+    包装单页请求：限速 + 失败后原页重试（指数退避）
+    返回的函数返回该页的 Data 字段；重试耗尽时返回 None，并把页码记入 stats['pages_lost']
+    """
+    lock = threading.Lock()
+
+    def load(page_num):
+        for attempt in range(max_retries + 1):
+            limiter.acquire()
+            try:
+                data = load_page(page_num)
+            except CookieExpiredError:
+                raise
+            except Exception as e:
+                if _is_throttled(e):
+                    limiter.on_throttled()
+                if attempt == max_retries:
+                    print(f"Request failed (page {page_num}), giving up after {attempt + 1} attempts: {e}")
+                    with lock:
+                        stats['pages_lost'].append(page_num)
+                    return None
+                delay = _retry_delay(e, attempt, base_delay, max_delay)
+                print(f"Request failed (page {page_num}): {e}, retrying in {delay:.1f}s...")
+                with lock:
+                    stats['page_retries'] += 1
+                time.sleep(delay)
+                continue
+
+            limiter.on_success()
+            with lock:
+                stats['pages_fetched'] += 1
+            return data
+
+    return load
+
+def _iter_pages_serial(load, known_feeds=None):
     page_num = 1
-    page_size = 20
-    
+    lost_in_row = 0
+
     while True:
-        payload = {
-            "pageNum": page_num,
-            "pageSize": page_size,
-            "relation": 0,
-            "summaryType": 0,
-            "startTime": start_time,
-            "endTime": end_time,
-            "searchDepartmentIds": [""],
-            "searchUserIds": [""],
-            "searchGroupIds": [""]
-        }
-        
-        print(f"Fetching page {page_num}...")
-        try:
-            response = requests.post(url, headers=headers, json=payload)
-            
-            # Cookie失效检测
-            if response.status_code in [401, 403]:
-                print("\n" + "=" * 50)
-                print("[ERROR] Cookie已失效!")
-                print("=" * 50)
-                
-                if auto_refresh_cookie:
-                    print("\n[INFO] 正在启动Cookie刷新工具...")
-                    try:
-                        import subprocess
-                        import sys
-                        
-                        # 获取cookie_refresher.py的路径
-                        refresher_path = os.path.join(os.path.dirname(__file__), '工具脚本', 'cookie_refresher.py')
-                        if not os.path.exists(refresher_path):
-                            refresher_path = os.path.join(os.path.dirname(__file__), 'cookie_refresher.py')
-                        
-                        # 调用cookie刷新工具（使用--auto模式，不等待用户输入）
-                        result = subprocess.run([sys.executable, refresher_path, '--auto'], 
-                                              cwd=os.path.dirname(__file__))
-                        
-                        if result.returncode == 0:
-                            print("\n[OK] Cookie刷新完成，重新加载配置...")
-                            # 重新加载配置
-                            new_config = load_config()
-                            # 递归调用，但禁用自动刷新避免无限循环
-                            return fetch_logs(new_config, start_time, end_time, auto_refresh_cookie=False)
-                        else:
-                            print("[FAIL] Cookie刷新失败")
-                    except Exception as e:
-                        print(f"[FAIL] 无法启动Cookie刷新工具: {e}")
-                
-                print("\n请手动运行以下命令刷新Cookie:")
-                print("   python 工具脚本/cookie_refresher.py")
-                print("\n或者手动更新 config.json 中的 cookie 值")
-                print("=" * 50)
-                return []
-            
-            response.raise_for_status()
-            data = response.json()
-            
-            if data['Code'] != 1:
-                print(f"Error from API: {data['Message']}")
-                break
-                
-            feeds = data.get('Data', {}).get('feeds', [])
-            if not feeds:
-                break
-                
-            all_logs.extend(feeds)
-            
-            if len(feeds) < page_size:
+        data = load(page_num)
+
+        # 重试耗尽的页跳过继续往后翻；连续多页失败说明上游不可用，停止
+        if data is None:
+            lost_in_row += 1
+            if lost_in_row >= MAX_CONSECUTIVE_LOST_PAGES:
                 break
-                
             page_num += 1
-            time.sleep(1) 
-            
-        except Exception as e:
-            print(f"Request failed: {e}")
+            continue
+        lost_in_row = 0
+
+        feeds = data.get('feeds', [])
+        if not feeds:
+            break
+
+        yield feeds
+
+        if _is_last_page(feeds, known_feeds):
             break
-            
-    return all_logs
+
+        page_num += 1
+
+def _iter_pages_concurrent(load, concurrency, known_feeds=None):
+    """
+    先取第1页确定总页数，其余页并发拉取，按页码顺序产出
+    增量模式下按窗口拉取，以便遇到整页已知日报时尽早停止
+    """
+    first = load(1)
+    if first is None:
+        return
+
+    first_feeds = first.get('feeds', [])
+    yield first_feeds
+    if _is_last_page(first_feeds, known_feeds):
+        return
+
+    total_pages = get_total_pages(first)
+
+    def load_indexed(page_num):
+        data = load(page_num)
+        return page_num, None if data is None else data.get('feeds', [])
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        if total_pages is not None and known_feeds is None:
+            print(f"Total pages: {total_pages}, fetching with concurrency {concurrency}...")
+            for page_num, feeds in executor.map(load_indexed, range(2, total_pages + 1)):
+                if feeds:
+                    yield feeds
+        else:
+            # 接口未返回总数或增量模式：按窗口批量预取，遇到最后一页即停止
+            next_page = 2
+            while True:
+                last_page = total_pages if total_pages is not None else next_page + concurrency - 1
+                window = range(next_page, min(next_page + concurrency, last_page + 1))
+                results = list(executor.map(load_indexed, window))
+                for page_num, feeds in results:
+                    if feeds:
+                        yield feeds
+                if any(feeds is not None and _is_last_page(feeds, known_feeds) for _, feeds in results):
+                    break
+                # 整个窗口都失败说明上游不可用，停止
+                if all(feeds is None for _, feeds in results):
+                    break
+                next_page += concurrency
+                if total_pages is not None and next_page > total_pages:
+                    break
+
+def _run_cookie_refresher(auto_refresh_cookie):
+    """Cookie 失效时调用刷新工具，成功返回重新加载的配置，否则返回 None"""
+    print("\n" + "=" * 50)
+    print("[ERROR] Cookie已失效!")
+    print("=" * 50)
+
+    if auto_refresh_cookie:
+        print("\n[INFO] 正在启动Cookie刷新工具...")
+        try:
+            import subprocess
+            import sys
+
+            # 获取cookie_refresher.py的路径
+            refresher_path = os.path.join(os.path.dirname(__file__), '工具脚本', 'cookie_refresher.py')
+            if not os.path.exists(refresher_path):
+                refresher_path = os.path.join(os.path.dirname(__file__), 'cookie_refresher.py')
+
+            # 调用cookie刷新工具（使用--auto模式，不等待用户输入）
+            result = subprocess.run([sys.executable, refresher_path, '--auto'],
+                                  cwd=os.path.dirname(__file__))
+
+            if result.returncode == 0:
+                print("\n[OK] Cookie刷新完成，重新加载配置...")
+                return load_config()
+            else:
+                print("[FAIL] Cookie刷新失败")
+        except Exception as e:
+            print(f"[FAIL] 无法启动Cookie刷新工具: {e}")
+
+    print("\n请手动运行以下命令刷新Cookie:")
+    print("   python 工具脚本/cookie_refresher.py")
+    print("\n或者手动更新 config.json 中的 cookie 值")
+    print("=" * 50)
+    return None
+
+# 多个线程（如 backfill 并行回填的各天）同时遇到 Cookie 失效时只运行一次刷新工具
+_cookie_refresh_lock = threading.Lock()
+_cookie_refresh = {'generation': 0, 'config': None}
+
+def cookie_generation():
+    """当前的 Cookie 刷新代数，拉取开始前记下，刷新时传给 refresh_cookie_shared"""
+    return _cookie_refresh['generation']
+
+def refresh_cookie_shared(generation, auto_refresh_cookie):
+    """
+    在全局锁内刷新 Cookie，返回重新加载的配置，刷新失败返回 None
+    generation 之后已有其他线程刷新过时不再启动刷新工具，直接复用那次的结果
+    """
+    with _cookie_refresh_lock:
+        if _cookie_refresh['generation'] == generation:
+            _cookie_refresh['config'] = _run_cookie_refresher(auto_refresh_cookie)
+            _cookie_refresh['generation'] += 1
+        return _cookie_refresh['config']
+
+def iter_fetch_logs(config, start_time, end_time, known_feeds=None, department_ids=None, stats=None):
+    """
+    按页码顺序逐页产出时间范围内的日报列表，拉到一页即产出一页
+    config['fetch'] 控制并发度与每秒请求数，concurrency=1 时退化为逐页拉取
+    known_feeds（feedId -> 指纹）不为 None 时为增量模式：某页全部是已知且未修改的日报即停止翻页
+    department_ids 不为空时由 Tita 服务端按部门过滤
+    stats（可选 dict）会填入 pages_fetched / page_retries / pages_lost
+    单页失败时按指数退避重试；遇到 429/5xx 时自适应降低请求速率
+    Cookie 失效时抛出 CookieExpiredError，由调用方处理
+    """
+    fetch_config = config.get('fetch', {})
+    concurrency = fetch_config.get('concurrency', DEFAULT_FETCH_CONCURRENCY)
+    limiter = get_shared_limiter('tita', fetch_config.get('requests_per_second', DEFAULT_FETCH_RPS),
+                                 adaptive=True)
+    if stats is None:
+        stats = new_fetch_stats()
+
+    def load_page(page_num):
+        return fetch_page(config, page_num, start_time, end_time, department_ids=department_ids)
+
+    load = _make_page_loader(load_page, limiter, stats,
+                             fetch_config.get('max_retries', DEFAULT_FETCH_MAX_RETRIES),
+                             fetch_config.get('backoff_base', DEFAULT_FETCH_BACKOFF_BASE),
+                             fetch_config.get('backoff_max', DEFAULT_FETCH_BACKOFF_MAX))
+
+    if concurrency > 1:
+        yield from _iter_pages_concurrent(load, concurrency, known_feeds)
+    else:
+        yield from _iter_pages_serial(load, known_feeds)
+
+    stats['pages_lost'].sort()
+    print(f"Pages fetched: {stats['pages_fetched']}, retries: {stats['page_retries']}, "
+          f"lost: {len(stats['pages_lost'])}" + (f" {stats['pages_lost']}" if stats['pages_lost'] else ""))
+
+def iter_day_feeds(config, start_time, end_time, known_feeds=None, department_ids=None, stats=None,
+                   auto_refresh_cookie=True, quiet_if_empty=False):
+    """
+    逐条产出去重后的日报，供流水线作为数据源
+    Cookie 失效时刷新后从头重新翻页（多线程共用一次刷新，见 refresh_cookie_shared），已产出过的日报不会重复产出
+    刷新失败时 stats['cookie_failed'] 记为 True 并抛出 CookieExpiredError，调用方据此区分 Cookie 失效与当天没有日报；
+    quiet_if_empty=True 且尚未产出任何日报时改为静默结束
+    """
+    if stats is None:
+        stats = new_fetch_stats()
+    seen_ids = set()
+    yielded = 0
+
+    while True:
+        generation = cookie_generation()
+        try:
+            for feeds in iter_fetch_logs(config, start_time, end_time, known_feeds, department_ids, stats):
+                for feed in feeds:
+                    feed_id = feed.get('feedId')
+                    if feed_id:
+                        if feed_id in seen_ids:
+                            continue
+                        seen_ids.add(feed_id)
+                    yielded += 1
+                    yield feed
+            return
+        except CookieExpiredError:
+            config = refresh_cookie_shared(generation, auto_refresh_cookie)
+            if config is None:
+                stats['cookie_failed'] = True
+                if quiet_if_empty and not yielded:
+                    return
+                raise
+            auto_refresh_cookie = False
+
+def fetch_logs(config, start_time, end_time, auto_refresh_cookie=True, known_feeds=None,
+               department_ids=None, stats=None):
+    """
+    拉取时间范围内的全部日报，返回去重后的列表（iter_day_feeds 的列表形式）
+    Cookie 失效且刷新失败时返回空列表；已拉到部分日报后才失效则抛出 CookieExpiredError
+    """
+    return list(iter_day_feeds(config, start_time, end_time, known_feeds=known_feeds,
+                               department_ids=department_ids, stats=stats,
+                               auto_refresh_cookie=auto_refresh_cookie, quiet_if_empty=True))
+
+def learn_department_ids(conn, feeds):
+    """从日报的发布人信息中记录 部门名称 -> 部门ID"""
+    pairs = {}
+    for feed in feeds:
+        user_info = feed.get('publishUser', {}) or {}
+        dept_name = str(user_info.get('departmentName', '') or '')
+        dept_id = next((user_info[k] for k in DEPARTMENT_ID_KEYS if user_info.get(k)), None)
+        if dept_name and dept_id:
+            pairs[dept_name] = str(dept_id)
+
+    if pairs:
+        c = conn.cursor()
+        c.executemany('''
+            INSERT INTO department_ids (department_name, department_id) VALUES (?, ?)
+            ON CONFLICT(department_name) DO UPDATE SET
+                department_id = excluded.department_id,
+                updated_at = CURRENT_TIMESTAMP
+        ''', list(pairs.items()))
+        conn.commit()
+    return pairs
+
+def resolve_department_ids(conn, config):
+    """
+    将 target_departments 中的部门名称解析为 Tita 部门ID
+    优先使用 config['department_filter']['ids'] 中手工配置的映射，其次是 department_ids 缓存表
+    任一部门无法解析或关闭了服务端过滤时返回 None，此时全量拉取后按名称过滤
+    """
+    dept_filter = config.get('department_filter', {})
+    if not dept_filter.get('server_side', True):
+        return None
+
+    targets = [str(t) for t in config['target_departments']]
+    if not targets:
+        return None
+    explicit = dept_filter.get('ids', {})
+
+    c = conn.cursor()
+    c.execute(f'''
+        SELECT department_name, department_id FROM department_ids
+        WHERE department_name IN ({','.join('?' * len(targets))})
+    ''', targets)
+    cached = dict(c.fetchall())
+
+    ids = []
+    for name in targets:
+        dept_id = explicit.get(name) or cached.get(name)
+        if not dept_id:
+            return None
+        ids.append(str(dept_id))
+    return ids
 
 def filter_logs(logs, target_departments):
     filtered = []
@@ -158,22 +682,45 @@ def filter_logs(logs, target_departments):
             filtered.append(log)
     return filtered
 
-def analyze_log_content(content, config):
+def build_log_content(log):
+    """将 Tita 日报的各个板块拼接成分析用的正文"""
+    raw_content_parts = []
+    for item in log.get('dailyContent', []) or []:
+        title = item.get('title', '')
+        text = item.get('content', '')
+        if text and text.strip() != "":
+            if title == "今日 OKR 进展":
+                try:
+                    okr_data = json.loads(text)
+                    okr_names = [row['Name'] for row in okr_data.get('Rows', [])]
+                    text = "\n".join([f"- {name}" for name in okr_names])
+                except:
+                    pass
+            raw_content_parts.append(f"**{title}**:\n{text}")
+
+    return "\n\n".join(raw_content_parts)
+
+def prefiltered_analysis(content, config):
+    """没有业务内容（空或只有 OKR 模板）的日报直接返回全空分类结果，不调用 LLM；否则返回 None"""
+    if is_template_only(content, config):
+        return empty_analysis(config.get('analysis_categories', []))
+    return None
+
+def analyze_log_content(content, config, tier=None):
+    """
+    单篇分类分析；开启 llm.routing 时按正文选择 cheap / strong 档（见 model_router），
+    cheap 档请求失败或回复无法解析时升级到 strong 档重跑
+    """
     api_key = config.get('volcengine_api_key')
-    endpoint_id = config.get('volcengine_endpoint_id')
     categories = config.get('analysis_categories')
     
     if not api_key or "PLEASE_ENTER" in api_key:
         print("Warning: No Volcano Engine API Key provided. Skipping analysis.")
         return {cat: "" for cat in categories}
 
-    url = "https://ark.cn-beijing.volces.com/api/v3/chat/completions"
-    
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {api_key}"
-    }
-    
+    tier = tier or select_tier(content, config)
+    endpoint_id = endpoint_for(tier, config)
+
     prompt = f"""
     你是一个专业的日志分析助手。请分析以下“日志原文”，并提取信息归类到以下类别中：
     {', '.join(categories)}
@@ -185,62 +732,529 @@ def analyze_log_content(content, config):
     {content}
     """
     
-    payload = {
-        "model": endpoint_id,
-        "messages": [
-            {"role": "system", "content": "You are a helpful assistant that outputs raw JSON."},
-            {"role": "user", "content": prompt}
-        ],
-        "temperature": 0.1
-    }
+    messages = [
+        {"role": "system", "content": "You are a helpful assistant that outputs raw JSON."},
+        {"role": "user", "content": prompt}
+    ]
+
+    schema = category_schema(categories)
+
+    def parse(content_str):
+        return parse_structured(content_str, schema)
     
     try:
-        response = requests.post(url, headers=headers, json=payload, timeout=30)
-        response.raise_for_status()
-        res_json = response.json()
-        
-        content_str = res_json['choices'][0]['message']['content']
-        content_str = content_str.replace('```json', '').replace('```', '').strip()
-        
-        return json.loads(content_str)
+        # 相同正文与提示词命中本地缓存时不再请求；多个分析线程共用 llm_client 中的速率上限
+        analysis, problems = chat_completion(messages, model=endpoint_id, api_key=api_key, config=config,
+                                             temperature=0.1, timeout=30, parse=parse, caller='daily_analysis')
     except Exception as e:
+        if tier == TIER_CHEAP:
+            return analyze_log_content(content, config, escalate('分类失败'))
         print(f"LLM Analysis failed: {e}")
-        return {cat: "分析失败" for cat in categories}
+        return {cat: ANALYSIS_FAILED for cat in categories}
 
-def generate_report(logs_with_analysis, date_str, config):
-    report_lines = []
-    report_lines.append(f"# 日报汇总 - {date_str}")
-    report_lines.append(f"生成时间: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-    report_lines.append(f"共筛选出 {len(logs_with_analysis)} 条记录")
-    report_lines.append("")
+    if problems:
+        analysis.update(fill_missing_categories(content, [p[0] for p in problems], config, endpoint_id))
+    return analysis
+
+def fill_missing_categories(content, missing, config, endpoint_id=None):
+    """
+    只针对缺失或无效的类别追问一次，仍然拿不到的类别记为分析失败
+    endpoint_id 为原请求所用的 Endpoint（见 model_router），未指定时使用 volcengine_endpoint_id
+    """
+    prompt = f"""
+    你是一个专业的日志分析助手。请只分析以下“日志原文”中与这些类别相关的信息：
+    {', '.join(missing)}
+
+    如果某个类别没有相关信息，请返回空字符串。
+    请直接返回一个标准的JSON格式对象，键为上述类别名，不要包含Markdown格式，也不要包含其他解释语。
     
-    for idx, item in enumerate(logs_with_analysis, 1):
-        log = item['original_log']
-        analysis = item['analysis']
+    日志原文：
+    {content}
+    """
+    messages = [
+        {"role": "system", "content": "You are a helpful assistant that outputs raw JSON."},
+        {"role": "user", "content": prompt}
+    ]
+    schema = category_schema(missing)
+    try:
+        filled, _ = chat_completion(messages, model=endpoint_id or config.get('volcengine_endpoint_id'),
+                                    api_key=config.get('volcengine_api_key'), config=config, temperature=0.1,
+                                    timeout=30, parse=lambda c: parse_structured(c, schema),
+                                    caller='daily_repair')
+    except Exception as e:
+        print(f"LLM Analysis follow-up failed: {e}")
+        filled = {}
+    return {cat: filled.get(cat, ANALYSIS_FAILED) for cat in missing}
+
+def analyze_log_combined(content, config, system_prompt, tier=None):
+    """
+    合并分析：一次调用同时得到分类结果与 v3 事件（config['analysis']['mode'] 为 "combined" 时使用）
+    system_prompt 由 extract_events_v3.build_combined_prompt 构建，每天只构建一次
+    返回 (analysis, events)；事件部分无法得到时 events 为 None，留给 extract_events_v3 补抽
+    cheap 档失败或事件置信度过低时升级到 strong 档重跑（见 model_router）
+    """
+    api_key = config.get('volcengine_api_key')
+    categories = config.get('analysis_categories')
+    if not api_key or "PLEASE_ENTER" in api_key:
+        return analyze_log_content(content, config), None
+
+    tier = tier or select_tier(content, config)
+    endpoint_id = endpoint_for(tier, config)
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": f"日报内容：\n{content}"}
+    ]
+    try:
+        result, _ = chat_completion(messages, model=endpoint_id, api_key=api_key,
+                                    config=config, temperature=0.1, timeout=90, cache_prefix=True,
+                                    parse=lambda c: parse_structured(c, {'type': 'object'}),
+                                    caller='daily_combined')
+    except Exception as e:
+        if tier == TIER_CHEAP:
+            return analyze_log_combined(content, config, system_prompt, escalate('合并分析失败'))
+        print(f"Combined analysis failed: {e}")
+        return {cat: ANALYSIS_FAILED for cat in categories}, None
+
+    analysis = result.get('analysis')
+    if not isinstance(analysis, dict):
+        analysis = {}
+    analysis, problems = conform(analysis, category_schema(categories))
+    if problems:
+        analysis.update(fill_missing_categories(content, [p[0] for p in problems], config, endpoint_id))
+
+    events = result.get('events')
+    if not isinstance(events, list):
+        return analysis, None
+    # 先归一字段再判断置信度，与 extract_events_v3.call_llm_extraction 的顺序一致
+    events = extractor.complete_events(content, events, config, endpoint_id)
+    if tier == TIER_CHEAP and low_confidence(events, config):
+        return analyze_log_combined(content, config, system_prompt, escalate('低置信度'))
+    return analysis, events
+
+def estimate_tokens(text):
+    """粗略估算 token 数：中日韩字符按 1 个计，其余按 4 个字符 1 个计"""
+    cjk = sum(1 for ch in text if '\u2e80' <= ch <= '\u9fff' or '\uac00' <= ch <= '\ud7af')
+    return cjk + (len(text) - cjk) // 4 + 1
+
+def pack_batches(docs, max_logs=DEFAULT_BATCH_MAX_LOGS, token_budget=DEFAULT_BATCH_TOKEN_BUDGET):
+    """按条数与 token 预算把 [(doc_id, content)] 切成若干批，超出预算的单篇日报单独成批"""
+    batches = []
+    current, used = [], 0
+    for doc_id, content in docs:
+        tokens = estimate_tokens(content)
+        if current and (len(current) >= max_logs or used + tokens > token_budget):
+            batches.append(current)
+            current, used = [], 0
+        current.append((doc_id, content))
+        used += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+def _parse_batch_result(content_str):
+    """解析批量分析结果，统一成 {日志ID: 分类结果}"""
+    parsed = repair_json(content_str)
+    if isinstance(parsed, list):
+        parsed = {str(item.get('id')): item.get('analysis', item) for item in parsed if isinstance(item, dict)}
+    if not isinstance(parsed, dict):
+        raise ValueError("批量分析结果不是JSON对象")
+    return {str(k): v for k, v in parsed.items() if isinstance(v, dict)}
+
+def _analyze_group(group, config, tier=TIER_STRONG):
+    """
+    分析一批日报；整体解析失败时对半拆分重试，缺失的日志单独补请求，单篇时退回逐条分析
+    cheap 档整批失败时升级到 strong 档重跑这一批
+    """
+    if len(group) == 1:
+        doc_id, content = group[0]
+        return {doc_id: analyze_log_content(content, config, tier)}
+
+    categories = config.get('analysis_categories')
+    docs_text = "\n\n".join(f"<<<{doc_id}>>>\n{content}" for doc_id, content in group)
+    prompt = f"""
+    你是一个专业的日志分析助手。下面有 {len(group)} 篇“日志原文”，每篇以 <<<日志ID>>> 开头。
+    请分别分析每一篇，并把信息归类到以下类别中：
+    {', '.join(categories)}
+
+    如果某个类别没有相关信息，请返回空字符串。
+    请直接返回一个标准的JSON格式对象，键为日志ID（不含尖括号），值为该篇日志的分类结果对象，
+    例如 {{"日志ID": {{"类别": "内容"}}}}。不要包含Markdown格式，也不要包含其他解释语。
+
+    {docs_text}
+    """
+    messages = [
+        {"role": "system", "content": "You are a helpful assistant that outputs raw JSON."},
+        {"role": "user", "content": prompt}
+    ]
+
+    endpoint_id = endpoint_for(tier, config)
+    try:
+        parsed = chat_completion(messages, model=endpoint_id,
+                                 api_key=config.get('volcengine_api_key'), config=config,
+                                 temperature=0.1, timeout=90, parse=_parse_batch_result, caller='daily_batch')
+    except Exception as e:
+        if tier == TIER_CHEAP:
+            return _analyze_group(group, config, escalate('批量分析失败'))
+        if isinstance(e, CircuitOpenError):
+            # 熔断期间不再拆分重试，整批记为失败，由失败队列稍后重试
+            print(f"Batch analysis skipped: {e}")
+            return {doc_id: {cat: ANALYSIS_FAILED for cat in categories} for doc_id, _ in group}
+        print(f"Batch analysis of {len(group)} logs failed: {e}, splitting and retrying...")
+        parsed = {}
+
+    results = {doc_id: parsed[doc_id] for doc_id, _ in group if doc_id in parsed}
+    # 个别类别缺失的日志只追问缺失的类别
+    schema = category_schema(categories)
+    for doc_id, content in group:
+        if doc_id in results:
+            results[doc_id], problems = conform(results[doc_id], schema)
+            if problems:
+                results[doc_id].update(fill_missing_categories(content, [p[0] for p in problems], config,
+                                                               endpoint_id))
+    missing = [doc for doc in group if doc[0] not in results]
+    if len(missing) == len(group):
+        half = len(group) // 2
+        results.update(_analyze_group(group[:half], config, tier))
+        results.update(_analyze_group(group[half:], config, tier))
+    elif missing:
+        results.update(_analyze_group(missing, config, tier))
+    return results
+
+def analyze_log_batch(docs, config):
+    """
+    批量分析：把多篇日报按 config['analysis'] 的 max_batch_logs / batch_token_budget 合并成少量请求，
+    分类说明只发送一次。docs 为 [(doc_id, content)]，doc_id 在拆分重试中保持不变
+    开启 llm.routing 时日报先按档位分组，cheap 档与 strong 档分别打包请求
+    返回 {doc_id: analysis}，每篇的结果格式与 analyze_log_content 相同
+    """
+    api_key = config.get('volcengine_api_key')
+    if not api_key or "PLEASE_ENTER" in api_key:
+        return {doc_id: analyze_log_content(content, config) for doc_id, content in docs}
+
+    by_tier = {}
+    for doc_id, content in docs:
+        by_tier.setdefault(select_tier(content, config), []).append((doc_id, content))
+
+    analysis_config = config.get('analysis', {})
+    results = {}
+    for tier, tier_docs in by_tier.items():
+        for group in pack_batches(tier_docs, analysis_config.get('max_batch_logs', DEFAULT_BATCH_MAX_LOGS),
+                                  analysis_config.get('batch_token_budget', DEFAULT_BATCH_TOKEN_BUDGET)):
+            results.update(_analyze_group(group, config, tier))
+    return results
+
+def feed_to_row(log, date_str, full_content, full_content_hash=None):
+    """Tita 日报 -> daily_logs 行数据"""
+    user_info = log.get('publishUser', {})
+    return {
+        'feed_id': log.get('feedId', ''),
+        'user_id': str(user_info.get('userId', '')),
+        'user_name': user_info.get('name', 'Unknown'),
+        'department': user_info.get('departmentName', ''),
+        'log_date': date_str,
+        'content': full_content,
+        'content_hash': full_content_hash or content_hash(full_content)
+    }
+
+def record_fetched_feeds(conn, date_str, all_logs):
+    """分析完成后统一记录：部门ID缓存、原始日报归档、增量台账"""
+    learn_department_ids(conn, all_logs)
+    archive_feeds(conn, date_str, all_logs)
+    # 分析完成后再记账，中途失败的日报下次仍会被分析
+    record_ledger(conn, date_str, all_logs)
+
+def earlier_saved_logs(conn, date_str, seen, stats):
+    """增量模式提前停止翻页时，之前已入库、本次未拉到（feedId 不在 seen 中）的日报，保证当天报告完整"""
+    earlier = load_saved_logs(conn, date_str, exclude_feed_ids=seen)
+    stats['skipped'] += len(earlier)
+    return earlier
+
+def append_earlier_logs(conn, date_str, processed, stats):
+    """earlier_saved_logs 的列表形式：补到 processed 末尾"""
+    seen = {str(item['original_log'].get('feedId', '')) for item in processed}
+    processed.extend(earlier_saved_logs(conn, date_str, seen, stats))
+
+def process_feeds(config, date_str, conn, feeds, reuse_analysis=None, save_reused=False, on_progress=None):
+    """
+    将一批 Tita 日报整理、分析并写入 daily_logs
+    reuse_analysis(feed) 返回 True 且正文哈希与已入库记录一致时复用已保存的分析结果，不调用 LLM；
+    正文变化的日报重新分析，旧分析保留在 prev_analysis_json
+    save_reused=True 时复用分析的日报也会用最新正文重写入库（用于从归档重建）
+    返回 (processed, stats)
+    """
+    stats = {'analyzed': 0, 'skipped': 0, 'edited': 0, 'prefiltered': 0}
+    processed = []
+    saved = load_saved_analyses(conn, date_str) if reuse_analysis else {}
+
+    for idx, log in enumerate(feeds):
         user_name = log.get('publishUser', {}).get('name', 'Unknown')
-        
-        full_content = item['full_content']
-        
-        report_lines.append(f"## {idx}. {user_name}")
-        report_lines.append("### 日志原文")
-        report_lines.append(full_content)
-        report_lines.append("")
-        report_lines.append("### 日志分析")
-        
-        if isinstance(analysis, dict):
-            for category, val in analysis.items():
-                if val:
-                    report_lines.append(f"- **{category}**: {val}")
+        feed_id = log.get('feedId', '')
+
+        if on_progress:
+            on_progress(idx + 1, len(feeds), user_name)
+
+        full_content = build_log_content(log)
+        full_content_hash = content_hash(full_content)
+
+        analysis = None
+        if reuse_analysis and reuse_analysis(log):
+            analysis, edited = reusable_analysis(saved, feed_id, full_content_hash)
+            if edited:
+                stats['edited'] += 1
+
+        reused = analysis is not None
+        if reused:
+            stats['skipped'] += 1
         else:
-            report_lines.append(f"- 分析结果格式错误: {analysis}")
-        
-        report_lines.append("\n---\n")
-        
+            analysis = prefiltered_analysis(full_content, config)
+            if analysis is not None:
+                stats['prefiltered'] += 1
+            else:
+                print(f"Analyzing log for {user_name}...")
+                analysis = analyze_log_content(full_content, config)
+            stats['analyzed'] += 1
+
+        if not reused or save_reused:
+            save_log_to_db(conn, feed_to_row(log, date_str, full_content, full_content_hash), analysis)
+
+        processed.append({
+            'original_log': log,
+            'full_content': full_content,
+            'analysis': analysis
+        })
+
+    return processed, stats
+
+def iter_ingest_day(config, date_str, conn, incremental=None, on_progress=None, stats=None):
+    """
+    流式拉取、分析并保存某一天的日报，逐条产出 {'original_log', 'full_content', 'analysis'}
+    拉取页 → 整理正文 → LLM 分析 → 入库 各阶段由有界队列连接并行推进：
+    第1页的日报在后续页仍在拉取时就开始分析，内存占用只取决于队列长度，与日报总数无关
+    LLM 分析由 config['analysis']['workers'] 个线程并行执行，整体不超过 config['analysis']['qps']；
+    config['analysis']['batch'] 为 true 时每次把已就绪的多篇日报合并成一个请求（见 analyze_log_batch）；
+    config['analysis']['mode'] 为 "combined" 时一次调用同时得到分类结果与 v3 事件（见 analyze_log_combined），
+    事件随日报一起写入 events_v3（单跑，标记为 pending），优先于 batch；
+    分析结果完成一条入库一条，产出顺序仍与 Tita 返回顺序一致
+    正文规范化哈希（content_hash）与已入库记录一致且已有分析结果的日报直接复用，不再调用 LLM；
+    正文被修改过的日报重新分析，旧分析保留在 prev_analysis_json
+    incremental（默认读 config['incremental']，缺省开启）时翻页遇到整页已知且内容指纹未变的日报即停止
+    拉取到的原始日报会压缩归档到 raw_feeds，供 replay_feeds.py 离线重放
+    on_progress(current, total, user_name) 在每条日报处理完成后回调，total 为目前已发现的目标日报数
+    stats（可选 dict）会填入 fetched / filtered / analyzed / skipped / edited / events / prefiltered 及拉取统计
+    没有业务内容的日报（见 content_filter）记录全空分类结果，不调用 LLM，计入 prefiltered
+    """
+    if incremental is None:
+        incremental = config.get('incremental', True)
+    if stats is None:
+        stats = {}
+    stats.update({'fetched': 0, 'filtered': 0, 'analyzed': 0, 'skipped': 0, 'edited': 0, 'events': 0,
+                  'prefiltered': 0})
+    fetch_stats = new_fetch_stats()
+    stats.update(fetch_stats)
+
+    start_time = f"{date_str} 00:00:00"
+    end_time = f"{date_str} 23:59:59"
+
+    # 入库之外的阶段运行在其他线程，需要的数据库内容提前读出
+    known_feeds = load_ledger(conn, date_str) if incremental else None
+    saved = load_saved_analyses(conn, date_str)
+    targets = config['target_departments']
+
+    # 能解析出部门ID时由服务端过滤，否则全量拉取；名称过滤始终保留作兜底
+    department_ids = resolve_department_ids(conn, config)
+    if department_ids is None:
+        print("Department IDs not resolved yet, fetching all departments and filtering by name")
+
+    def normalize(log):
+        dept_name = str(log.get('publishUser', {}).get('departmentName', ''))
+        item = {'seq': stats['fetched'], 'log': log, 'target': dept_name in targets,
+                'analysis': None, 'analyzed': False, 'events': None}
+        stats['fetched'] += 1
+        if item['target']:
+            stats['filtered'] += 1
+            item['full_content'] = build_log_content(log)
+            item['content_hash'] = content_hash(item['full_content'])
+            item['analysis'], item['edited'] = reusable_analysis(saved, log.get('feedId', ''),
+                                                                 item['content_hash'])
+            if item['analysis'] is None:
+                item['analysis'] = prefiltered_analysis(item['full_content'], config)
+                if item['analysis'] is not None:
+                    item['analyzed'] = True
+                    stats['prefiltered'] += 1
+        return item
+
+    def analyze(item):
+        if item['target'] and item['analysis'] is None:
+            print(f"Analyzing log for {item['log'].get('publishUser', {}).get('name', 'Unknown')}...")
+            item['analysis'] = analyze_log_content(item['full_content'], config)
+            item['analyzed'] = True
+        return item
+
+    def analyze_combined(item):
+        if item['target'] and item['analysis'] is None:
+            print(f"Analyzing log for {item['log'].get('publishUser', {}).get('name', 'Unknown')} (combined)...")
+            item['analysis'], item['events'] = analyze_log_combined(item['full_content'], config, combined_prompt)
+            item['analyzed'] = True
+        return item
+
+    def analyze_batch(items):
+        todo = [item for item in items if item['target'] and item['analysis'] is None]
+        if todo:
+            print(f"Analyzing {len(todo)} logs in batch mode...")
+            docs = [(str(item['log'].get('feedId') or item['seq']), item['full_content']) for item in todo]
+            results = analyze_log_batch(docs, config)
+            for (doc_id, _), item in zip(docs, todo):
+                item['analysis'] = results[doc_id]
+                item['analyzed'] = True
+        return items
+
+    source = iter_day_feeds(config, start_time, end_time, known_feeds=known_feeds,
+                            department_ids=department_ids, stats=fetch_stats)
+    analysis_config = config.get('analysis', {})
+    workers = analysis_config.get('workers', DEFAULT_ANALYSIS_WORKERS)
+    combined = analysis_config.get('mode', 'split') == 'combined'
+    if combined and not extractor.events_table_exists(conn):
+        print("Warning: events_v3 table not found, run upgrade_schema_v3.py first; falling back to split analysis")
+        combined = False
+    if combined:
+        # 提示词每天只构建一次，所有日报共用同一份前缀
+        combined_prompt = extractor.build_combined_prompt(extractor.load_business_knowledge(),
+                                                          extractor.load_taxonomy(conn),
+                                                          config['analysis_categories'])
+        stages = [('normalize', normalize, 1), ('analyze', analyze_combined, workers)]
+    elif analysis_config.get('batch'):
+        # 批量模式：worker 一次取走队列中已就绪的多篇日报，合并成少量请求
+        stages = [('normalize', normalize, 1),
+                  ('analyze', analyze_batch, workers, analysis_config.get('max_batch_logs', DEFAULT_BATCH_MAX_LOGS))]
+    else:
+        stages = [('normalize', normalize, 1), ('analyze', analyze, workers)]
+    queue_size = config.get('pipeline', {}).get('queue_size', DEFAULT_QUEUE_SIZE)
+
+    # 入库与产出在调用方线程进行，独占数据库连接
+    pending = []
+    seen = set()
+    done = 0
+    reorder = {}
+    next_seq = 0
+    try:
+        for item in run_pipeline(source, stages, queue_size=queue_size):
+            log = item['log']
+            # 分析结果乱序到达：先入库并上报进度，再按原顺序产出
+            if item['target']:
+                if item['analyzed']:
+                    save_log_to_db(conn, feed_to_row(log, date_str, item['full_content'], item['content_hash']),
+                                   item['analysis'])
+                    if item['events']:
+                        # 没有得到事件的日报留给 extract_events_v3.py 按双跑补抽
+                        saved_events, _ = extractor.save_events_v3(conn, str(log.get('feedId', '')), date_str,
+                                                                   item['events'], item['events'], None, False)
+                        stats['events'] += saved_events
+                    stats['analyzed'] += 1
+                    if item['edited']:
+                        stats['edited'] += 1
+                else:
+                    stats['skipped'] += 1
+                done += 1
+                if on_progress:
+                    on_progress(done, stats['filtered'], log.get('publishUser', {}).get('name', 'Unknown'))
+
+            reorder[item['seq']] = item
+            while next_seq in reorder:
+                item = reorder.pop(next_seq)
+                next_seq += 1
+                log = item['log']
+                pending.append(log)
+                if item['target']:
+                    seen.add(str(log.get('feedId', '')))
+                    yield {'original_log': log, 'full_content': item['full_content'], 'analysis': item['analysis']}
+
+                # 分析入库完成后再记账，中途失败的日报下次仍会被分析
+                if len(pending) >= PAGE_SIZE:
+                    record_fetched_feeds(conn, date_str, pending)
+                    pending = []
+    finally:
+        if pending:
+            record_fetched_feeds(conn, date_str, pending)
+        stats.update(fetch_stats)
+
+    if incremental:
+        yield from earlier_saved_logs(conn, date_str, seen, stats)
+
+def ingest_day(config, date_str, conn, incremental=None, on_progress=None):
+    """
+    拉取、分析并保存某一天的日报，参数见 iter_ingest_day
+    返回 (processed, stats)
+    """
+    stats = {}
+    processed = list(iter_ingest_day(config, date_str, conn, incremental=incremental,
+                                     on_progress=on_progress, stats=stats))
+    return processed, stats
+
+def generate_report(logs_with_analysis, date_str, config, stats=None):
+    """
+    写出 Markdown 报告，logs_with_analysis 可以是列表或 iter_ingest_day 这样的生成器
+    正文边处理边写入临时文件，最后补上条数写成正式报告；返回报告条数
+    传入 stats 时，遍历结束后 stats['fetched'] 为 0（Cookie 失效、Tita 故障等）则丢弃临时文件，
+    不覆盖已有报告；遍历中途出错时同样不覆盖
+    """
     output_filename = f"daily_report_{date_str}.md"
+    body_filename = output_filename + ".part"
+
+    count = 0
+    try:
+        with open(body_filename, 'w', encoding='utf-8') as body:
+            for count, item in enumerate(logs_with_analysis, 1):
+                body.write("\n".join(format_report_item(count, item)) + "\n")
+    except BaseException:
+        os.remove(body_filename)
+        raise
+
+    if stats is not None and not stats.get('fetched'):
+        os.remove(body_filename)
+        print(f"No logs fetched for {date_str}, keeping existing report (if any)")
+        return 0
+
+    report_lines = []
+    report_lines.append(f"# 日报汇总 - {date_str}")
+    report_lines.append(f"生成时间: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    report_lines.append(f"共筛选出 {count} 条记录")
+    report_lines.append("")
+
     with open(output_filename, 'w', encoding='utf-8') as f:
         f.write("\n".join(report_lines))
-    
+        if count:
+            f.write("\n")
+        with open(body_filename, 'r', encoding='utf-8') as body:
+            shutil.copyfileobj(body, f)
+    os.remove(body_filename)
+
     print(f"Report generated: {output_filename}")
+    return count
+
+def format_report_item(idx, item):
+    """单条日报在报告中的 Markdown 行"""
+    report_lines = []
+    log = item['original_log']
+    analysis = item['analysis']
+    user_name = log.get('publishUser', {}).get('name', 'Unknown')
+
+    full_content = item['full_content']
+
+    report_lines.append(f"## {idx}. {user_name}")
+    report_lines.append("### 日志原文")
+    report_lines.append(full_content)
+    report_lines.append("")
+    report_lines.append("### 日志分析")
+
+    if isinstance(analysis, dict):
+        for category, val in analysis.items():
+            if val:
+                report_lines.append(f"- **{category}**: {val}")
+    else:
+        report_lines.append(f"- 分析结果格式错误: {analysis}")
+
+    report_lines.append("\n---\n")
+    return report_lines
 
 def main():
     if not os.path.exists(CONFIG_FILE):
@@ -254,65 +1268,33 @@ def main():
     
     print(f"Fetching logs for {yesterday_date} ({start_time} to {end_time})...")
     
-    all_logs = fetch_logs(config, start_time, end_time)
-    print(f"Total logs fetched: {len(all_logs)}")
-    
-    target_depts = config['target_departments']
-    filtered_logs = filter_logs(all_logs, target_depts)
-    print(f"Logs after filtering (Dept {target_depts}): {len(filtered_logs)}")
-    
-    processed_logs = []
-    
-    for log in filtered_logs:
-        user_name = log.get('publishUser', {}).get('name', 'Unknown')
-        user_id = str(log.get('publishUser', {}).get('userId', ''))
-        dept_name = log.get('publishUser', {}).get('departmentName', '')
-        feed_id = log.get('feedId', '')
-        
-        raw_content_parts = []
-        daily_content = log.get('dailyContent', [])
-        if daily_content:
-            for item in daily_content:
-                title = item.get('title', '')
-                text = item.get('content', '')
-                if text and text.strip() != "":
-                    if title == "今日 OKR 进展":
-                       try:
-                           okr_data = json.loads(text)
-                           okr_names = [row['Name'] for row in okr_data.get('Rows', [])]
-                           text = "\n".join([f"- {name}" for name in okr_names])
-                       except:
-                           pass 
-                    raw_content_parts.append(f"**{title}**:\n{text}")
-        
-        full_content = "\n\n".join(raw_content_parts)
-        
-        # Avoid re-analyzing if already in DB (Optional optimization, but strictly speaking we should follow requirement to fetch and analyze)
-        # But user wants "Every morning crawl".
-        # Let's just analyze.
-        
-        print(f"Analyzing log for {user_name}...")
-        analysis = analyze_log_content(full_content, config)
-        
-        # Save to DB
-        db_data = {
-            'feed_id': feed_id,
-            'user_id': user_id,
-            'user_name': user_name,
-            'department': dept_name,
-            'log_date': str(yesterday_date),
-            'content': full_content
-        }
-        save_log_to_db(conn, db_data, analysis)
-        
-        processed_logs.append({
-            'original_log': log,
-            'full_content': full_content,
-            'analysis': analysis
-        })
+    # 边拉取边分析边写报告，不在内存中保留全部日报
+    stats = {}
+    try:
+        generate_report(iter_ingest_day(config, str(yesterday_date), conn, stats=stats), str(yesterday_date), config,
+                        stats=stats)
+    except CookieExpiredError:
+        print("[FAIL] Cookie已失效且刷新失败，本次拉取中止，请刷新Cookie后重新运行")
+        conn.close()
+        return
+    print(f"Total logs fetched: {stats['fetched']}")
+    print(f"Logs after filtering (Dept {config['target_departments']}): {stats['filtered']}")
+    print(f"Analyzed: {stats['analyzed']} (edited since last run: {stats['edited']}), "
+          f"unchanged (skipped): {stats['skipped']}")
+    if stats['prefiltered']:
+        print(f"Template-only logs recorded without LLM: {stats['prefiltered']} "
+              f"({stats['prefiltered']} calls saved)")
+    if stats['events']:
+        print(f"v3 events saved in combined mode: {stats['events']}")
+    if stats['pages_lost']:
+        print(f"[WARN] Pages lost after retries: {stats['pages_lost']}, rerun to fill the gap")
+    if routing_enabled(config):
+        print(format_routing_stats())
+    llm_cache = cache_stats()
+    if llm_cache:
+        print(f"LLM cache: {llm_cache['hits']} hits, {llm_cache['misses']} misses, {llm_cache['entries']} entries")
         
     conn.close()
-    generate_report(processed_logs, str(yesterday_date), config)
 
 if __name__ == "__main__":
     main()
@@ -2,13 +2,25 @@
 日报分析系统 v3.0 - 事件抽取器
 支持：置信度输出、双跑一致性、Silver/Gray分流
 """
+import argparse
 import sqlite3
 import json
-import requests
 import os
+import time
 import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 
+from circuit_breaker import CircuitOpenError
+from content_filter import is_template_only
+from failure_queue import (STAGE_CONFIRM, STAGE_EXTRACT, enqueue as enqueue_failure, held_back, init_failure_queue,
+                           record_failure, resolve as resolve_failures)
+from llm_client import chat_completion, stream_chat_completion, usage_stats
+from model_router import (TIER_CHEAP, endpoint_for, escalate, format_routing_stats, low_confidence, routing_enabled,
+                          select_tier)
+from response_validator import EVENT_SCHEMA, EVENT_LIST_SCHEMA, conform, parse_structured, repair_json
+
 # Configuration
 CONFIG_FILE = 'config.json'
 DB_FILE = 'tita_logs.db'
@@ -18,6 +30,27 @@ BUSINESS_KNOWLEDGE_FILE = 'business_knowledge.md'
 SILVER_THRESHOLD = 0.85
 CONSISTENCY_THRESHOLD = 0.7
 
+# 自适应双跑（config['extraction']['adaptive']）的默认值
+DEFAULT_ADAPTIVE_MIN_EVENT_CONF = SILVER_THRESHOLD
+DEFAULT_ADAPTIVE_MIN_FIELD_CONF = 0.7
+DEFAULT_ADAPTIVE_MAX_CHARS = 800
+DEFAULT_ADAPTIVE_MAX_SCHOOLS = 2
+DEFAULT_ADAPTIVE_AUDIT_RATE = 0.1
+# 字段置信度 -> 对应的取值字段；字段为空时其置信度通常也很低，不参与判断
+ADAPTIVE_FIELD_CONFS = {
+    'school_conf': ('school_raw', 'school_norm'),
+    'product_conf': ('product_raw', 'product_norm'),
+    'action_type_conf': ('action_type',),
+    'outcome_conf': ('outcome',),
+}
+
+# 并行抽取的日报数；所有调用合计仍受 analysis.qps 限制
+DEFAULT_EXTRACTION_WORKERS = 4
+# 每次运行复核的单跑（pending）日报数，0 表示不复核
+DEFAULT_CONFIRM_PENDING = 0
+# 每次运行自动补发 Run B 的日报数：按双跑规则本应有 Run B 的单跑日报（合并分析写入、Run B 失败）
+DEFAULT_CONFIRM_OWED = 100
+
 def load_config():
     if os.path.exists(CONFIG_FILE):
         with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
@@ -33,7 +66,8 @@ def load_business_knowledge():
 def load_taxonomy(conn):
     """加载已有的标签体系供LLM参考"""
     c = conn.cursor()
-    c.execute("SELECT dimension, name_norm, definition FROM taxonomy WHERE status='stable'")
+    # 固定排序，保证提示词前缀在多次调用间逐字节一致
+    c.execute("SELECT dimension, name_norm, definition FROM taxonomy WHERE status='stable' ORDER BY dimension, name_norm")
     tags = c.fetchall()
     
     taxonomy_text = ""
@@ -45,27 +79,95 @@ def load_taxonomy(conn):
                 taxonomy_text += f"- **{name}**: {defn or ''}\n"
     return taxonomy_text
 
+def get_pending_logs(conn, limit):
+    """获取事件全部为 pending（单跑：自适应跳过 Run B、Run B 失败或合并分析写入）的日志"""
+    c = conn.cursor()
+    c.execute('''
+        SELECT feed_id, content, log_date, user_name
+        FROM daily_logs
+        WHERE feed_id IN (SELECT doc_id FROM events_v3 WHERE doc_id IS NOT NULL GROUP BY doc_id
+                          HAVING SUM(consistency_flag != 'pending') = 0)
+        ORDER BY log_date DESC
+        LIMIT ?
+    ''', (limit,))
+    return c.fetchall()
+
+def get_owed_logs(conn, config, limit):
+    """
+    获取按双跑规则（run_b_reason）本应有 Run B 的 pending 日志：合并分析写入、Run B 失败的日报
+    自适应跳过 Run B 的日报重新判定仍会跳过，不在其中；
+    复核失败过的日报登记在失败队列（confirm_v3），按其间隔重试，失败 max_attempts 次后不再复核
+    """
+    skip = held_back(conn.cursor(), STAGE_CONFIRM)
+    owed = []
+    for log in get_pending_logs(conn, -1):
+        if log[0] in skip:
+            continue
+        events_a = load_run_a_events(conn, log[0])
+        if events_a and run_b_reason(log[0], log[1], events_a, config):
+            owed.append(log)
+            if len(owed) >= limit:
+                break
+    return owed
+
+def load_run_a_events(conn, doc_id):
+    """读取单跑保存时记录的 Run A 完整结果"""
+    c = conn.cursor()
+    c.execute('SELECT run_a_json FROM events_v3 WHERE doc_id = ? AND run_a_json IS NOT NULL LIMIT 1', (doc_id,))
+    row = c.fetchone()
+    return json.loads(row[0]) if row else None
+
+def init_extraction_skips(c):
+    """预过滤判定为无业务内容、不做抽取的日报；正文哈希变化后重新判定"""
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS extraction_skips (
+            doc_id TEXT PRIMARY KEY,
+            content_hash TEXT,
+            skipped_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+def record_extraction_skips(conn, doc_ids):
+    c = conn.cursor()
+    c.executemany('''
+        INSERT OR REPLACE INTO extraction_skips (doc_id, content_hash)
+        SELECT feed_id, content_hash FROM daily_logs WHERE feed_id = ?
+    ''', [(doc_id,) for doc_id in doc_ids])
+    conn.commit()
+
 def get_unprocessed_logs(conn):
-    """获取尚未在events_v3中分析过的日志"""
+    """获取尚未在events_v3中分析过、也未因无业务内容被跳过的日志"""
     c = conn.cursor()
     c.execute('''
         SELECT feed_id, content, log_date, user_name 
         FROM daily_logs 
         WHERE feed_id NOT IN (SELECT DISTINCT doc_id FROM events_v3 WHERE doc_id IS NOT NULL)
+        AND NOT EXISTS (SELECT 1 FROM extraction_skips s
+                        WHERE s.doc_id = daily_logs.feed_id AND s.content_hash IS daily_logs.content_hash)
         ORDER BY log_date DESC
     ''')
     return c.fetchall()
 
-def build_extraction_prompt(business_knowledge, taxonomy_text, variant='A'):
-    """构建抽取提示词，支持A/B变体"""
-    
-    base_prompt = f"""你是一个专业的商业事件分析员。请从日报中提取结构化的商业事件。
-
-## 业务背景
+def build_static_prefix(business_knowledge, taxonomy_text):
+    """业务背景 + 标签体系，所有抽取提示词共用的静态前缀"""
+    return f"""## 业务背景
 {business_knowledge}
 
 ## 已有标签体系（请优先使用）
 {taxonomy_text}
+"""
+
+def build_extraction_prompt(business_knowledge, taxonomy_text, variant='A'):
+    """
+    构建抽取提示词，支持A/B变体
+    体量最大的业务背景与标签体系放在最前面，A/B 两个变体共享这段逐字节一致的静态前缀，
+    便于模型服务的前缀缓存复用；变体差异只出现在其后的任务说明中
+    """
+    static_prefix = build_static_prefix(business_knowledge, taxonomy_text)
+
+    base_prompt = f"""
+## 任务
+你是一个专业的商业事件分析员。请从日报中提取结构化的商业事件。
 
 ## 提取规则
 1. 将日报拆解为独立事件，每个「学校×产品」的互动是一个事件
@@ -99,43 +201,284 @@ def build_extraction_prompt(business_knowledge, taxonomy_text, variant='A'):
         base_prompt = base_prompt.replace("商业事件分析员", "销售日报结构化专家")
         base_prompt = base_prompt.replace("置信度评分", "确信度打分")
     
-    return base_prompt
+    return static_prefix + base_prompt
+
+class EventStreamParser:
+    """
+    增量解析流式返回的事件数组
+    feed() 接收新到的文本片段，返回其中刚闭合的完整事件对象（经 repair_json 修复常见格式问题）；
+    数组之前的说明文字、Markdown 代码块标记以及数组之后的内容都会被忽略，
+    只有后面紧跟 { 或 ] 的 [ 才视为数组开头
+    数组已结束但其中的事件对象全部无法解析时抛出 ValueError，由调用方重试
+    """
+
+    def __init__(self):
+        self.text = ''
+        self.pos = 0
+        self.depth = 0          # 0: 数组外，1: 数组内，>=2: 事件对象内
+        self.quote = None       # 当前字符串的结束引号，不在字符串内为 None
+        self.escape = False
+        self.obj_start = None
+        self.closed = False     # 已读到数组结尾的 ]
+        self.dropped = 0        # 修复后仍无法解析的事件对象数
+        self.events = []
+
+    def _array_starts(self):
+        """当前位置的 [ 之后（跳过空白）是否为 { 或 ]；文本不够判断时返回 None"""
+        rest = self.text[self.pos + 1:].lstrip()
+        if not rest:
+            return None
+        return rest[0] in '{]'
+
+    def feed(self, chunk):
+        self.text += chunk
+        new_events = []
+        while self.pos < len(self.text) and not self.closed:
+            ch = self.text[self.pos]
+            if self.quote:
+                if self.escape:
+                    self.escape = False
+                elif ch == '\\':
+                    self.escape = True
+                elif ch == self.quote or (self.quote == '”' and ch == '"'):
+                    self.quote = None
+            elif self.depth == 0:
+                if ch == '[':
+                    starts = self._array_starts()
+                    if starts is None:
+                        break       # 等待后续片段再判断
+                    if starts:
+                        self.depth = 1
+            elif ch in '"“':
+                self.quote = '"' if ch == '"' else '”'
+            elif ch in '{[':
+                if self.depth == 1 and ch == '{':
+                    self.obj_start = self.pos
+                self.depth += 1
+            elif ch in '}]':
+                self.depth -= 1
+                if self.depth == 1 and self.obj_start is not None:
+                    try:
+                        event = repair_json(self.text[self.obj_start:self.pos + 1])
+                    except ValueError:
+                        event = None
+                    if isinstance(event, dict):
+                        self.events.append(event)
+                        new_events.append(event)
+                    else:
+                        self.dropped += 1
+                    self.obj_start = None
+                elif self.depth == 0:
+                    if self.dropped and not self.events:
+                        raise ValueError(f"{self.dropped} 个事件对象无法解析")
+                    self.closed = True
+            self.pos += 1
+        return new_events
+
+def _event_key(event):
+    return (event.get('raw_span'), event.get('school_raw'), event.get('product_raw'))
+
+def _continuation_messages(messages, events):
+    """已收到部分事件时，只请求剩余部分：把已输出的事件作为上文，要求模型接着输出"""
+    emitted = '[' + ',\n'.join(json.dumps(e, ensure_ascii=False) for e in events)
+    return messages + [
+        {"role": "assistant", "content": emitted},
+        {"role": "user", "content": f"上面的输出在第 {len(events)} 个事件之后中断了。请只输出剩余的事件，"
+                                    f"格式仍为JSON数组，不要重复已输出的事件；没有剩余事件时返回 []。"}
+    ]
+
+def complete_events(log_content, events, config, endpoint_id=None):
+    """
+    按 EVENT_SCHEMA 归一事件字段；缺失或无效的必填字段只追问一次，
+    追问的回复按事件序号合并回原事件，不重抽整篇日报
+    追问发给抽取所用的 endpoint_id（见 model_router），未指定时使用 volcengine_endpoint_id
+    """
+    events = [e for e in events if isinstance(e, dict)]
+    events, problems = conform(events, EVENT_LIST_SCHEMA)
+    if not problems:
+        return events
+
+    missing = {}
+    for idx, field in problems:
+        missing.setdefault(idx, []).append(field)
+    todo = [{"index": idx, "raw_span": events[idx].get('raw_span', ''), "fields": fields}
+            for idx, fields in sorted(missing.items())]
+
+    messages = [
+        {"role": "system", "content": "You are a helpful assistant that outputs raw JSON."},
+        {"role": "user", "content": f"""以下是一篇销售日报，以及从中抽取出的事件里缺失或无效的字段。
+请只补充这些字段，返回JSON数组，每项包含 index 以及需要补充的字段，置信度字段为 0-1 的数字，
+不要包含Markdown格式，也不要包含其他解释语。
+
+需要补充的字段：
+{json.dumps(todo, ensure_ascii=False)}
+
+日报内容：
+{log_content}"""}
+    ]
+    fix_schema = {'type': 'array', 'items': {'type': 'object', 'properties': EVENT_SCHEMA['properties']}}
+    try:
+        fixes, _ = chat_completion(messages, model=endpoint_id or config.get('volcengine_endpoint_id'),
+                                   api_key=config.get('volcengine_api_key'), config=config, temperature=0.1,
+                                   timeout=60, parse=lambda c: parse_structured(c, fix_schema),
+                                   caller='extract_repair')
+    except Exception as e:
+        print(f" [字段补全失败: {e}]", end="")
+        return events
+
+    for fix in fixes:
+        idx = fix.get('index') if isinstance(fix, dict) else None
+        if isinstance(idx, int) and idx in missing:
+            events[idx].update({f: fix[f] for f in missing[idx] if f in fix})
+    return events
+
+def stream_llm_extraction(log_content, system_prompt, config, on_event=None, endpoint_id=None, max_retries=3):
+    """
+    流式事件抽取：边接收边解析，每个事件对象闭合后立即交给 on_event
+    回复被截断或连接中断时保留已解析的事件，重试只请求缺失的部分
+    数组中的事件对象全部无法解析时（EventStreamParser 抛出 ValueError）按失败重试
+    """
+    api_key = config.get('volcengine_api_key')
+    endpoint_id = endpoint_id or config.get('volcengine_endpoint_id')
+
+    if not api_key:
+        return None, "No API Key"
+
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": f"日报内容：\n{log_content}"}
+    ]
+
+    events = []
+    seen = set()
+    request_messages = messages
+    error = None
+    for attempt in range(max_retries):
+        parser = EventStreamParser()
+        error = None
+        try:
+            for chunk in stream_chat_completion(request_messages, model=endpoint_id, api_key=api_key, config=config,
+                                                temperature=0.1, timeout=90, cache_prefix=True,
+                                                caller='extract_v3', attempt=attempt):
+                for event in parser.feed(chunk):
+                    if _event_key(event) in seen:
+                        continue
+                    seen.add(_event_key(event))
+                    events.append(event)
+                    if on_event:
+                        on_event(event)
+        except CircuitOpenError as e:
+            # 熔断期间不再重试，交给失败队列
+            error = str(e)
+            break
+        except Exception as e:
+            error = str(e)
+
+        if parser.closed:
+            return complete_events(log_content, events, config, endpoint_id), None
 
-def call_llm_extraction(log_content, system_prompt, config):
-    """调用LLM进行事件抽取"""
+        error = error or "回复被截断"
+        if events:
+            request_messages = _continuation_messages(messages, events)
+        if attempt < max_retries - 1:
+            time.sleep(2)
+
+    if events:
+        # 重试耗尽仍未收到完整数组时保留已解析的部分
+        print(f" [部分结果: {error}]", end="")
+        return complete_events(log_content, events, config, endpoint_id), None
+    return None, error
+
+def build_combined_prompt(business_knowledge, taxonomy_text, categories):
+    """
+    合并分析提示词：一次调用同时返回日报分类结果与事件数组
+    静态前缀与 A/B 抽取提示词相同，可共用前缀缓存
+    """
+    return build_static_prefix(business_knowledge, taxonomy_text) + f"""
+## 任务
+你是一个专业的商业事件分析员。请对日报同时完成两项工作：
+1. 分类摘要：把日报中的信息归类到以下类别：{', '.join(categories)}。某个类别没有相关信息时返回空字符串。
+2. 事件抽取：将日报拆解为独立事件，每个「学校×产品」的互动是一个事件，给出置信度评分（0-1），并引用原文片段作为证据。
+
+## 输出格式（JSON对象）
+{{
+  "analysis": {{ "类别名": "该类别的内容" }},
+  "events": [
+    {{
+      "raw_span": "原文片段（完整引用）",
+      "school_raw": "原始学校名",
+      "school_norm": "规范学校名（如能确定）",
+      "school_conf": 0.95,
+      "product_raw": "原始产品名",
+      "product_norm": "规范产品名",
+      "product_conf": 0.90,
+      "action_type": "动作类型标签",
+      "action_type_conf": 0.85,
+      "blocker": "阻碍原因（可为空）",
+      "blocker_conf": 0.80,
+      "outcome": "结果标签",
+      "outcome_conf": 0.75,
+      "event_conf": 0.85
+    }}
+  ]
+}}
+
+只返回JSON，不要Markdown格式。"""
+
+def events_table_exists(conn):
+    c = conn.cursor()
+    c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='events_v3'")
+    return c.fetchone() is not None
+
+def call_llm_extraction(log_content, system_prompt, config, on_event=None, tier=None):
+    """
+    调用LLM进行事件抽取；config['extraction']['stream'] 为 true 时走流式抽取
+    开启 llm.routing 时按正文选择 cheap / strong 档（见 model_router）：
+    cheap 档失败时不在本档重试，事件置信度过低时同样升级到 strong 档重跑
+    """
+    tier = tier or select_tier(log_content, config)
+    max_retries = 1 if tier == TIER_CHEAP else 3
+    if config.get('extraction', {}).get('stream', False):
+        events, error = stream_llm_extraction(log_content, system_prompt, config, on_event,
+                                              endpoint_for(tier, config), max_retries)
+    else:
+        events, error = _request_extraction(log_content, system_prompt, config, endpoint_for(tier, config),
+                                            max_retries)
+    if tier == TIER_CHEAP:
+        if events is None:
+            return call_llm_extraction(log_content, system_prompt, config, on_event, escalate('抽取失败'))
+        if low_confidence(events, config):
+            return call_llm_extraction(log_content, system_prompt, config, on_event, escalate('低置信度'))
+    return events, error
+
+def _request_extraction(log_content, system_prompt, config, endpoint_id, max_retries=3):
+    """非流式抽取，整体无法解析时重试 max_retries 次"""
     api_key = config.get('volcengine_api_key')
-    endpoint_id = config.get('volcengine_endpoint_id')
     
     if not api_key:
         return None, "No API Key"
 
-    url = "https://ark.cn-beijing.volces.com/api/v3/chat/completions"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {api_key}"
-    }
-
-    payload = {
-        "model": endpoint_id,
-        "messages": [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": f"日报内容：\n{log_content}"}
-        ],
-        "temperature": 0.1
-    }
-
-    max_retries = 3
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": f"日报内容：\n{log_content}"}
+    ]
+
+    def parse(content):
+        # 修复常见格式问题；字段级问题交给 complete_events 追问，只有整体无法解析时才重试
+        events, _ = parse_structured(content, {'type': 'array'})
+        return events
+
     for attempt in range(max_retries):
         try:
-            response = requests.post(url, headers=headers, json=payload, timeout=90)
-            response.raise_for_status()
-            res_json = response.json()
-            content = res_json['choices'][0]['message']['content']
-            content = content.replace('```json', '').replace('```', '').strip()
-            return json.loads(content), None
+            # 系统提示词作为静态前缀，模型服务支持上下文缓存时只需上传一次
+            events = chat_completion(messages, model=endpoint_id, api_key=api_key, config=config,
+                                     temperature=0.1, timeout=90, parse=parse, cache_prefix=True,
+                                     caller='extract_v3', attempt=attempt)
+            return complete_events(log_content, events, config, endpoint_id), None
+        except CircuitOpenError as e:
+            return None, str(e)
         except Exception as e:
             if attempt < max_retries - 1:
-                import time
                 time.sleep(2)
             else:
                 return None, str(e)
@@ -214,8 +557,8 @@ def merge_events(events_a, events_b, matched_pairs):
     
     return merged
 
-def save_events_v3(conn, doc_id, date_str, events, run_a_json, run_b_json, is_dual_run=True):
-    """保存事件到events_v3表"""
+def save_events_v3(conn, doc_id, date_str, events, run_a_json, run_b_json, is_dual_run=True, count_tags=True):
+    """保存事件到events_v3表；count_tags=False 时不再累计候选标签频次（复核已计数过的事件时使用）"""
     c = conn.cursor()
     saved_count = 0
     silver_count = 0
@@ -272,7 +615,8 @@ def save_events_v3(conn, doc_id, date_str, events, run_a_json, run_b_json, is_du
         saved_count += 1
         
         # 更新候选标签池
-        update_candidate_tags(c, evt)
+        if count_tags:
+            update_candidate_tags(c, evt)
     
     conn.commit()
     return saved_count, silver_count
@@ -304,9 +648,155 @@ def update_candidate_tags(cursor, event):
                 VALUES (?, ?, ?, 'candidate', 1)
             ''', (tag_id, dim, tag_value))
 
-def main():
-    import sys
+# 每解析出一个事件打印一个点（流式抽取时边收边打）
+def show_event(event):
+    print(".", end="", flush=True)
+
+def audit_sampled(doc_id, rate):
+    """按 doc_id 哈希抽样，同一篇日报重跑时结果不变"""
+    return zlib.crc32(str(doc_id).encode('utf-8')) % 10000 < rate * 10000
+
+def run_b_reason(doc_id, content, events_a, config):
+    """
+    自适应双跑：返回需要 Run B 的原因，不需要时返回 None
+    未开启 config['extraction']['adaptive'] 时总是双跑
+    """
+    adaptive = config.get('extraction', {}).get('adaptive', {})
+    if not adaptive.get('enabled'):
+        return '双跑'
+    min_event_conf = adaptive.get('min_event_conf', DEFAULT_ADAPTIVE_MIN_EVENT_CONF)
+    min_field_conf = adaptive.get('min_field_conf', DEFAULT_ADAPTIVE_MIN_FIELD_CONF)
+    for e in events_a:
+        if e.get('event_conf', 0) < min_event_conf:
+            return '低置信度'
+        if any(f in e and e[f] < min_field_conf and any(e.get(v) for v in value_fields)
+               for f, value_fields in ADAPTIVE_FIELD_CONFS.items()):
+            return '字段低置信度'
+    if len(content) > adaptive.get('max_chars', DEFAULT_ADAPTIVE_MAX_CHARS):
+        return '长日报'
+    schools = {e.get('school_norm') or e.get('school_raw') for e in events_a} - {None, ''}
+    if len(schools) >= adaptive.get('max_schools', DEFAULT_ADAPTIVE_MAX_SCHOOLS):
+        return '多学校'
+    # 随机抽检一部分高置信度日报，保证一致性统计不因只复核疑难日报而偏低
+    if audit_sampled(doc_id, adaptive.get('audit_rate', DEFAULT_ADAPTIVE_AUDIT_RATE)):
+        return '抽检'
+    return None
+
+def run_extraction(doc_id, content, prompt_a, prompt_b, config, on_event=None):
+    """
+    对一篇日报发出 Run A / Run B，不访问数据库，可在工作线程中执行
+    未开启自适应双跑时两次调用同时发出；开启时 Run B 取决于 Run A 的结果，只能先后发出
+    返回 {'events_a', 'err_a', 'events_b', 'err_b', 'reason'}，reason 为 None 表示跳过了 Run B
+    """
+    result = {'events_a': None, 'err_a': None, 'events_b': None, 'err_b': None, 'reason': None}
+    if not config.get('extraction', {}).get('adaptive', {}).get('enabled'):
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            future_b = pool.submit(call_llm_extraction, content, prompt_b, config)
+            result['events_a'], result['err_a'] = call_llm_extraction(content, prompt_a, config, on_event=on_event)
+            result['events_b'], result['err_b'] = future_b.result()
+        result['reason'] = '双跑'
+        return result
+
+    result['events_a'], result['err_a'] = call_llm_extraction(content, prompt_a, config, on_event=on_event)
+    if result['events_a']:
+        result['reason'] = run_b_reason(doc_id, content, result['events_a'], config)
+        if result['reason']:
+            result['events_b'], result['err_b'] = call_llm_extraction(content, prompt_b, config, on_event=on_event)
+    return result
+
+def save_extraction(conn, doc_id, date_str, result, config, stats=None):
+    """
+    保存 run_extraction 的结果，返回 (保存事件数, Silver 数, 错误)
+    Run A 失败时登记到失败队列，由 tita_service 在早高峰之外重试
+    stats（可选 dict）累计 run_b / run_b_skipped
+    """
+    if stats is None:
+        stats = {}
+    events_a, err_a = result['events_a'], result['err_a']
+    c = conn.cursor()
+    if events_a is None:
+        print(f"  ├─ Run A ✗ ({err_a})")
+        enqueue_failure(c, doc_id, STAGE_EXTRACT, err_a, date_str, config)
+        conn.commit()
+        return 0, 0, err_a
+    resolve_failures(c, [doc_id], STAGE_EXTRACT)
+    if not events_a:
+        print("  ├─ Run A - (无事件)")
+        conn.commit()
+        return 0, 0, None
+    print(f"  ├─ Run A ✓ ({len(events_a)} events)")
+
+    reason = result['reason']
+    if reason is None:
+        stats['run_b_skipped'] = stats.get('run_b_skipped', 0) + 1
+        saved, silver = save_events_v3(conn, doc_id, date_str, events_a, events_a, None, False)
+        print(f"  └─ 高置信度，跳过 Run B，保存 {saved} 事件 (pending)")
+        return saved, silver, None
+    stats['run_b'] = stats.get('run_b', 0) + 1
+
+    events_b, err_b = result['events_b'], result['err_b']
+    if events_b:
+        print(f"  ├─ Run B ({reason}) ✓ ({len(events_b)} events)")
+    else:
+        print(f"  ├─ Run B ({reason}) ✗ ({err_b})")
+        # 仅有A的结果，标记为pending
+        saved, silver = save_events_v3(conn, doc_id, date_str, events_a, events_a, None, False)
+        print(f"  └─ 保存 {saved} 事件 (pending)")
+        return saved, silver, None
+
+    saved, silver = save_dual_run(conn, doc_id, date_str, events_a, events_b)
+    return saved, silver, None
+
+def save_dual_run(conn, doc_id, date_str, events_a, events_b, count_tags=True):
+    """计算 A/B 一致性、合并并按 Silver/Gray 保存，返回 (保存事件数, Silver 数)"""
+    consistency, matched = calculate_consistency(events_a, events_b)
+    print(f"  ├─ 一致性: {consistency:.1%}")
+    
+    if matched:
+        merged_events = merge_events(events_a, events_b, matched)
+        saved, silver = save_events_v3(conn, doc_id, date_str, merged_events, events_a, events_b, True, count_tags)
+    else:
+        # 无法匹配，各自保存为gray
+        for e in events_a:
+            e['consistency_score'] = 0
+        saved, silver = save_events_v3(conn, doc_id, date_str, events_a, events_a, events_b, True, count_tags)
     
+    print(f"  └─ 保存 {saved} 事件 (Silver: {silver})")
+    return saved, silver
+
+def save_confirmation(conn, doc_id, date_str, events_b, err_b):
+    """
+    复核单跑日报：以单跑保存的 Run A 结果为 A，与补发的 Run B（可在工作线程中调用 call_llm_extraction）
+    按双跑重新判定 Silver/Gray，替换原有的 pending 事件；Run B 失败时保持 pending
+    返回 (保存事件数, Silver 数, 错误)
+    """
+    events_a = load_run_a_events(conn, doc_id)
+    if not events_a:
+        return 0, 0, "无 Run A 结果"
+    if not events_b:
+        print(f"  ├─ Run B (复核) ✗ ({err_b or '无事件'})")
+        return 0, 0, err_b or "Run B 无事件"
+    print(f"  ├─ Run B (复核) ✓ ({len(events_b)} events)")
+    c = conn.cursor()
+    c.execute("DELETE FROM events_v3 WHERE doc_id = ? AND consistency_flag = 'pending'", (doc_id,))
+    # 删除与重新写入在同一事务中，由 save_events_v3 统一提交；候选标签已在单跑保存时计数
+    saved, silver = save_dual_run(conn, doc_id, date_str, events_a, events_b, count_tags=False)
+    return saved, silver, None
+
+def extract_log(conn, doc_id, content, date_str, prompt_a, prompt_b, config, on_event=show_event, stats=None):
+    """
+    对一篇日报做 A/B 双跑抽取并保存，返回 (保存事件数, Silver 数, 错误)
+    开启自适应双跑时，Run A 结果可信的简单日报跳过 Run B，事件按单跑保存为 pending
+    """
+    result = run_extraction(doc_id, content, prompt_a, prompt_b, config, on_event=on_event)
+    return save_extraction(conn, doc_id, date_str, result, config, stats)
+
+def main():
+    parser = argparse.ArgumentParser(description='v3 事件抽取（A/B 双跑一致性）')
+    parser.add_argument('--confirm-pending', type=int, default=None, metavar='N',
+                        help='本次最多复核 N 篇单跑（pending）日报，默认读 extraction.confirm_pending')
+    args = parser.parse_args()
+
     print("\n" + "="*60)
     print("  日报分析系统 v3.0 - 双跑一致性模式")
     print("="*60 + "\n")
@@ -315,69 +805,93 @@ def main():
     business_knowledge = load_business_knowledge()
     
     conn = sqlite3.connect(DB_FILE)
+    init_failure_queue(conn.cursor())
+    init_extraction_skips(conn.cursor())
     taxonomy_text = load_taxonomy(conn)
     
     # 获取未处理日志
     logs = get_unprocessed_logs(conn)
+    print(f"发现 {len(logs)} 条未分析日志")
+    
+    # 空日报与只有 OKR 模板的日报没有可抽取的事件，不调用模型
+    skipped_ids = [log[0] for log in logs if is_template_only(log[1], config)]
+    skipped = len(skipped_ids)
+    if skipped:
+        # 记下已跳过的日报，之后的运行不再重复判定和计数
+        record_extraction_skips(conn, skipped_ids)
+        skipped_set = set(skipped_ids)
+        logs = [log for log in logs if log[0] not in skipped_set]
+        # 双跑每篇两次调用；自适应双跑时至少一次
+        per_log = 1 if config.get('extraction', {}).get('adaptive', {}).get('enabled') else 2
+        print(f"预过滤: {skipped} 篇无业务内容，跳过，节省约 {skipped * per_log} 次调用")
     total = len(logs)
-    print(f"发现 {total} 条未分析日志\n")
+
+    confirm_limit = args.confirm_pending
+    if confirm_limit is None:
+        confirm_limit = config.get('extraction', {}).get('confirm_pending', DEFAULT_CONFIRM_PENDING)
+    pending = get_pending_logs(conn, confirm_limit) if confirm_limit > 0 else []
+    # 合并分析写入的事件只有单跑结果，不补发 Run B 永远不会成为 Silver
+    owed_limit = config.get('extraction', {}).get('confirm_owed', DEFAULT_CONFIRM_OWED)
+    if owed_limit > 0:
+        queued = {log[0] for log in pending}
+        pending += [log for log in get_owed_logs(conn, config, owed_limit) if log[0] not in queued]
+    if pending:
+        print(f"待复核单跑日志: {len(pending)} 条")
+    print()
     
-    if total == 0:
+    if total == 0 and not pending:
         print("无新日志需要分析，退出。")
         conn.close()
         return
     
     total_events = 0
     total_silver = 0
+    run_stats = {}
     
-    for idx, log in enumerate(logs):
-        doc_id, content, date_str, user_name = log
-        progress = (idx + 1) / total * 100
-        
-        print(f"[{idx+1}/{total}] ({progress:.0f}%) 分析: {user_name} ({date_str})")
-        
-        # 构建提示词
-        prompt_a = build_extraction_prompt(business_knowledge, taxonomy_text, 'A')
-        prompt_b = build_extraction_prompt(business_knowledge, taxonomy_text, 'B')
-        
-        # Run A
-        print("  ├─ Run A...", end="", flush=True)
-        events_a, err_a = call_llm_extraction(content, prompt_a, config)
-        if events_a:
-            print(f" ✓ ({len(events_a)} events)")
-        else:
-            print(f" ✗ ({err_a})")
-            continue
-        
-        # Run B
-        print("  ├─ Run B...", end="", flush=True)
-        events_b, err_b = call_llm_extraction(content, prompt_b, config)
-        if events_b:
-            print(f" ✓ ({len(events_b)} events)")
-        else:
-            print(f" ✗ ({err_b})")
-            # 仅有A的结果，标记为pending
-            saved, silver = save_events_v3(conn, doc_id, date_str, events_a, events_a, None, False)
+    # 提示词只构建一次，所有日志共用同一份前缀
+    prompt_a = build_extraction_prompt(business_knowledge, taxonomy_text, 'A')
+    prompt_b = build_extraction_prompt(business_knowledge, taxonomy_text, 'B')
+    
+    # 多篇日报并行抽取（LLM 调用在工作线程），完成一篇在主线程入库一篇；
+    # 所有请求共用 llm_client 中按 analysis.qps 设置的全局速率上限
+    workers = max(1, config.get('extraction', {}).get('workers', DEFAULT_EXTRACTION_WORKERS))
+    on_event = show_event if workers == 1 else None
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(run_extraction, log[0], log[1], prompt_a, prompt_b, config, on_event): log
+                   for log in logs}
+        for idx, future in enumerate(as_completed(futures)):
+            doc_id, _, date_str, user_name = futures[future]
+            progress = (idx + 1) / total * 100
+            
+            print(f"[{idx+1}/{total}] ({progress:.0f}%) 分析: {user_name} ({date_str})")
+            
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {'events_a': None, 'err_a': str(e), 'events_b': None, 'err_b': None, 'reason': None}
+            saved, silver, _ = save_extraction(conn, doc_id, date_str, result, config, run_stats)
             total_events += saved
-            print(f"  └─ 保存 {saved} 事件 (pending)")
-            continue
-        
-        # 计算一致性并合并
-        consistency, matched = calculate_consistency(events_a, events_b)
-        print(f"  ├─ 一致性: {consistency:.1%}")
-        
-        if matched:
-            merged_events = merge_events(events_a, events_b, matched)
-            saved, silver = save_events_v3(conn, doc_id, date_str, merged_events, events_a, events_b, True)
-        else:
-            # 无法匹配，各自保存为gray
-            for e in events_a:
-                e['consistency_score'] = 0
-            saved, silver = save_events_v3(conn, doc_id, date_str, events_a, events_a, events_b, True)
-        
-        total_events += saved
-        total_silver += silver
-        print(f"  └─ 保存 {saved} 事件 (Silver: {silver})")
+            total_silver += silver
+
+        # 单跑日报补发 Run B，按双跑重新判定 Silver/Gray
+        futures = {pool.submit(call_llm_extraction, log[1], prompt_b, config): log for log in pending}
+        for idx, future in enumerate(as_completed(futures)):
+            doc_id, _, date_str, user_name = futures[future]
+            print(f"[复核 {idx+1}/{len(pending)}] {user_name} ({date_str})")
+            try:
+                events_b, err_b = future.result()
+            except Exception as e:
+                events_b, err_b = None, str(e)
+            saved, silver, error = save_confirmation(conn, doc_id, date_str, events_b, err_b)
+            c = conn.cursor()
+            if error is None:
+                resolve_failures(c, [doc_id], STAGE_CONFIRM)
+                run_stats['confirmed'] = run_stats.get('confirmed', 0) + 1
+                run_stats['confirmed_silver'] = run_stats.get('confirmed_silver', 0) + silver
+            else:
+                # 记下失败次数，反复失败的日报按间隔重试，超过上限后不再每次都补发 Run B
+                record_failure(c, doc_id, STAGE_CONFIRM, error, date_str, config)
+            conn.commit()
     
     conn.close()
     
@@ -385,6 +899,17 @@ def main():
     print(f"  分析完成！")
     print(f"  总事件数: {total_events}")
     print(f"  Silver事件: {total_silver} ({total_silver/total_events*100:.1f}%)" if total_events > 0 else "")
+    if routing_enabled(config):
+        print(f"  {format_routing_stats()}")
+    if run_stats.get('run_b_skipped'):
+        print(f"  Run B: {run_stats.get('run_b', 0)} 次，高置信度跳过 {run_stats['run_b_skipped']} 次")
+    if pending:
+        print(f"  复核单跑日报: {run_stats.get('confirmed', 0)}/{len(pending)} 篇，"
+              f"新增 Silver 事件 {run_stats.get('confirmed_silver', 0)}")
+    usage = usage_stats()
+    if usage['prompt_tokens']:
+        print(f"  输入Token: {usage['prompt_tokens']}，其中命中前缀缓存: {usage['cached_tokens']} "
+              f"({usage['cached_tokens']/usage['prompt_tokens']*100:.1f}%)")
     print("="*60 + "\n")
 
 if __name__ == "__main__":
@@ -0,0 +1,288 @@
+"""
+分析失败队列（死信队列）
+日报分类分析结果为「分析失败」、v3 事件抽取 Run A 失败、单跑事件的复核 Run B 失败时，在 failure_queue 表中登记一条记录：
+日报、阶段、错误信息、已尝试次数、下次尝试时间。
+tita_service 的定时任务在早高峰之外分批重试，两次尝试之间的间隔按指数增长，
+超过 max_attempts 次仍失败的记录标记为 dead，不再自动重试。
+
+命令行：
+    python failure_queue.py           # 队列概况
+    python failure_queue.py drain     # 立即处理一批到期的记录
+    python failure_queue.py revive    # 把 dead 记录重新放回队列
+
+配置（config.json，可选）：
+    "retry_queue": { "enabled": true, "interval_minutes": 30, "batch_size": 20,
+                     "base_delay_minutes": 15, "max_delay_hours": 24, "max_attempts": 6,
+                     "peak_hours": [8, 11] }
+"""
+import datetime
+import json
+import os
+import sqlite3
+import sys
+import time
+
+DB_FILE = 'tita_logs.db'
+
+STAGE_ANALYSIS = 'analysis'
+STAGE_EXTRACT = 'extract_v3'
+STAGE_CONFIRM = 'confirm_v3'
+
+DEFAULT_BATCH_SIZE = 20
+DEFAULT_BASE_DELAY_MINUTES = 15
+DEFAULT_MAX_DELAY_HOURS = 24
+DEFAULT_MAX_ATTEMPTS = 6
+# 默认避开 9:00 的日报拉取，[开始小时, 结束小时)
+DEFAULT_PEAK_HOURS = (8, 11)
+
+
+def init_failure_queue(c):
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS failure_queue (
+            feed_id TEXT,
+            stage TEXT,               -- analysis / extract_v3 / confirm_v3
+            log_date TEXT,
+            error TEXT,
+            attempts INTEGER DEFAULT 0,
+            status TEXT DEFAULT 'pending',   -- pending / done / dead
+            next_attempt_at REAL,     -- unix 秒
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (feed_id, stage)
+        )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_failure_queue_due ON failure_queue(status, next_attempt_at)')
+
+
+def retry_delay(attempts, config=None):
+    """第 attempts 次失败后到下次尝试的秒数：base × 2^(attempts-1)，不超过 max_delay_hours"""
+    queue_config = (config or {}).get('retry_queue', {})
+    base = queue_config.get('base_delay_minutes', DEFAULT_BASE_DELAY_MINUTES) * 60
+    cap = queue_config.get('max_delay_hours', DEFAULT_MAX_DELAY_HOURS) * 3600
+    return min(cap, base * 2 ** max(0, attempts - 1))
+
+
+def enqueue(c, feed_id, stage, error, log_date=None, config=None):
+    """
+    登记失败（不提交，由调用方提交）
+    已在队列中的记录只更新错误信息；done 的记录重新变为 pending
+    """
+    c.execute('''
+        INSERT INTO failure_queue (feed_id, stage, log_date, error, attempts, status, next_attempt_at)
+        VALUES (?, ?, ?, ?, 0, 'pending', ?)
+        ON CONFLICT(feed_id, stage) DO UPDATE SET
+            error = excluded.error,
+            log_date = COALESCE(excluded.log_date, failure_queue.log_date),
+            status = CASE WHEN failure_queue.status = 'done' THEN 'pending' ELSE failure_queue.status END,
+            attempts = CASE WHEN failure_queue.status = 'done' THEN 0 ELSE failure_queue.attempts END,
+            next_attempt_at = CASE WHEN failure_queue.status = 'done'
+                                   THEN excluded.next_attempt_at ELSE failure_queue.next_attempt_at END,
+            updated_at = CURRENT_TIMESTAMP
+    ''', (str(feed_id), stage, log_date, (error or '')[:500], time.time() + retry_delay(1, config)))
+
+
+def record_failure(c, feed_id, stage, error, log_date=None, config=None):
+    """
+    登记一次失败（不提交）：不在队列中（或已 done）时新登记，
+    已在队列中时计一次尝试、推迟下次尝试时间，超过 max_attempts 次标记为 dead
+    """
+    c.execute('SELECT status FROM failure_queue WHERE feed_id = ? AND stage = ?', (str(feed_id), stage))
+    row = c.fetchone()
+    if row is None or row[0] == 'done':
+        enqueue(c, feed_id, stage, error, log_date, config)
+    else:
+        _record_attempt(c, str(feed_id), stage, False, error, config)
+
+
+def held_back(c, stage):
+    """该阶段暂不应自动重试的日报：dead，或还没到下次尝试时间"""
+    c.execute('''
+        SELECT feed_id FROM failure_queue
+        WHERE stage = ? AND (status = 'dead' OR (status = 'pending' AND next_attempt_at > ?))
+    ''', (stage, time.time()))
+    return {row[0] for row in c.fetchall()}
+
+
+def resolve(c, feed_ids, stage):
+    """这些日报在该阶段已成功，关闭未完成的记录（不提交）"""
+    feed_ids = [str(f) for f in feed_ids]
+    for i in range(0, len(feed_ids), 500):
+        chunk = feed_ids[i:i + 500]
+        c.execute(f'''
+            UPDATE failure_queue SET status = 'done', updated_at = CURRENT_TIMESTAMP
+            WHERE stage = ? AND status != 'done' AND feed_id IN ({','.join('?' * len(chunk))})
+        ''', [stage] + chunk)
+
+
+def _record_attempt(c, feed_id, stage, ok, error, config):
+    if ok:
+        resolve(c, [feed_id], stage)
+        return
+    max_attempts = (config or {}).get('retry_queue', {}).get('max_attempts', DEFAULT_MAX_ATTEMPTS)
+    c.execute('SELECT attempts FROM failure_queue WHERE feed_id = ? AND stage = ?', (feed_id, stage))
+    row = c.fetchone()
+    attempts = (row[0] if row else 0) + 1
+    c.execute('''
+        UPDATE failure_queue
+        SET attempts = ?, error = ?, status = ?, next_attempt_at = ?, updated_at = CURRENT_TIMESTAMP
+        WHERE feed_id = ? AND stage = ?
+    ''', (attempts, (error or '')[:500], 'dead' if attempts >= max_attempts else 'pending',
+          time.time() + retry_delay(attempts + 1, config), feed_id, stage))
+
+
+def in_peak_hours(config=None, now=None):
+    peak = (config or {}).get('retry_queue', {}).get('peak_hours', DEFAULT_PEAK_HOURS)
+    hour = (now or datetime.datetime.now()).hour
+    return peak[0] <= hour < peak[1]
+
+
+def due_items(conn, limit):
+    c = conn.cursor()
+    c.execute('''
+        SELECT feed_id, stage FROM failure_queue
+        WHERE status = 'pending' AND next_attempt_at <= ?
+        ORDER BY next_attempt_at LIMIT ?
+    ''', (time.time(), limit))
+    return c.fetchall()
+
+
+def _retry_analysis(conn, feed_id, config):
+    import daily_log_aggregator as aggregator
+
+    c = conn.cursor()
+    c.execute('SELECT content FROM daily_logs WHERE feed_id = ?', (feed_id,))
+    row = c.fetchone()
+    if row is None:
+        return True, None     # 日报已不存在，无需再试
+    analysis = aggregator.analyze_log_content(row[0], config)
+    if aggregator.is_failed_analysis(analysis):
+        failed = [k for k, v in analysis.items() if v == aggregator.ANALYSIS_FAILED]
+        return False, f"{len(failed)} 个类别分析失败"
+    c.execute('UPDATE daily_logs SET analysis_json = ? WHERE feed_id = ?',
+              (json.dumps(analysis, ensure_ascii=False), feed_id))
+    return True, None
+
+
+def _extraction_prompts(conn, prompts):
+    import extract_events_v3 as extractor
+
+    if prompts.get('a') is None:
+        business_knowledge = extractor.load_business_knowledge()
+        taxonomy_text = extractor.load_taxonomy(conn)
+        prompts['a'] = extractor.build_extraction_prompt(business_knowledge, taxonomy_text, 'A')
+        prompts['b'] = extractor.build_extraction_prompt(business_knowledge, taxonomy_text, 'B')
+    return prompts
+
+
+def _retry_extraction(conn, feed_id, config, prompts):
+    import extract_events_v3 as extractor
+
+    c = conn.cursor()
+    c.execute('SELECT content, log_date FROM daily_logs WHERE feed_id = ?', (feed_id,))
+    row = c.fetchone()
+    if row is None:
+        return True, None
+    _extraction_prompts(conn, prompts)
+    _, _, error = extractor.extract_log(conn, feed_id, row[0], row[1], prompts['a'], prompts['b'], config)
+    return error is None, error
+
+
+def _retry_confirmation(conn, feed_id, config, prompts):
+    import extract_events_v3 as extractor
+
+    c = conn.cursor()
+    c.execute('SELECT content, log_date FROM daily_logs WHERE feed_id = ?', (feed_id,))
+    row = c.fetchone()
+    c.execute("SELECT 1 FROM events_v3 WHERE doc_id = ? AND consistency_flag = 'pending' LIMIT 1", (feed_id,))
+    if row is None or c.fetchone() is None:
+        return True, None     # 日报已不存在或已不是单跑，无需复核
+    _extraction_prompts(conn, prompts)
+    events_b, err_b = extractor.call_llm_extraction(row[0], prompts['b'], config)
+    _, _, error = extractor.save_confirmation(conn, feed_id, row[1], events_b, err_b)
+    return error is None, error
+
+
+def drain(config, conn=None, batch_size=None):
+    """处理一批到期的失败记录，返回 {'tried', 'recovered', 'failed'}"""
+    if batch_size is None:
+        batch_size = config.get('retry_queue', {}).get('batch_size', DEFAULT_BATCH_SIZE)
+    own_conn = conn is None
+    if own_conn:
+        conn = sqlite3.connect(DB_FILE)
+        init_failure_queue(conn.cursor())
+
+    from llm_client import circuit_open
+    from model_router import endpoint_for, route_tier
+
+    stats = {'tried': 0, 'recovered': 0, 'failed': 0}
+    prompts = {}
+    try:
+        for feed_id, stage in due_items(conn, batch_size):
+            c = conn.cursor()
+            c.execute('SELECT content FROM daily_logs WHERE feed_id = ?', (feed_id,))
+            row = c.fetchone()
+            if row is not None and circuit_open(config, endpoint_for(route_tier(row[0], config), config)):
+                # 这篇日报路由到的 Endpoint 熔断中，留到下一轮，不消耗尝试次数
+                continue
+            stats['tried'] += 1
+            try:
+                if stage == STAGE_ANALYSIS:
+                    ok, error = _retry_analysis(conn, feed_id, config)
+                elif stage == STAGE_CONFIRM:
+                    ok, error = _retry_confirmation(conn, feed_id, config, prompts)
+                else:
+                    ok, error = _retry_extraction(conn, feed_id, config, prompts)
+            except Exception as e:
+                ok, error = False, str(e)
+            _record_attempt(conn.cursor(), feed_id, stage, ok, error, config)
+            conn.commit()
+            stats['recovered' if ok else 'failed'] += 1
+    finally:
+        if own_conn:
+            conn.close()
+    return stats
+
+
+def queue_stats(conn):
+    c = conn.cursor()
+    c.execute('SELECT stage, status, COUNT(*) FROM failure_queue GROUP BY stage, status')
+    stats = {}
+    for stage, status, count in c.fetchall():
+        stats.setdefault(stage, {})[status] = count
+    return stats
+
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else 'stats'
+    conn = sqlite3.connect(DB_FILE)
+    init_failure_queue(conn.cursor())
+    conn.commit()
+    try:
+        if command == 'drain':
+            config = {}
+            if os.path.exists('config.json'):
+                with open('config.json', 'r', encoding='utf-8') as f:
+                    config = json.load(f)
+            stats = drain(config, conn)
+            print(f"重试 {stats['tried']} 条: 恢复 {stats['recovered']} 条, 仍失败 {stats['failed']} 条")
+        elif command == 'revive':
+            c = conn.cursor()
+            c.execute('''
+                UPDATE failure_queue SET status = 'pending', attempts = 0, next_attempt_at = ?,
+                       updated_at = CURRENT_TIMESTAMP
+                WHERE status = 'dead'
+            ''', (time.time(),))
+            conn.commit()
+            print(f"已重新放回队列 {c.rowcount} 条")
+        else:
+            stats = queue_stats(conn)
+            if not stats:
+                print("失败队列为空")
+            for stage, counts in sorted(stats.items()):
+                print(f"{stage}: " + ", ".join(f"{k} {v}" for k, v in sorted(counts.items())))
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -8,6 +8,31 @@ from collections import Counter
 DB_FILE = 'tita_logs.db'
 OUTPUT_HTML = 'daily_report_dashboard.html'
 
+# 日报模板与 OKR 固定词汇、占位词：content_filter 判定模板日报时按整词去除
+TEMPLATE_STOP_WORDS = frozenset([
+    # 日报模板固定词汇
+    '今日', '昨日', '明日', '工作', '总结', '计划', '进展', '完成', '内容', '描述',
+    '今日工作', '明日工作', '工作总结', '工作计划', '今日工作总结', '明日工作计划',
+    '今天', '明天', '昨天', '本周', '上周', '本月', '上月',
+    # OKR相关
+    '进度', '目标', '关键', '结果', '指标', '达成', '执行',
+    # 无意义短词
+    '进行中', '已完成', '待完成', '无', '空', '暂无'
+])
+
+# 关键词统计时排除的词：模板词之外再加上常用连接词与业务动词
+STOP_WORDS = TEMPLATE_STOP_WORDS | frozenset([
+    # 常用连接词/动词
+    '沟通', '对接', '协调', '问题', '情况', '需要', '表示', '我们', '他们', 
+    '以及', '虽然', '但是', '然后', '最后', '没有', '可以', '这个', '那个', 
+    '一下', '目前', '正在', '已经', '进行', '拜访', '走访', '跟进', '处理',
+    '反馈', '确认', '联系', '安排', '准备', '开展', '推进', '完善', '提升',
+    '了解', '汇报', '整理', '梳理', '分析', '继续', '持续', '相关', '主要',
+    '其他', '通过', '关于', '针对', '根据', '按照', '结合', '围绕', '针对',
+    # 数字相关
+    '一个', '两个', '三个', '第一', '第二', '第三',
+])
+
 html_template = """
 <!DOCTYPE html>
 <html lang="zh-CN">
@@ -563,29 +588,8 @@ def extract_keywords(logs):
     # 1. Regex to find potential words (len > 1, Chinese characters)
     words = re.findall(r'[\u4e00-\u9fa5]{2,}', text_pool)
     
-    # 2. Stop words list (expanded to filter out report template words)
-    stop_words = set([
-        # 日报模板固定词汇
-        '今日', '昨日', '明日', '工作', '总结', '计划', '进展', '完成', '内容', '描述',
-        '今日工作', '明日工作', '工作总结', '工作计划', '今日工作总结', '明日工作计划',
-        '今天', '明天', '昨天', '本周', '上周', '本月', '上月',
-        # OKR相关
-        '进度', '目标', '关键', '结果', '指标', '达成', '执行',
-        # 常用连接词/动词
-        '沟通', '对接', '协调', '问题', '情况', '需要', '表示', '我们', '他们', 
-        '以及', '虽然', '但是', '然后', '最后', '没有', '可以', '这个', '那个', 
-        '一下', '目前', '正在', '已经', '进行', '拜访', '走访', '跟进', '处理',
-        '反馈', '确认', '联系', '安排', '准备', '开展', '推进', '完善', '提升',
-        '了解', '汇报', '整理', '梳理', '分析', '继续', '持续', '相关', '主要',
-        '其他', '通过', '关于', '针对', '根据', '按照', '结合', '围绕', '针对',
-        # 数字相关
-        '一个', '两个', '三个', '第一', '第二', '第三',
-        # 无意义短词
-        '进行中', '已完成', '待完成', '无', '空', '暂无'
-    ])
-    
-    # 3. Count
-    counter = Counter([w for w in words if w not in stop_words])
+    # 2. Count, skipping template words (STOP_WORDS)
+    counter = Counter([w for w in words if w not in STOP_WORDS])
     
     # Format for ECharts
     return [{"name": k, "value": v} for k, v in counter.most_common(60)]
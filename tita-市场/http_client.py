@@ -0,0 +1,137 @@
+"""
+共享HTTP连接池
+按上游服务（Tita / 火山引擎 / 飞书）各维护一个 requests.Session，
+复用 TCP/TLS 连接，并统一默认超时与重试策略。
+
+用法：
+    from http_client import get_session
+    response = get_session('volcengine').post(url, headers=headers, json=payload)
+
+各上游的参数可在 config.json 的 "http" 中覆盖：
+    "http": { "volcengine": { "pool_size": 16, "timeout": 90, "retries": 1 } }
+"""
+import json
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+CONFIG_FILE = 'config.json'
+
+# 默认连接池配置
+# timeout: (连接超时, 读取超时) 或单个秒数；调用方显式传入 timeout 时以调用方为准
+# retry_post: POST 是否参与自动重试（飞书写入非幂等，不重试）
+# retry_read: 读取超时/连接中断（请求已发出）后是否重试
+# retry_statuses: 自动重试的状态码；Tita 的 429/5xx 交给 iter_fetch_logs 的自适应限速和退避处理
+DEFAULT_HOST_SETTINGS = {
+    'tita': {
+        'pool_size': 8,
+        'timeout': (5, 30),
+        'retries': 2,
+        'retry_post': True,
+        'retry_statuses': (),
+    },
+    # 模型调用只在建连失败时重试：请求一旦发出，读超时与 429/5xx 直接交给调用方（抽取重试、失败队列），
+    # 并计入 llm_client 的熔断统计，避免一次慢请求在传输层被重复提交、重复计费
+    'volcengine': {
+        'pool_size': 16,
+        'timeout': (5, 90),
+        'retries': 1,
+        'retry_post': False,
+        'retry_read': False,
+        'retry_statuses': (),
+    },
+    'feishu': {
+        'pool_size': 4,
+        'timeout': (5, 30),
+        'retries': 2,
+        'retry_post': False,
+    },
+}
+
+RETRY_STATUS_CODES = (429, 502, 503, 504)
+
+_sessions = {}
+_lock = threading.Lock()
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """在调用方未指定 timeout 时补上默认超时"""
+
+    def __init__(self, *args, timeout=None, **kwargs):
+        self.timeout = timeout
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        return super().send(request, **kwargs)
+
+
+def _load_http_config():
+    if os.path.exists(CONFIG_FILE):
+        try:
+            with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
+                return json.load(f).get('http', {})
+        except Exception:
+            pass
+    return {}
+
+
+def get_host_settings(name, config=None):
+    """合并默认值与配置中的覆盖项"""
+    overrides = (config or {}).get('http') if config else _load_http_config()
+    settings = dict(DEFAULT_HOST_SETTINGS.get(name, DEFAULT_HOST_SETTINGS['tita']))
+    settings.update((overrides or {}).get(name, {}))
+    if isinstance(settings['timeout'], list):
+        settings['timeout'] = tuple(settings['timeout'])
+    return settings
+
+
+def build_session(settings):
+    allowed_methods = set(Retry.DEFAULT_ALLOWED_METHODS)
+    if settings['retry_post']:
+        allowed_methods.add('POST')
+
+    retry = Retry(
+        total=settings['retries'],
+        read=None if settings.get('retry_read', True) else 0,
+        backoff_factor=0.5,
+        status_forcelist=settings.get('retry_statuses', RETRY_STATUS_CODES),
+        allowed_methods=frozenset(allowed_methods),
+        raise_on_status=False,
+        respect_retry_after_header=True,
+    )
+    adapter = TimeoutHTTPAdapter(
+        timeout=settings['timeout'],
+        pool_connections=settings['pool_size'],
+        pool_maxsize=settings['pool_size'],
+        max_retries=retry,
+    )
+
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_session(name, config=None):
+    """获取指定上游的共享会话（首次调用时创建，进程内复用）"""
+    session = _sessions.get(name)
+    if session is not None:
+        return session
+
+    with _lock:
+        if name not in _sessions:
+            _sessions[name] = build_session(get_host_settings(name, config))
+        return _sessions[name]
+
+
+def close_all():
+    """关闭所有会话，释放连接"""
+    with _lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
@@ -0,0 +1,576 @@
+"""
+火山引擎 LLM 调用入口与响应缓存
+日报分析、v3 事件抽取、周报汇总都通过 chat_completion 访问同一个接口，
+相同请求（模型 + 全部消息 + temperature）的结果缓存在本地 SQLite，重跑、崩溃恢复、
+提示词 A/B 对比时不再为同一请求重复付费。
+
+用法：
+    from llm_client import chat_completion
+    content = chat_completion(messages, model=endpoint_id, api_key=api_key, config=config)
+
+缓存配置（config.json，可选）：
+    "llm_cache": { "enabled": true, "ttl_days": 30, "max_entries": 50000 }
+临时绕过缓存（仍会用新结果刷新缓存）：设置环境变量 LLM_CACHE_BYPASS=1，或调用时传 use_cache=False
+
+需要边生成边处理时使用 stream_chat_completion，逐段产出回复正文。
+
+每次实际发出的请求都记录到 llm_telemetry（调用方由 caller 参数标明，重试序号由 attempt 标明）。
+
+前缀缓存：调用时传 cache_prefix=True，开头的 system 消息会通过火山方舟的上下文缓存接口
+（/context/create，common_prefix 模式）只上传一次，后续请求只发送日报正文；
+接口不可用时自动退回普通请求。命中的 token 数累计在 usage_stats() 中。
+    "llm": { "base_url": "https://ark.cn-beijing.volces.com/api/v3",
+             "context_cache": { "enabled": true, "ttl": 3600 } }
+
+熔断与对冲：同一 Endpoint 连续失败（连接错误、超时、429、5xx）达到阈值后熔断，冷却期内的调用
+直接抛出 CircuitOpenError，调用方把剩余日报交给失败队列，不再逐个等超时。
+开启 hedging 后，请求耗时超过最近观测到的 p95 时再发一个相同的请求，取先返回的结果。
+    "llm": { "circuit_breaker": { "failure_threshold": 5, "cooldown": 60 },
+             "hedging": { "enabled": false, "min_samples": 20, "min_delay": 2 } }
+
+命令行：
+    python llm_client.py stats   # 缓存条数与命中情况
+    python llm_client.py evict   # 清理过期与超量条目
+    python llm_client.py clear   # 清空缓存
+"""
+import hashlib
+import json
+import math
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from circuit_breaker import DEFAULT_COOLDOWN, DEFAULT_FAILURE_THRESHOLD, get_circuit_breaker
+from http_client import get_session
+from llm_telemetry import record_call
+from rate_limiter import get_shared_limiter
+
+DEFAULT_BASE_URL = "https://ark.cn-beijing.volces.com/api/v3"
+DEFAULT_CONTEXT_TTL = 3600
+# 周报等长篇汇总的超时（连接, 读取）：输出很长，volcengine 会话默认的读取超时不够用
+DEFAULT_SUMMARY_TIMEOUT = (5, 300)
+
+# 缓存文件放在本模块旁边，tita-市场 与根目录的周报脚本共用
+CACHE_DB_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'llm_cache.db')
+DEFAULT_CACHE_TTL_DAYS = 30
+DEFAULT_CACHE_MAX_ENTRIES = 50000
+EVICT_EVERY_PUTS = 200
+
+# 未配置 analysis.qps 时，所有 LLM 调用合计的每秒请求上限
+DEFAULT_QPS = 2
+
+# 对冲请求：按最近 LATENCY_WINDOW 次成功请求的 p95 决定何时发备份请求
+LATENCY_WINDOW = 200
+DEFAULT_HEDGE_MIN_SAMPLES = 20
+DEFAULT_HEDGE_MIN_DELAY = 2
+HEDGE_WORKERS = 32
+
+
+def cache_key(model, messages, temperature):
+    """模型、全部消息（含系统提示词）与 temperature 共同决定缓存键"""
+    raw = json.dumps({'model': model, 'messages': messages, 'temperature': temperature},
+                     ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class LLMCache:
+    """
+    内容寻址的 LLM 响应缓存
+    - 超过 ttl_seconds 的条目视为过期
+    - 条目数超过 max_entries 时按最近使用时间淘汰
+    - hits / misses 为本进程内的命中统计
+    """
+
+    def __init__(self, path=CACHE_DB_FILE, ttl_seconds=DEFAULT_CACHE_TTL_DAYS * 86400,
+                 max_entries=DEFAULT_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                cache_key TEXT PRIMARY KEY,
+                model TEXT,
+                response TEXT,
+                created_at REAL,
+                last_used REAL,
+                hit_count INTEGER DEFAULT 0
+            )
+        ''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_llm_cache_last_used ON llm_cache(last_used)')
+        self._conn.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute('SELECT response, created_at FROM llm_cache WHERE cache_key = ?',
+                                     (key,)).fetchone()
+            if row is None or (self.ttl_seconds and now - row[1] > self.ttl_seconds):
+                self.misses += 1
+                return None
+            self._conn.execute('UPDATE llm_cache SET last_used = ?, hit_count = hit_count + 1 WHERE cache_key = ?',
+                               (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, model, response):
+        now = time.time()
+        with self._lock:
+            self._conn.execute('''
+                INSERT INTO llm_cache (cache_key, model, response, created_at, last_used) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(cache_key) DO UPDATE SET
+                    response = excluded.response, created_at = excluded.created_at, last_used = excluded.last_used
+            ''', (key, model, response, now, now))
+            self._puts += 1
+            if self._puts % EVICT_EVERY_PUTS == 0:
+                self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now):
+        if self.ttl_seconds:
+            self._conn.execute('DELETE FROM llm_cache WHERE created_at < ?', (now - self.ttl_seconds,))
+        if self.max_entries:
+            self._conn.execute('''
+                DELETE FROM llm_cache WHERE cache_key IN (
+                    SELECT cache_key FROM llm_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                )
+            ''', (self.max_entries,))
+
+    def evict(self):
+        """清理过期条目并把总条数压到 max_entries 以内"""
+        with self._lock:
+            self._evict(time.time())
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute('DELETE FROM llm_cache')
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            entries, total_hits = self._conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(hit_count), 0) FROM llm_cache').fetchone()
+        lookups = self.hits + self.misses
+        return {
+            'entries': entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+            'total_hits': total_hits,
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache(config=None):
+    """进程内共享的缓存实例；config['llm_cache']['enabled'] 为 false 时返回 None"""
+    global _cache
+    cache_config = (config or {}).get('llm_cache', {})
+    if not cache_config.get('enabled', True):
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = LLMCache(
+                    path=cache_config.get('path', CACHE_DB_FILE),
+                    ttl_seconds=cache_config.get('ttl_days', DEFAULT_CACHE_TTL_DAYS) * 86400,
+                    max_entries=cache_config.get('max_entries', DEFAULT_CACHE_MAX_ENTRIES),
+                )
+    return _cache
+
+
+def cache_stats():
+    """本进程的缓存命中统计；缓存未启用时返回 None"""
+    return _cache.stats() if _cache is not None else None
+
+
+def _cache_bypassed():
+    return os.environ.get('LLM_CACHE_BYPASS', '').lower() in ('1', 'true', 'yes')
+
+
+def get_base_url(config=None):
+    """模型服务地址，config['llm']['base_url'] 可指向其他 OpenAI 兼容服务（如本地替身）"""
+    return ((config or {}).get('llm', {}).get('base_url') or DEFAULT_BASE_URL).rstrip('/')
+
+
+_usage = {'calls': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'cached_tokens': 0}
+_usage_lock = threading.Lock()
+
+
+def _record_usage(usage):
+    usage = usage or {}
+    cached = (usage.get('prompt_tokens_details') or {}).get('cached_tokens', 0) or 0
+    with _usage_lock:
+        _usage['calls'] += 1
+        _usage['prompt_tokens'] += usage.get('prompt_tokens', 0) or 0
+        _usage['completion_tokens'] += usage.get('completion_tokens', 0) or 0
+        _usage['cached_tokens'] += cached
+
+
+def usage_stats():
+    """本进程实际发出的请求数与 token 用量（cached_tokens 为命中前缀缓存的输入 token）"""
+    with _usage_lock:
+        return dict(_usage)
+
+
+_contexts = {}
+_contexts_unsupported = set()
+_contexts_lock = threading.Lock()
+
+
+def _split_prefix(messages):
+    """开头连续的 system 消息作为可缓存的静态前缀"""
+    n = 0
+    while n < len(messages) and messages[n].get('role') == 'system':
+        n += 1
+    return messages[:n], messages[n:]
+
+
+def _get_prefix_context(model, prefix, api_key, config):
+    """为静态前缀创建（或复用）服务端上下文缓存，返回 context_id；不支持时返回 None"""
+    context_config = (config or {}).get('llm', {}).get('context_cache', {})
+    if not context_config.get('enabled', True) or not prefix:
+        return None
+
+    base_url = get_base_url(config)
+    if (base_url, model) in _contexts_unsupported:
+        return None
+
+    key = cache_key(model, prefix, None)
+    now = time.time()
+    with _contexts_lock:
+        context = _contexts.get(key)
+        if context and context[1] > now:
+            return context[0]
+
+        ttl = context_config.get('ttl', DEFAULT_CONTEXT_TTL)
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {api_key}"
+        }
+        try:
+            response = get_session('volcengine', config).post(
+                base_url + '/context/create', headers=headers,
+                json={'model': model, 'mode': 'common_prefix', 'messages': prefix, 'ttl': ttl})
+        except Exception as e:
+            # 超时、连接失败等临时错误只影响本次调用，下次仍尝试创建
+            print(f"上下文缓存创建失败（{model}），本次改用普通请求: {e}")
+            return None
+
+        # 4xx（限流与超时除外）或回复里没有上下文 ID 说明该模型/接入点不支持，之后不再尝试；5xx 视为临时错误
+        status = response.status_code
+        if status >= 500 or status in (408, 429):
+            print(f"上下文缓存创建失败（{model}，HTTP {status}），本次改用普通请求")
+            return None
+        try:
+            if status >= 400:
+                raise ValueError(f"HTTP {status}: {response.text[:200]}")
+            context_id = response.json()['id']
+        except (ValueError, KeyError, TypeError) as e:
+            print(f"上下文缓存不可用（{model}），改用普通请求: {e}")
+            _contexts_unsupported.add((base_url, model))
+            return None
+
+        # 提前一分钟视为过期，避免用到服务端刚失效的上下文
+        _contexts[key] = (context_id, now + max(60, ttl - 60))
+        return context_id
+
+
+def _drop_prefix_context(model, prefix):
+    with _contexts_lock:
+        _contexts.pop(cache_key(model, prefix, None), None)
+
+
+def _record_call(caller, model, usage, latency, attempt, response, parse_ok, error, config):
+    # 连接池（urllib3 Retry）内部的自动重试次数也计入 retries
+    retry_state = getattr(getattr(response, 'raw', None), 'retries', None)
+    history = getattr(retry_state, 'history', None)
+    pool_retries = len(history) if isinstance(history, tuple) else 0
+    record_call(caller, model, usage, latency, attempt + pool_retries,
+                getattr(response, 'status_code', None), parse_ok,
+                f"{type(error).__name__}: {error}" if error else None, config)
+
+
+def _post_chat(session, messages, model, api_key, config, temperature, timeout, url, cache_prefix, stream=False):
+    """发出一次对话请求并返回响应；cache_prefix 时优先走上下文缓存接口"""
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {api_key}"
+    }
+    extra = {"stream": True, "stream_options": {"include_usage": True}} if stream else {}
+
+    if cache_prefix and url is None:
+        prefix, rest = _split_prefix(messages)
+        context_id = _get_prefix_context(model, prefix, api_key, config)
+        if context_id:
+            response = session.post(get_base_url(config) + '/context/chat/completions', headers=headers,
+                                    json={"model": model, "context_id": context_id, "messages": rest,
+                                          "temperature": temperature, **extra}, timeout=timeout, stream=stream)
+            if response.status_code < 400:
+                return response
+            # 上下文过期或被清理：丢弃后按普通请求发送，下次调用重新创建
+            response.close()
+            _drop_prefix_context(model, prefix)
+
+    payload = {
+        "model": model,
+        "messages": messages,
+        "temperature": temperature,
+        **extra
+    }
+    return session.post(url or get_base_url(config) + '/chat/completions', headers=headers,
+                        json=payload, timeout=timeout, stream=stream)
+
+
+def _get_breaker(model, config):
+    breaker_config = (config or {}).get('llm', {}).get('circuit_breaker', {})
+    return get_circuit_breaker(f"volcengine:{model}",
+                               breaker_config.get('failure_threshold', DEFAULT_FAILURE_THRESHOLD),
+                               breaker_config.get('cooldown', DEFAULT_COOLDOWN))
+
+
+def _update_breaker(breaker, response):
+    """连接失败、超时、429 与 5xx 计为上游故障；其余 4xx 是请求本身的问题，不影响熔断"""
+    status = getattr(response, 'status_code', None)
+    if status is None or status == 429 or status >= 500:
+        breaker.on_failure()
+    else:
+        breaker.on_success()
+
+
+_latencies = {}
+_latencies_lock = threading.Lock()
+
+
+def _observe_latency(model, latency):
+    with _latencies_lock:
+        window = _latencies.setdefault(model, deque(maxlen=LATENCY_WINDOW))
+        window.append(latency)
+
+
+def observed_p95(model):
+    """本进程最近 LATENCY_WINDOW 次成功请求的 p95 延迟（秒），样本不足时为 None"""
+    with _latencies_lock:
+        window = sorted(_latencies.get(model, ()))
+    if not window:
+        return None
+    return window[max(0, math.ceil(0.95 * len(window)) - 1)]
+
+
+def _hedge_delay(model, config):
+    """开启对冲且样本足够时，返回发出备份请求前的等待秒数，否则返回 None"""
+    hedge_config = (config or {}).get('llm', {}).get('hedging', {})
+    if not hedge_config.get('enabled', False):
+        return None
+    with _latencies_lock:
+        samples = len(_latencies.get(model, ()))
+    if samples < hedge_config.get('min_samples', DEFAULT_HEDGE_MIN_SAMPLES):
+        return None
+    return max(hedge_config.get('min_delay', DEFAULT_HEDGE_MIN_DELAY), observed_p95(model))
+
+
+_hedge_executor = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix='llm-hedge')
+
+
+def _hedged(request, delay):
+    """
+    对冲请求：主请求超过 delay 秒仍未返回时再发一个相同的请求，取先成功的结果
+    落后的请求在后台自然结束（结果丢弃，照常计入遥测）；两个都失败时抛出主请求的异常
+    """
+    primary = _hedge_executor.submit(request)
+    done, _ = wait([primary], timeout=delay)
+    if done:
+        return primary.result()
+
+    backup = _hedge_executor.submit(request, True)
+    pending = {primary, backup}
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+    return primary.result()
+
+
+def circuit_open(config, model=None):
+    """Endpoint 当前是否处于熔断冷却期（不含可试探的半开状态）"""
+    return _get_breaker(model or (config or {}).get('volcengine_endpoint_id'), config).state == 'open'
+
+
+def chat_completion(messages, model, api_key, config=None, temperature=0.1, timeout=None, url=None,
+                    use_cache=True, parse=None, cache_prefix=False, caller=None, attempt=0):
+    """
+    调用 chat/completions 接口
+    不传 parse 时返回回复正文（str）；传入 parse 时返回 parse(回复正文) 的结果，
+    解析失败时抛出异常，且不写入缓存
+    use_cache=False 或 LLM_CACHE_BYPASS=1 时跳过缓存读取（结果仍写入缓存）
+    cache_prefix=True 时开头的 system 消息走服务端上下文缓存（见模块说明）
+    caller / attempt 写入遥测记录：调用方名称与调用方自己的重试序号（首次为 0）
+    网络或接口错误直接抛出，由调用方决定重试与降级
+    """
+    cache = get_cache(config)
+    key = cache_key(model, messages, temperature) if cache is not None else None
+
+    if cache is not None and use_cache and not _cache_bypassed():
+        cached = cache.get(key)
+        if cached is not None:
+            try:
+                return parse(cached) if parse else cached
+            except Exception:
+                # 旧缓存无法被当前解析逻辑接受时重新请求
+                pass
+
+    breaker = _get_breaker(model, config)
+    breaker.before_call()
+    hedge_delay = _hedge_delay(model, config)
+
+    def request(hedge=False):
+        return _request_once(messages, model, api_key, config, temperature, timeout, url, parse, cache_prefix,
+                             f"{caller or 'unknown'}:hedge" if hedge else caller, attempt, breaker)
+
+    if hedge_delay is None:
+        content, result = request()
+    else:
+        content, result = _hedged(request, hedge_delay)
+
+    if cache is not None:
+        cache.put(key, model, content)
+    return result
+
+
+def _request_once(messages, model, api_key, config, temperature, timeout, url, parse, cache_prefix, caller,
+                  attempt, breaker):
+    """发出一次请求：限速、熔断计数、遥测；返回 (回复正文, 解析结果)"""
+    qps = (config or {}).get('analysis', {}).get('qps', DEFAULT_QPS)
+    get_shared_limiter('volcengine', qps).acquire()
+
+    session = get_session('volcengine', config)
+
+    started = time.time()
+    latency = None
+    response = None
+    usage = None
+    try:
+        try:
+            response = _post_chat(session, messages, model, api_key, config, temperature, timeout, url,
+                                  cache_prefix)
+            response.raise_for_status()
+            res_json = response.json()
+        except Exception:
+            _update_breaker(breaker, response)
+            raise
+        latency = time.time() - started
+        breaker.on_success()
+        _observe_latency(model, latency)
+        usage = res_json.get('usage')
+        _record_usage(usage)
+        content = res_json['choices'][0]['message']['content']
+
+        result = parse(content) if parse else content
+    except Exception as e:
+        _record_call(caller, model, usage, latency or time.time() - started, attempt, response, False, e, config)
+        raise
+
+    _record_call(caller, model, usage, latency, attempt, response, True, None, config)
+    return content, result
+
+
+def stream_chat_completion(messages, model, api_key, config=None, temperature=0.1, timeout=None, url=None,
+                           use_cache=True, cache_prefix=False, caller=None, attempt=0):
+    """
+    流式调用（SSE），逐段产出回复正文，参数含义同 chat_completion
+    只有完整结束（finish_reason=stop）的回复才写入缓存；命中缓存时一次产出全部正文
+    回复因长度被截断时正常结束，连接中断等错误在已产出部分之后抛出，由调用方决定如何续写
+    """
+    cache = get_cache(config)
+    key = cache_key(model, messages, temperature) if cache is not None else None
+
+    if cache is not None and use_cache and not _cache_bypassed():
+        cached = cache.get(key)
+        if cached is not None:
+            yield cached
+            return
+
+    breaker = _get_breaker(model, config)
+    breaker.before_call()
+    qps = (config or {}).get('analysis', {}).get('qps', DEFAULT_QPS)
+    get_shared_limiter('volcengine', qps).acquire()
+    session = get_session('volcengine', config)
+
+    started = time.time()
+    response = None
+    usage = None
+    finish_reason = None
+    parts = []
+    error = None
+    try:
+        try:
+            response = _post_chat(session, messages, model, api_key, config, temperature, timeout, url,
+                                  cache_prefix, stream=True)
+            response.raise_for_status()
+        except Exception:
+            _update_breaker(breaker, response)
+            raise
+        breaker.on_success()
+        for line in response.iter_lines():
+            line = line.decode('utf-8') if isinstance(line, bytes) else line
+            if not line.startswith('data:'):
+                continue
+            data = line[5:].strip()
+            if data == '[DONE]':
+                break
+            chunk = json.loads(data)
+            if chunk.get('usage'):
+                usage = chunk['usage']
+            for choice in chunk.get('choices') or []:
+                delta = (choice.get('delta') or {}).get('content')
+                if delta:
+                    parts.append(delta)
+                    yield delta
+                if choice.get('finish_reason'):
+                    finish_reason = choice['finish_reason']
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        if response is not None:
+            response.close()
+        _record_usage(usage)
+        if error is None and finish_reason not in (None, 'stop'):
+            error = RuntimeError(f"finish_reason={finish_reason}")
+        _record_call(caller, model, usage, time.time() - started, attempt, response, finish_reason == 'stop',
+                     error, config)
+
+    if cache is not None and finish_reason == 'stop':
+        cache.put(key, model, ''.join(parts))
+
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else 'stats'
+    cache = LLMCache()
+    if command == 'clear':
+        cache.clear()
+        print("LLM 缓存已清空")
+    elif command == 'evict':
+        cache.evict()
+        print(f"清理完成，剩余 {cache.stats()['entries']} 条")
+    else:
+        stats = cache.stats()
+        print(f"缓存文件: {cache.path}")
+        print(f"缓存条数: {stats['entries']}，累计命中: {stats['total_hits']} 次")
+
+
+if __name__ == "__main__":
+    main()
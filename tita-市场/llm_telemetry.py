@@ -0,0 +1,230 @@
+"""
+LLM 调用遥测
+llm_client.chat_completion 每发出一次请求（命中本地缓存的不算）记录一行：
+调用方、模型、输入/输出/前缀缓存 token、耗时、重试次数、HTTP 状态码、解析是否成功。
+用于评估并发与限速设置、发现 Endpoint 变慢或失败率上升。
+
+记录先放在内存里，攒够 FLUSH_EVERY 条或超过 FLUSH_INTERVAL 秒后一次性写入，进程退出时补写。
+
+命令行：
+    python llm_telemetry.py              # 最近 7 天的延迟 / 吞吐 / token 报告
+    python llm_telemetry.py --days 30
+    python llm_telemetry.py --caller extract_v3
+
+配置（config.json，可选）：
+    "llm_telemetry": { "enabled": true }
+"""
+import argparse
+import atexit
+import datetime
+import math
+import os
+import sqlite3
+import threading
+import time
+
+# 与 llm_cache.db 一样放在本模块旁边，tita-市场 与根目录的周报脚本共用
+TELEMETRY_DB_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'llm_telemetry.db')
+FLUSH_EVERY = 50
+FLUSH_INTERVAL = 5
+DEFAULT_REPORT_DAYS = 7
+
+_pending = []
+_last_flush = time.time()
+_lock = threading.Lock()
+_initialized = set()
+
+
+def _connect(path=TELEMETRY_DB_FILE):
+    conn = sqlite3.connect(path, timeout=30)
+    if path not in _initialized:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS llm_calls (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                ts REAL,                   -- 请求发出时间（unix 秒）
+                day TEXT,                  -- 本地日期 YYYY-MM-DD
+                caller TEXT,               -- daily_analysis / daily_batch / extract_v3 / weekly_summary ...
+                model TEXT,
+                prompt_tokens INTEGER,
+                completion_tokens INTEGER,
+                cached_tokens INTEGER,
+                latency_ms INTEGER,
+                retries INTEGER,           -- 调用方重试序号 + 连接池自动重试次数
+                http_status INTEGER,       -- 未收到响应时为 NULL
+                parse_ok INTEGER,          -- 回复被成功解析为 1
+                error TEXT
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_llm_calls_day ON llm_calls(day)')
+        conn.commit()
+        _initialized.add(path)
+    return conn
+
+
+def record_call(caller, model, usage, latency, retries, http_status, parse_ok, error=None, config=None):
+    """记录一次模型调用；latency 单位为秒"""
+    if not (config or {}).get('llm_telemetry', {}).get('enabled', True):
+        return
+    now = time.time()
+    usage = usage or {}
+    row = (
+        now - latency,
+        datetime.date.fromtimestamp(now).isoformat(),
+        caller or 'unknown',
+        model,
+        usage.get('prompt_tokens', 0) or 0,
+        usage.get('completion_tokens', 0) or 0,
+        (usage.get('prompt_tokens_details') or {}).get('cached_tokens', 0) or 0,
+        int(latency * 1000),
+        retries,
+        http_status,
+        1 if parse_ok else 0,
+        (error or '')[:500] or None,
+    )
+    with _lock:
+        _pending.append(row)
+        due = len(_pending) >= FLUSH_EVERY or now - _last_flush >= FLUSH_INTERVAL
+    if due:
+        flush()
+
+
+def flush():
+    """把内存中的记录写入数据库"""
+    global _last_flush
+    with _lock:
+        rows = _pending[:]
+        _pending.clear()
+        _last_flush = time.time()
+    if not rows:
+        return
+    try:
+        conn = _connect()
+        try:
+            conn.executemany('''
+                INSERT INTO llm_calls (ts, day, caller, model, prompt_tokens, completion_tokens, cached_tokens,
+                                       latency_ms, retries, http_status, parse_ok, error)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', rows)
+            conn.commit()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        # 遥测写入失败不影响业务调用
+        print(f"LLM telemetry write failed: {e}")
+
+
+atexit.register(flush)
+
+
+def _percentile(sorted_values, pct):
+    """最近秩法百分位"""
+    if not sorted_values:
+        return None
+    return sorted_values[max(0, math.ceil(pct / 100 * len(sorted_values)) - 1)]
+
+
+def _summarize_rows(rows):
+    """rows: [(ts, latency_ms, http_status, parse_ok, retries, prompt, completion, cached)]"""
+    latencies = sorted(r[1] for r in rows)
+    per_minute = {}
+    for r in rows:
+        per_minute[int(r[0] // 60)] = per_minute.get(int(r[0] // 60), 0) + 1
+    calls = len(rows)
+    return {
+        'calls': calls,
+        'errors': sum(1 for r in rows if r[2] is None or r[2] >= 400),
+        'parse_failures': sum(1 for r in rows if r[2] is not None and r[2] < 400 and not r[3]),
+        'retried': sum(1 for r in rows if r[4]),
+        'p50_ms': _percentile(latencies, 50),
+        'p95_ms': _percentile(latencies, 95),
+        'max_ms': latencies[-1] if latencies else None,
+        # 吞吐按有调用的分钟计算，空闲时段不摊薄
+        'calls_per_min': round(calls / len(per_minute), 2) if per_minute else 0.0,
+        'peak_calls_per_min': max(per_minute.values()) if per_minute else 0,
+        'prompt_tokens': sum(r[5] for r in rows),
+        'completion_tokens': sum(r[6] for r in rows),
+        'cached_tokens': sum(r[7] for r in rows),
+    }
+
+
+def summarize(days=DEFAULT_REPORT_DAYS, caller=None, path=TELEMETRY_DB_FILE):
+    """
+    最近 days 天的调用统计
+    返回 {'overall': {...}, 'by_caller': {caller: {...}}, 'by_model': {model: {...}},
+          'by_day': [{day, calls, tokens...}]}
+    """
+    flush()
+    since = (datetime.date.today() - datetime.timedelta(days=max(1, days) - 1)).isoformat()
+    sql = '''
+        SELECT ts, latency_ms, http_status, parse_ok, retries, prompt_tokens, completion_tokens, cached_tokens,
+               caller, day, model
+        FROM llm_calls WHERE day >= ?
+    '''
+    params = [since]
+    if caller:
+        sql += ' AND caller = ?'
+        params.append(caller)
+
+    conn = _connect(path)
+    try:
+        rows = conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
+
+    by_caller = {}
+    by_model = {}
+    by_day = {}
+    for r in rows:
+        by_caller.setdefault(r[8], []).append(r)
+        by_model.setdefault(r[10] or 'unknown', []).append(r)
+        by_day.setdefault(r[9], []).append(r)
+
+    return {
+        'since': since,
+        'overall': _summarize_rows(rows),
+        'by_caller': {name: _summarize_rows(items) for name, items in sorted(by_caller.items())},
+        'by_model': {name: _summarize_rows(items) for name, items in sorted(by_model.items())},
+        'by_day': [dict(day=day, **{k: v for k, v in _summarize_rows(items).items()
+                                   if k in ('calls', 'errors', 'p50_ms', 'p95_ms', 'prompt_tokens',
+                                            'completion_tokens', 'cached_tokens')})
+                   for day, items in sorted(by_day.items())],
+    }
+
+
+def _format_stats(name, s):
+    return (f"{name:<16} 调用 {s['calls']:>6}  失败 {s['errors']:>4}  解析失败 {s['parse_failures']:>4}  "
+            f"p50 {s['p50_ms'] or 0:>6}ms  p95 {s['p95_ms'] or 0:>6}ms  "
+            f"{s['calls_per_min']:>6}/分钟（峰值 {s['peak_calls_per_min']}）  "
+            f"token 入 {s['prompt_tokens']} / 出 {s['completion_tokens']} / 缓存 {s['cached_tokens']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='LLM 调用延迟 / 吞吐 / token 报告')
+    parser.add_argument('--days', type=int, default=DEFAULT_REPORT_DAYS, help='统计最近几天（含今天）')
+    parser.add_argument('--caller', help='只看某个调用方')
+    args = parser.parse_args()
+
+    report = summarize(args.days, args.caller)
+    print(f"统计区间: {report['since']} 起，数据文件: {TELEMETRY_DB_FILE}")
+    if not report['overall']['calls']:
+        print("暂无调用记录")
+        return
+
+    print("\n按调用方:")
+    print(_format_stats('合计', report['overall']))
+    for name, stats in report['by_caller'].items():
+        print(_format_stats(name, stats))
+
+    print("\n按模型:")
+    for name, stats in report['by_model'].items():
+        print(_format_stats(name, stats))
+
+    print("\n按天:")
+    for day in report['by_day']:
+        print(f"{day['day']}  调用 {day['calls']:>6}  失败 {day['errors']:>4}  "
+              f"p50 {day['p50_ms'] or 0:>6}ms  p95 {day['p95_ms'] or 0:>6}ms  "
+              f"token 入 {day['prompt_tokens']} / 出 {day['completion_tokens']} / 缓存 {day['cached_tokens']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+"""
+模型分级路由
+日报分类分析、合并分析与 v3 事件抽取默认走便宜快速的 cheap 档 Endpoint，
+以下情况改用 strong 档（volcengine_endpoint_id）：
+  - 正文超过 max_chars 字，或提到的学校不少于 max_schools 所（调用前判断）
+  - cheap 档回复无法解析 / 请求失败，或抽取出的事件 event_conf 低于 min_confidence（调用后升级重跑）
+
+命令行：
+    python model_router.py              # 最近 7 天按档位的调用数、延迟与估算费用
+    python model_router.py --days 30
+    python -m doctest model_router.py   # 校名识别的路由检查用例（见 school_names）
+
+配置（config.json，可选；未填 cheap_endpoint_id 时所有调用仍走 volcengine_endpoint_id）：
+    "llm": { "routing": { "enabled": true, "cheap_endpoint_id": "ep-xxx",
+                          "max_chars": 600, "max_schools": 2, "min_confidence": 0.7,
+                          "prices": { "cheap": {"input": 0.3, "output": 0.6},
+                                      "strong": {"input": 0.8, "output": 2.0} } } }
+    prices 为每百万 token 的价格（元），只用于报告中的费用估算
+"""
+import argparse
+import json
+import os
+import re
+import threading
+
+TIER_CHEAP = 'cheap'
+TIER_STRONG = 'strong'
+
+DEFAULT_MAX_CHARS = 600
+DEFAULT_MAX_SCHOOLS = 2
+DEFAULT_MIN_CONFIDENCE = 0.7
+
+# 「大学生」「中学生」说的是学生，不是学校
+_SCHOOL_SUFFIX_RE = re.compile(r'大学(?!生)|学院|中学(?!生)|小学(?!生)|学校|幼儿园|附中|[一二三四五六七八九十\d]+中(?!学)')
+_GENERIC_SUFFIXES = ('大学', '学院', '中学', '小学', '学校', '幼儿园', '附中')
+_SCHOOL_PREFIX_RE = re.compile(r'[\u4e00-\u9fa5]{1,8}$')
+# 校名之前常见的时间词、动词和连接词，截掉它们及其之前的部分（单字词容易是校名的一部分，见 _trim_school_prefix）
+_LEADING_WORDS = ('今天', '昨天', '明天', '上午', '下午', '晚上', '随后', '然后', '之后', '再次', '回到', '前往',
+                  '拜访', '走访', '联系', '对接', '跟进', '约见', '沟通', '到访', '又', '再', '去', '到', '和',
+                  '与', '跟', '及', '在', '给', '向', '对', '了', '的')
+
+_stats = {TIER_CHEAP: 0, TIER_STRONG: 0, 'escalated': {}}
+_stats_lock = threading.Lock()
+
+
+def routing_config(config):
+    return (config or {}).get('llm', {}).get('routing', {})
+
+
+def routing_enabled(config):
+    routing = routing_config(config)
+    return bool(routing.get('enabled') and routing.get('cheap_endpoint_id'))
+
+
+def _trim_school_prefix(prefix, min_rest=2):
+    """去掉校名前面混进来的时间词、动词等，只保留校名本身；单字词截完须至少剩 min_rest 个字"""
+    cut = 0
+    for word in _LEADING_WORDS:
+        end = prefix.rfind(word) + len(word)
+        if end > cut and word in prefix and (len(word) > 1 or len(prefix) - end >= min_rest):
+            cut = end
+    return prefix[cut:]
+
+
+def _only_leading_words(text):
+    """text 是否完全由 _LEADING_WORDS 中的词拼成（空串也算）"""
+    if not text:
+        return True
+    return any(text.startswith(w) and _only_leading_words(text[len(w):]) for w in _LEADING_WORDS)
+
+
+def _is_school_name(name):
+    """通用后缀前的名字：至少两个字、不全是修饰词、也不以单字虚词结尾（「在学校」「开会后到学校」）"""
+    return len(name) >= 2 and not _only_leading_words(name) and \
+        not any(len(w) == 1 and name.endswith(w) for w in _LEADING_WORDS)
+
+
+def school_names(content):
+    """
+    正文中提到的校名（按校名后缀识别并截掉前面的修饰词），按名称去重
+
+    >>> sorted(school_names('今天拜访北京大学老师，随后又回到北京大学签约'))
+    ['北京大学']
+    >>> sorted(school_names('到十一中和一中'))
+    ['一中', '十一中']
+    >>> sorted(school_names('拜访和平中学与育才中学'))
+    ['和平中学', '育才中学']
+    >>> sorted(school_names('去北京大学附中和人大附中'))
+    ['人大附中', '北京大学附中']
+    >>> school_names('在学校开会'), school_names('和大学生沟通'), school_names('去了学校')
+    (set(), set(), set())
+    """
+    content = content or ''
+    matches = list(_SCHOOL_SUFFIX_RE.finditer(content))
+    names = set()
+    prev_end = 0
+    for i, m in enumerate(matches):
+        # 「北京大学附中」这类紧接着另一个后缀的只算后面那一个
+        if i + 1 < len(matches) and matches[i + 1].start() == m.end():
+            continue
+        prefix = _SCHOOL_PREFIX_RE.search(content[prev_end:m.start()])
+        prev_end = m.end()
+        # 「三中」「十一中」本身就是校名，「大学」「中学」等通用后缀前面必须有名字
+        if m.group() not in _GENERIC_SUFFIXES:
+            names.add((_trim_school_prefix(prefix.group(), 0) if prefix else '') + m.group())
+        elif prefix:
+            name = _trim_school_prefix(prefix.group())
+            if _is_school_name(name):
+                names.add(name + m.group())
+    # 截不干净时同一所学校会留下「拜访北京大学」「北京大学」两种写法：
+    # 只有多出来的部分全是修饰词时才算同一所，「十一中」与「一中」是两所学校
+    return {n for n in names
+            if not any(o != n and n.endswith(o) and _only_leading_words(n[:-len(o)]) for o in names)}
+
+
+def count_schools(content):
+    """正文中提到的不同学校数"""
+    return len(school_names(content))
+
+
+def route_tier(content, config):
+    """按正文长度与提到的学校数选择档位（不计入路由统计）"""
+    if not routing_enabled(config):
+        return TIER_STRONG
+    routing = routing_config(config)
+    if len(content or '') > routing.get('max_chars', DEFAULT_MAX_CHARS) or \
+            count_schools(content) >= routing.get('max_schools', DEFAULT_MAX_SCHOOLS):
+        return TIER_STRONG
+    return TIER_CHEAP
+
+
+def select_tier(content, config):
+    """route_tier 选择档位，并计入本次运行的路由统计"""
+    tier = route_tier(content, config)
+    if not routing_enabled(config):
+        return tier
+    with _stats_lock:
+        _stats[tier] += 1
+    return tier
+
+
+def endpoint_for(tier, config):
+    if tier == TIER_CHEAP and routing_enabled(config):
+        return routing_config(config)['cheap_endpoint_id']
+    return config.get('volcengine_endpoint_id')
+
+
+def _event_conf(event):
+    """事件的 event_conf；缺失或不是数字时按 0 计"""
+    conf = event.get('event_conf', 0)
+    return conf if isinstance(conf, (int, float)) and not isinstance(conf, bool) else 0
+
+
+def low_confidence(events, config):
+    """抽取结果中有事件的 event_conf 低于 min_confidence（不是数字的视为过低），非对象的项忽略"""
+    threshold = routing_config(config).get('min_confidence', DEFAULT_MIN_CONFIDENCE)
+    return any(_event_conf(e) < threshold for e in events or [] if isinstance(e, dict))
+
+
+def escalate(reason):
+    """cheap 档结果不可用，升级到 strong 档重跑；返回 TIER_STRONG"""
+    with _stats_lock:
+        _stats['escalated'][reason] = _stats['escalated'].get(reason, 0) + 1
+        _stats[TIER_STRONG] += 1
+    return TIER_STRONG
+
+
+def routing_stats():
+    """本进程的路由统计：{'cheap': n, 'strong': n, 'escalated': {原因: n}}"""
+    with _stats_lock:
+        return {TIER_CHEAP: _stats[TIER_CHEAP], TIER_STRONG: _stats[TIER_STRONG],
+                'escalated': dict(_stats['escalated'])}
+
+
+def format_routing_stats():
+    stats = routing_stats()
+    escalated = sum(stats['escalated'].values())
+    detail = '，'.join(f"{reason} {n}" for reason, n in sorted(stats['escalated'].items()))
+    return (f"模型路由: cheap {stats[TIER_CHEAP]} 次，strong {stats[TIER_STRONG]} 次"
+            + (f"（其中升级 {escalated} 次: {detail}）" if escalated else ""))
+
+
+def tier_of(model, config):
+    if routing_enabled(config) and model == routing_config(config)['cheap_endpoint_id']:
+        return TIER_CHEAP
+    if model == config.get('volcengine_endpoint_id'):
+        return TIER_STRONG
+    return None
+
+
+def estimate_cost(stats, tier, config):
+    """按 prices 估算费用（元）；未配置价格时返回 None"""
+    price = routing_config(config).get('prices', {}).get(tier)
+    if not price:
+        return None
+    return (stats['prompt_tokens'] * price.get('input', 0) +
+            stats['completion_tokens'] * price.get('output', 0)) / 1_000_000
+
+
+def tier_report(config, days=7):
+    """llm_telemetry 中按模型的统计，附上档位与估算费用"""
+    from llm_telemetry import summarize
+
+    report = []
+    for model, stats in summarize(days)['by_model'].items():
+        tier = tier_of(model, config)
+        report.append(dict(stats, model=model, tier=tier or '-',
+                           cost=estimate_cost(stats, tier, config) if tier else None))
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='按模型档位输出调用延迟与估算费用')
+    parser.add_argument('--days', type=int, default=7, help='统计最近几天（含今天）')
+    args = parser.parse_args()
+
+    config = {}
+    if os.path.exists('config.json'):
+        with open('config.json', 'r', encoding='utf-8') as f:
+            config = json.load(f)
+
+    report = tier_report(config, args.days)
+    if not report:
+        print("暂无调用记录")
+        return
+    for row in sorted(report, key=lambda r: r['tier']):
+        cost = f"{row['cost']:.2f} 元" if row['cost'] is not None else "未配置价格"
+        print(f"{row['tier']:<7} {row['model']:<24} 调用 {row['calls']:>6}  p50 {row['p50_ms'] or 0:>6}ms  "
+              f"p95 {row['p95_ms'] or 0:>6}ms  token 入 {row['prompt_tokens']} / 出 {row['completion_tokens']}  "
+              f"费用 {cost}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+有界队列流水线
+数据源与各处理阶段分别运行在独立线程中，阶段之间用有界队列连接：
+  - 上游比下游快时在队列满处阻塞，内存占用只取决于队列长度，与数据总量无关
+  - 任一阶段抛出异常时整条流水线停止，异常在消费端重新抛出
+  - 消费端提前结束（break / close）时通知上游线程退出
+
+用法：
+    for result in run_pipeline(source, [('normalize', normalize, 1), ('analyze', analyze, 4)]):
+        persist(result)
+
+阶段函数接收一个元素、返回下一阶段的元素；返回 None 表示丢弃该元素。
+阶段写成 (名称, 函数, worker数, batch_size) 且 batch_size > 1 时为批处理阶段：
+worker 取到一个元素后顺带取走队列中已就绪的元素（不等待，最多 batch_size 个），
+函数接收元素列表、返回结果列表。
+多个 worker 的阶段不保证输出顺序。
+"""
+import queue
+import threading
+
+DEFAULT_QUEUE_SIZE = 40
+
+_END = object()
+
+
+def run_pipeline(source, stages, queue_size=DEFAULT_QUEUE_SIZE):
+    """
+    source: 可迭代对象，在独立线程中逐个读取
+    stages: [(名称, 函数, worker数), ...] 或 [(名称, 函数, worker数, batch_size), ...]
+    返回生成器，逐个产出最后一个阶段的结果
+    """
+    stop = threading.Event()
+    errors = []
+    queues = [queue.Queue(maxsize=max(1, queue_size)) for _ in range(len(stages) + 1)]
+
+    def put(q, item):
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def get(q):
+        while not stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _END
+
+    def fail(name, e):
+        print(f"Pipeline stage '{name}' failed: {e}")
+        errors.append(e)
+        stop.set()
+
+    def produce():
+        try:
+            for item in source:
+                if not put(queues[0], item):
+                    return
+        except Exception as e:
+            fail('source', e)
+            return
+        put(queues[0], _END)
+
+    def work(name, func, inq, outq, live, batch_size):
+        while True:
+            item = get(inq)
+            ended = item is _END
+            batch = [] if ended else [item]
+            while batch_size > 1 and not ended and len(batch) < batch_size:
+                try:
+                    more = inq.get_nowait()
+                except queue.Empty:
+                    break
+                if more is _END:
+                    ended = True
+                else:
+                    batch.append(more)
+
+            if batch:
+                try:
+                    results = func(batch) if batch_size > 1 else [func(batch[0])]
+                except Exception as e:
+                    fail(name, e)
+                    return
+                for result in results:
+                    if result is not None and not put(outq, result):
+                        return
+
+            if ended:
+                # 放回结束标记让同阶段其他 worker 也能看到，最后一个退出的 worker 向下游传递
+                put(inq, _END)
+                with live['lock']:
+                    live['count'] -= 1
+                    last = live['count'] == 0
+                if last:
+                    put(outq, _END)
+                return
+
+    threads = [threading.Thread(target=produce, name='pipeline-source', daemon=True)]
+    for idx, stage in enumerate(stages):
+        name, func, workers = stage[:3]
+        batch_size = stage[3] if len(stage) > 3 else 1
+        workers = max(1, workers)
+        live = {'count': workers, 'lock': threading.Lock()}
+        for n in range(workers):
+            threads.append(threading.Thread(target=work,
+                                            args=(name, func, queues[idx], queues[idx + 1], live, batch_size),
+                                            name=f'pipeline-{name}-{n}', daemon=True))
+
+    def consume():
+        for t in threads:
+            t.start()
+        try:
+            while True:
+                item = get(queues[-1])
+                if item is _END:
+                    break
+                yield item
+            if errors:
+                raise errors[0]
+        finally:
+            stop.set()
+            for t in threads:
+                t.join()
+
+    return consume()
@@ -11,7 +11,7 @@ DB_FILE = 'tita_logs.db'
 PROMOTION_RULES = {
     'freq_7d': 5,           # 近7天出现≥5次
     'distinct_schools': 3,   # 覆盖≥3个学校
-    'consistency_rate': 0.8, # 双跑一致率≥80%
+    'consistency_rate': 0.8, # 双跑一致率≥80%（Silver / 双跑事件，不含 pending）
     'similarity_threshold': 0.7  # 与现有stable标签相似度<70%才允许晋升
 }
 
@@ -41,11 +41,14 @@ def calculate_tag_stats(conn):
         ''', (name_norm,))
         distinct_schools = c.fetchone()[0]
         
-        # 计算 consistency_rate（在Silver事件中出现的比例）
+        # 计算 consistency_rate（在双跑事件中为Silver的比例）
+        # pending（单跑：自适应跳过 Run B、Run B 失败或合并分析写入）没有一致性结论，不计入分母；
+        # 它们仍计入 freq_7d 与 distinct_schools。只出现在 pending 事件中的标签一致率为 0，
+        # 需等抽检或复核（extraction.confirm_pending）产生双跑事件后才可能晋升
         c.execute(f'''
             SELECT 
                 COUNT(CASE WHEN consistency_flag = 'silver' THEN 1 END) as silver_count,
-                COUNT(*) as total_count
+                COUNT(CASE WHEN consistency_flag != 'pending' THEN 1 END) as total_count
             FROM events_v3 
             WHERE {dimension} = ?
         ''', (name_norm,))
@@ -0,0 +1,113 @@
+"""
+线程安全的请求限速器
+多个线程共享同一个实例时，保证整体请求速率不超过 rate 次/秒
+"""
+import threading
+import time
+
+
+class RateLimiter:
+    """按固定间隔放行请求，rate<=0 表示不限速"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self._lock = threading.Lock()
+        self._next_time = 0.0
+
+    def acquire(self):
+        """阻塞直到允许发出下一个请求"""
+        if not self.rate or self.rate <= 0:
+            return
+
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_time)
+            self._next_time = start + 1.0 / self.rate
+
+        wait = start - now
+        if wait > 0:
+            time.sleep(wait)
+
+    def on_throttled(self):
+        """固定速率，不做调整"""
+
+    def on_success(self):
+        """固定速率，不做调整"""
+
+
+class AdaptiveRateLimiter:
+    """
+    自适应令牌桶限速器（AIMD）
+    - 上游返回 429/5xx 时调用 on_throttled()，速率减半（不低于 min_rate）
+    - 请求正常时调用 on_success()，速率按 max_rate 的 1/10 逐步回升
+    rate<=0 表示不限速，此时不做自适应
+    """
+
+    def __init__(self, rate, min_rate=None, burst=1):
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min_rate if min_rate is not None else (rate / 8 if rate else 0)
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def set_rate(self, rate):
+        with self._lock:
+            self.max_rate = rate
+            self.min_rate = rate / 8 if rate else 0
+            self.rate = min(self.rate, rate) if self.rate and rate else rate
+
+    def _refill(self, now):
+        elapsed = now - self._updated
+        self._updated = now
+        self._tokens = min(self.burst, self._tokens + elapsed * self.rate)
+
+    def acquire(self):
+        """阻塞直到取得一个令牌"""
+        while True:
+            with self._lock:
+                if not self.rate or self.rate <= 0:
+                    return
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def on_throttled(self):
+        with self._lock:
+            if self.rate and self.rate > 0:
+                self._refill(time.monotonic())
+                self.rate = max(self.min_rate, self.rate / 2)
+
+    def on_success(self):
+        with self._lock:
+            if self.rate and self.rate > 0 and self.rate < self.max_rate:
+                self._refill(time.monotonic())
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 10)
+
+
+_shared_limiters = {}
+_shared_lock = threading.Lock()
+
+
+def get_shared_limiter(name, rate, adaptive=False):
+    """
+    按名称获取进程内共享的限速器
+    多个任务（如并行回填的多个日期）同时访问同一上游时共用一个速率上限
+    adaptive=True 时返回 AdaptiveRateLimiter
+    """
+    with _shared_lock:
+        limiter = _shared_limiters.get(name)
+        if limiter is None:
+            limiter_cls = AdaptiveRateLimiter if adaptive else RateLimiter
+            limiter = _shared_limiters[name] = limiter_cls(rate)
+        elif isinstance(limiter, AdaptiveRateLimiter):
+            if limiter.max_rate != rate:
+                limiter.set_rate(rate)
+        else:
+            limiter.rate = rate
+        return limiter
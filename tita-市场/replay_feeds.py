@@ -0,0 +1,68 @@
+"""
+原始日报离线重放
+从 raw_feeds 归档重建 daily_logs，不访问 Tita 接口。
+适用于修改了正文拼接规则或分析提示词之后的本地重处理。
+
+使用方式：
+python replay_feeds.py 2025-10-01 2025-12-31              # 重建正文，正文未变的复用已有分析（缺失或正文变化的才调用LLM）
+python replay_feeds.py 2025-10-01 2025-12-31 --reanalyze  # 重建正文并全部重新分析
+python replay_feeds.py 2025-10-01 --report                # 同时重新生成当天的 Markdown 报告
+"""
+import argparse
+import os
+import sys
+
+import daily_log_aggregator as aggregator
+from backfill import split_days
+
+
+def replay_day(config, log_date, conn, reanalyze=False, report=False):
+    """重放单天归档，返回统计"""
+    feeds = aggregator.load_archived_feeds(conn, log_date)
+    filtered = aggregator.filter_logs(feeds, config['target_departments'])
+
+    reuse = None if reanalyze else (lambda feed: True)
+    processed, stats = aggregator.process_feeds(config, log_date, conn, filtered,
+                                                reuse_analysis=reuse, save_reused=True)
+    stats.update({'archived': len(feeds), 'filtered': len(filtered)})
+
+    if report and processed:
+        aggregator.generate_report(processed, log_date, config)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='从原始日报归档重建 daily_logs')
+    parser.add_argument('start', help='开始日期 YYYY-MM-DD')
+    parser.add_argument('end', nargs='?', help='结束日期 YYYY-MM-DD（含，默认同开始日期）')
+    parser.add_argument('--reanalyze', action='store_true', help='忽略已有分析结果，全部重新调用LLM分析')
+    parser.add_argument('--report', action='store_true', help='重新生成每天的 Markdown 报告')
+    args = parser.parse_args()
+
+    if not os.path.exists(aggregator.CONFIG_FILE):
+        print(f"Config file {aggregator.CONFIG_FILE} not found!")
+        sys.exit(1)
+
+    config = aggregator.load_config()
+    conn = aggregator.init_db()
+
+    totals = {'archived': 0, 'filtered': 0, 'analyzed': 0, 'skipped': 0, 'edited': 0}
+    for log_date in split_days(args.start, args.end or args.start):
+        stats = replay_day(config, log_date, conn, reanalyze=args.reanalyze, report=args.report)
+        if not stats['archived']:
+            continue
+        for key in totals:
+            totals[key] += stats[key]
+        print(f"[OK] {log_date}: 归档 {stats['archived']} 条，重建 {stats['filtered']} 条，"
+              f"分析 {stats['analyzed']} 条（其中正文变化 {stats['edited']} 条），复用 {stats['skipped']} 条")
+
+    conn.close()
+
+    print("\n" + "=" * 60)
+    print(f"  重放完成: 归档 {totals['archived']} 条，重建 {totals['filtered']} 条")
+    print(f"  调用LLM分析 {totals['analyzed']} 条，复用已有分析 {totals['skipped']} 条")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+"""
+LLM 结构化输出的校验与修复
+日报分类（JSON 对象）与 v3 事件抽取（JSON 数组）共用：
+  - repair_json: 修复常见的格式问题后解析——Markdown 代码块、前后说明文字、尾随逗号、
+    全角引号/冒号/逗号、字符串内的换行、回复被截断（丢弃最后一个不完整的元素并补齐括号）
+  - parse_structured: repair_json + conform；截断时丢掉的对象字段也算作字段级问题，调用方可以只追问这些字段
+  - conform: 按 schema 归一字段类型（null 转空串、数字字符串转数字、置信度截到 0~1），
+    返回仍然缺失或无效的字段路径，调用方只需针对这些字段追问，不必整篇重试
+
+schema 采用 JSON Schema 的一个子集：type / properties / required / items / minimum / maximum。
+"""
+import json
+import re
+
+# v3 事件抽取的单个事件
+_CONF = {'type': 'number', 'minimum': 0, 'maximum': 1}
+_TEXT = {'type': 'string'}
+EVENT_SCHEMA = {
+    'type': 'object',
+    'required': ['raw_span', 'school_raw', 'action_type', 'event_conf'],
+    'properties': {
+        'raw_span': _TEXT,
+        'school_raw': _TEXT,
+        'school_norm': _TEXT,
+        'school_conf': _CONF,
+        'product_raw': _TEXT,
+        'product_norm': _TEXT,
+        'product_conf': _CONF,
+        'action_type': _TEXT,
+        'action_type_conf': _CONF,
+        'blocker': _TEXT,
+        'blocker_conf': _CONF,
+        'outcome': _TEXT,
+        'outcome_conf': _CONF,
+        'event_conf': _CONF,
+    },
+}
+EVENT_LIST_SCHEMA = {'type': 'array', 'items': EVENT_SCHEMA}
+
+_FULLWIDTH_PUNCT = {'：': ':', '，': ','}
+_CLOSERS = {'{': '}', '[': ']'}
+_MEMBER_KEY_RE = re.compile(r'\s*,?\s*("(?:[^"\\]|\\.)*")\s*:')
+
+
+def category_schema(categories):
+    """日报分类结果：每个类别一个字符串（没有内容时为空串）"""
+    return {
+        'type': 'object',
+        'required': list(categories),
+        'properties': {cat: _TEXT for cat in categories},
+    }
+
+
+def strip_fences(text):
+    return (text or '').replace('```json', '').replace('```', '').strip()
+
+
+def _scan(text, mixed_quotes=False):
+    """
+    逐字符规范化 JSON 文本，返回 (规范化文本, 未闭合的括号栈, 是否停在字符串内, 截断回退点)
+    回退点为最后一个完整元素之后的位置与当时的括号栈，用于处理截断；
+    只在顶层元素（数组元素或对象字段）之间设回退点，截断在某个元素内部时整个元素都会被丢弃
+    mixed_quotes=True 时以 “ 开头的字符串也可以用半角引号结束
+    """
+    out = []
+    stack = []
+    quote = None        # 当前字符串的结束引号，不在字符串内为 None
+    escape = False
+    cut = None
+    for ch in text:
+        if quote:
+            if escape:
+                escape = False
+                out.append(ch)
+            elif ch == '\\':
+                escape = True
+                out.append(ch)
+            elif ch == quote or (mixed_quotes and quote == '”' and ch == '"'):
+                quote = None
+                out.append('"')
+            elif ch == '"':
+                # 全角引号包起来的字符串里出现的半角引号
+                out.append('\\"')
+            elif ch == '\n':
+                out.append('\\n')
+            elif ch in '\r\t':
+                out.append(' ')
+            else:
+                out.append(ch)
+            continue
+
+        if ch in '"“':
+            quote = '"' if ch == '"' else '”'
+            out.append('"')
+        elif ch in '{[':
+            stack.append(_CLOSERS[ch])
+            out.append(ch)
+            if len(stack) == 1:
+                cut = (len(out), list(stack))
+        elif ch in '}]':
+            # 去掉尾随逗号
+            while out and out[-1].isspace():
+                out.pop()
+            if out and out[-1] == ',':
+                out.pop()
+            if stack:
+                stack.pop()
+            out.append(ch)
+            if not stack:
+                break       # 顶层结构结束，忽略之后的说明文字
+            if len(stack) == 1:
+                cut = (len(out), list(stack))
+        elif ch in ',，':
+            if len(stack) <= 1:
+                cut = (len(out), list(stack))
+            out.append(',')
+        else:
+            out.append(_FULLWIDTH_PUNCT.get(ch, ch))
+    return ''.join(out), stack, quote is not None, cut
+
+
+def _dropped_member(tail):
+    """回退时丢掉的对象字段名（截断在字段名内时无法得知，返回 None）"""
+    match = _MEMBER_KEY_RE.match(tail)
+    if not match:
+        return None
+    try:
+        return json.loads(match.group(1))
+    except ValueError:
+        return None
+
+
+def _repair(text):
+    """repair_json 的实现，返回 (解析结果, 截断时丢掉的顶层对象字段路径列表)"""
+    text = strip_fences(text)
+    try:
+        return json.loads(text), []
+    except ValueError:
+        pass
+
+    starts = [i for i in (text.find('{'), text.find('[')) if i >= 0]
+    if not starts:
+        raise ValueError("回复中没有 JSON 内容")
+    for mixed_quotes in (False, True):
+        normalized, stack, in_string, cut = _scan(text[min(starts):], mixed_quotes)
+        candidates = [(normalized, [])]
+        if stack or in_string:
+            # 被截断：最后一个字段是已闭合的字符串时对象直接补齐；
+            # 否则退回到最后一个完整元素，补齐只会留下值残缺的最后一个元素（如截断的字符串）
+            if stack == ['}'] and not in_string and normalized.rstrip().endswith('"'):
+                candidates.append((normalized + '}', []))
+            if cut:
+                dropped = []
+                if cut[1] == ['}']:
+                    key = _dropped_member(normalized[cut[0]:])
+                    dropped = [(key,)] if key is not None else []
+                candidates.append((normalized[:cut[0]] + ''.join(reversed(cut[1])), dropped))
+        for candidate, dropped in candidates:
+            try:
+                return json.loads(candidate), dropped
+            except ValueError:
+                continue
+    raise ValueError(f"无法修复的 JSON: {text[:80]}")
+
+
+def repair_json(text):
+    """尽量把模型回复修成合法 JSON 并解析；无法修复时抛出 ValueError"""
+    return _repair(text)[0]
+
+
+def _conform_value(value, schema):
+    """按 schema 归一单个值，返回 (值, 是否有效)"""
+    expected = schema.get('type')
+    if expected == 'string':
+        if value is None:
+            return '', True
+        if isinstance(value, list):
+            return '\n'.join(str(v) for v in value if v is not None), True
+        if isinstance(value, (int, float, bool)):
+            return str(value), True
+        return value, isinstance(value, str)
+    if expected == 'number':
+        if isinstance(value, str):
+            text = value.strip()
+            try:
+                value = float(text[:-1]) / 100 if text.endswith('%') else float(text)
+            except ValueError:
+                return value, False
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return value, False
+        if 'maximum' in schema:
+            value = min(value, schema['maximum'])
+        if 'minimum' in schema:
+            value = max(value, schema['minimum'])
+        return value, True
+    return value, True
+
+
+def conform(value, schema, path=()):
+    """
+    按 schema 就地归一 value，返回 (value, problems)
+    problems 为缺失或无效的字段路径列表，如 [('学校进展',)] 或 [(2, 'event_conf')]；
+    根节点类型不符时返回 [()]，无效字段会从对象中移除
+    """
+    expected = schema.get('type')
+    if expected == 'object':
+        if not isinstance(value, dict):
+            return value, [path]
+        problems = []
+        for key, sub_schema in schema.get('properties', {}).items():
+            if key not in value:
+                continue
+            if sub_schema.get('type') in ('object', 'array'):
+                value[key], sub_problems = conform(value[key], sub_schema, path + (key,))
+                problems.extend(sub_problems)
+                continue
+            value[key], ok = _conform_value(value[key], sub_schema)
+            if not ok:
+                del value[key]
+        problems.extend(path + (key,) for key in schema.get('required', []) if key not in value)
+        return value, problems
+    if expected == 'array':
+        if not isinstance(value, list):
+            return value, [path]
+        problems = []
+        item_schema = schema.get('items')
+        if item_schema:
+            for idx, item in enumerate(value):
+                value[idx], item_problems = conform(item, item_schema, path + (idx,))
+                problems.extend(item_problems)
+        return value, problems
+    value, ok = _conform_value(value, schema)
+    return value, [] if ok else [path]
+
+
+def parse_structured(text, schema):
+    """
+    repair_json + conform；根节点无法解析或类型不符时抛出 ValueError，字段级问题随结果返回
+    回复被截断时丢掉的对象字段（schema 中声明过的）也作为问题返回，由调用方追问
+    """
+    value, dropped = _repair(text)
+    value, problems = conform(value, schema)
+    if () in problems:
+        raise ValueError(f"回复的顶层类型不是 {schema.get('type')}")
+    properties = schema.get('properties', {})
+    problems.extend(path for path in dropped if path[0] in properties and path not in problems)
+    return value, problems
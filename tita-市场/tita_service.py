@@ -12,7 +12,6 @@ python tita_service.py
 
 import json
 import sqlite3
-import requests
 import datetime
 import time
 import os
@@ -23,14 +22,16 @@ import webbrowser
 from pathlib import Path
 from collections import Counter
 
+from http_client import get_session
+
 # Flask和APScheduler
 try:
-    from flask import Flask, send_file, jsonify, redirect
+    from flask import Flask, send_file, jsonify, redirect, request
     from apscheduler.schedulers.background import BackgroundScheduler
 except ImportError:
     print("缺少依赖，正在安装...")
     os.system("pip install flask apscheduler")
-    from flask import Flask, send_file, jsonify, redirect
+    from flask import Flask, send_file, jsonify, redirect, request
     from apscheduler.schedulers.background import BackgroundScheduler
 
 # Selenium (用于扫码)
@@ -71,6 +72,19 @@ fetch_progress = {
     "end_time": None
 }
 
+# 历史回填状态
+backfill_progress = {
+    "is_running": False,
+    "start": None,
+    "end": None,
+    "done_days": 0,
+    "failed_days": [],
+    "total_days": 0,
+    "message": "",
+    "start_time": None,
+    "end_time": None
+}
+
 # ==================== 工具函数 ====================
 
 def load_shared_cookie():
@@ -141,7 +155,7 @@ def test_cookie(config):
     }
     
     try:
-        response = requests.post(url, headers=headers, json=payload, timeout=10)
+        response = get_session('tita', config).post(url, headers=headers, json=payload, timeout=10)
         if response.status_code in [401, 403]:
             return False, "Cookie已失效"
         if response.status_code != 200:
@@ -224,8 +238,8 @@ def ensure_valid_cookie():
 
 # ==================== 数据爬取与分析 ====================
 
-def fetch_and_analyze_logs(date_str=None):
-    """爬取并分析日报"""
+def fetch_and_analyze_logs(date_str=None, incremental=None):
+    """爬取并分析日报；incremental=False 时全量翻页（正文未变的日报仍复用已有分析）"""
     global service_status, fetch_progress
     
     # 初始化进度
@@ -259,85 +273,69 @@ def fetch_and_analyze_logs(date_str=None):
         # 调用现有的爬取逻辑
         import daily_log_aggregator as aggregator
         
-        start_time = f"{date_str} 00:00:00"
-        end_time = f"{date_str} 23:59:59"
+        def on_progress(current, total, user_name):
+            fetch_progress["phase"] = "analyzing"
+            fetch_progress["current"] = current
+            fetch_progress["total"] = total
+            fetch_progress["current_user"] = user_name
+            fetch_progress["message"] = f"正在分析: {user_name} ({current}/{total})"
+        
+        # 分析并保存（增量模式下未变化的日报不再调用LLM）
+        if config.get('ingest_engine') == 'async':
+            import async_engine
+            log("使用异步引擎拉取分析")
+            processed, stats = async_engine.ingest_day(config, date_str, incremental=incremental,
+                                                       on_progress=on_progress)
+            report_count = aggregator.generate_report(processed, date_str, config, stats=stats)
+        else:
+            # 拉取、分析、入库、写报告流式衔接
+            conn = aggregator.init_db()
+            stats = {}
+            try:
+                report_count = aggregator.generate_report(
+                    aggregator.iter_ingest_day(config, date_str, conn, incremental=incremental,
+                                               on_progress=on_progress, stats=stats),
+                    date_str, config, stats=stats)
+            finally:
+                conn.close()
         
-        all_logs = aggregator.fetch_logs(config, start_time, end_time)
-        if not all_logs:
+        if not stats['fetched']:
             fetch_progress["phase"] = "done"
             fetch_progress["message"] = f"未获取到 {date_str} 的日报数据"
             fetch_progress["is_running"] = False
             log(f"未获取到 {date_str} 的日报数据")
             return False
         
-        filtered = aggregator.filter_logs(all_logs, config['target_departments'])
-        fetch_progress["total"] = len(filtered)
-        fetch_progress["message"] = f"获取到 {len(filtered)} 条日报，开始AI分析..."
-        fetch_progress["phase"] = "analyzing"
-        log(f"获取到 {len(filtered)} 条日报")
+        log(f"共 {report_count} 条日报，本次分析 {stats['analyzed']} 条（其中正文被修改 {stats['edited']} 条），"
+            f"未变化跳过 {stats['skipped']} 条")
+        log(f"拉取 {stats['pages_fetched']} 页，重试 {stats['page_retries']} 次，丢失 {len(stats['pages_lost'])} 页")
+        if stats['pages_lost']:
+            log(f"以下页面重试后仍失败，数据可能不完整: {stats['pages_lost']}", "WARNING")
+        from llm_client import cache_stats
+        llm_cache = cache_stats()
+        if llm_cache:
+            log(f"LLM缓存（服务启动以来）: 命中 {llm_cache['hits']} 次，未命中 {llm_cache['misses']} 次，"
+                f"缓存 {llm_cache['entries']} 条")
         
-        # 分析并保存
-        conn = aggregator.init_db()
-        processed = []
-        
-        for idx, log_item in enumerate(filtered):
-            user_name = log_item.get('publishUser', {}).get('name', 'Unknown')
-            user_id = str(log_item.get('publishUser', {}).get('userId', ''))
-            dept_name = log_item.get('publishUser', {}).get('departmentName', '')
-            feed_id = log_item.get('feedId', '')
-            
-            # 更新进度
-            fetch_progress["current"] = idx + 1
-            fetch_progress["current_user"] = user_name
-            fetch_progress["message"] = f"正在分析: {user_name} ({idx + 1}/{len(filtered)})"
-            
-            # 提取内容
-            content_parts = []
-            for item in log_item.get('dailyContent', []):
-                title = item.get('title', '')
-                text = item.get('content', '')
-                if text and text.strip():
-                    if title == "今日 OKR 进展":
-                        try:
-                            okr = json.loads(text)
-                            text = "\n".join([f"- {r['Name']}" for r in okr.get('Rows', [])])
-                        except:
-                            pass
-                    content_parts.append(f"**{title}**:\n{text}")
-            
-            full_content = "\n\n".join(content_parts)
-            
-            log(f"分析: {user_name}...")
-            analysis = aggregator.analyze_log_content(full_content, config)
-            
-            db_data = {
-                'feed_id': feed_id, 'user_id': user_id, 'user_name': user_name,
-                'department': dept_name, 'log_date': date_str, 'content': full_content
-            }
-            aggregator.save_log_to_db(conn, db_data, analysis)
-            processed.append({'original_log': log_item, 'full_content': full_content, 'analysis': analysis})
-        
-        conn.close()
-        
-        # 生成报告
         fetch_progress["phase"] = "generating"
         fetch_progress["message"] = "正在生成Dashboard..."
-        aggregator.generate_report(processed, date_str, config)
         
         service_status["last_fetch"] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         service_status["last_analysis"] = service_status["last_fetch"]
-        service_status["total_logs"] = len(processed)
+        service_status["total_logs"] = report_count
         
         # 重新生成Dashboard
         regenerate_dashboard()
         
         # 完成
         fetch_progress["phase"] = "done"
-        fetch_progress["message"] = f"✅ 完成! 处理 {len(processed)} 条日报"
+        fetch_progress["message"] = f"✅ 完成! 处理 {report_count} 条日报"
+        if stats['pages_lost']:
+            fetch_progress["message"] += f"（{len(stats['pages_lost'])} 页拉取失败，建议稍后重新拉取）"
         fetch_progress["end_time"] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         fetch_progress["is_running"] = False
         
-        log(f"✅ 完成! 处理 {len(processed)} 条日报")
+        log(f"✅ 完成! 处理 {report_count} 条日报")
         return True
         
     except Exception as e:
@@ -349,6 +347,55 @@ def fetch_and_analyze_logs(date_str=None):
         traceback.print_exc()
         return False
 
+def backfill_logs(start_date, end_date, workers=None, force=False):
+    """按日期区间回填历史日报（支持断点续跑）"""
+    global backfill_progress
+    import backfill
+    
+    backfill_progress.update({
+        "is_running": True, "start": start_date, "end": end_date,
+        "done_days": 0, "failed_days": [], "total_days": 0,
+        "message": "正在检测Cookie状态...",
+        "start_time": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "end_time": None
+    })
+    
+    try:
+        if not ensure_valid_cookie():
+            backfill_progress["message"] = "Cookie无效且刷新失败"
+            log("Cookie无效且刷新失败，跳过回填", "ERROR")
+            return False
+        
+        config = load_config()
+        backfill_progress["total_days"] = len(backfill.split_days(start_date, end_date))
+        log(f"开始回填 {start_date} ~ {end_date}")
+        
+        def on_day_done(log_date, stats, error):
+            if error:
+                backfill_progress["failed_days"].append(log_date)
+            else:
+                backfill_progress["done_days"] += 1
+            backfill_progress["message"] = f"已处理 {log_date}"
+        
+        summary = backfill.run_backfill(config, start_date, end_date, workers=workers, force=force,
+                                        on_day_done=on_day_done)
+        backfill_progress["done_days"] += summary["resumed_days"]
+        backfill_progress["message"] = (f"✅ 回填完成: 成功 {summary['done_days']} 天，"
+                                        f"失败 {len(summary['failed_days'])} 天，"
+                                        f"断点跳过 {summary['resumed_days']} 天")
+        log(backfill_progress["message"])
+        
+        regenerate_dashboard()
+        return not summary["failed_days"]
+    
+    except Exception as e:
+        backfill_progress["message"] = f"❌ 回填失败: {str(e)}"
+        log(f"回填失败: {e}", "ERROR")
+        return False
+    
+    finally:
+        backfill_progress["is_running"] = False
+        backfill_progress["end_time"] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
 def regenerate_dashboard():
     """重新生成Dashboard"""
     try:
@@ -382,6 +429,16 @@ def daily_fetch_job():
     log("执行每日定时爬取...")
     fetch_and_analyze_logs()
 
+def retry_failures_job():
+    """失败队列重试：早高峰与爬取/回填进行中时跳过，留给下一轮"""
+    import failure_queue
+    config = load_config()
+    if failure_queue.in_peak_hours(config) or fetch_progress["is_running"] or backfill_progress["is_running"]:
+        return
+    stats = failure_queue.drain(config)
+    if stats['tried']:
+        log(f"失败队列重试 {stats['tried']} 条: 恢复 {stats['recovered']} 条, 仍失败 {stats['failed']} 条")
+
 def setup_scheduler():
     """设置定时任务"""
     scheduler = BackgroundScheduler()
@@ -392,6 +449,12 @@ def setup_scheduler():
     # 每日爬取任务 - 早上9:00
     scheduler.add_job(daily_fetch_job, 'cron', hour=9, minute=0, id='daily_fetch')
     
+    # 失败队列重试 - 按间隔分批执行，早高峰内自动跳过；记录自身按指数间隔安排下次尝试
+    retry_config = config.get('retry_queue', {})
+    if retry_config.get('enabled', True):
+        scheduler.add_job(retry_failures_job, 'interval', minutes=retry_config.get('interval_minutes', 30),
+                          id='retry_failures', max_instances=1, coalesce=True)
+    
     # 保活任务 - 工作时间内随机执行
     start_hour = keepalive_config.get('start_hour', 8)
     end_hour = keepalive_config.get('end_hour', 18)
@@ -445,15 +508,54 @@ def api_progress():
 
 @app.route('/api/fetch')
 def api_fetch():
-    """手动触发爬取"""
+    """手动触发爬取，?full=1 全量翻页（不按台账提前停止）"""
+    incremental = False if request.args.get('full') == '1' else None
+    
     def do_fetch():
-        fetch_and_analyze_logs()
+        fetch_and_analyze_logs(incremental=incremental)
     
     thread = threading.Thread(target=do_fetch)
     thread.start()
     
     return jsonify({"status": "started", "message": "后台开始爬取，请稍后刷新页面"})
 
+@app.route('/api/backfill')
+def api_backfill():
+    """回填历史日报: /api/backfill?start=2025-10-01&end=2025-12-31[&workers=3][&force=1]"""
+    start_date = request.args.get('start')
+    end_date = request.args.get('end')
+    if not start_date or not end_date:
+        return jsonify({"status": "error", "message": "需要 start 和 end 参数 (YYYY-MM-DD)"}), 400
+    
+    try:
+        import backfill
+        backfill.split_days(start_date, end_date)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    
+    if backfill_progress["is_running"]:
+        return jsonify({"status": "busy", "message": "已有回填任务在运行"}), 409
+    
+    workers = request.args.get('workers', type=int)
+    force = request.args.get('force') == '1'
+    
+    thread = threading.Thread(target=backfill_logs, args=(start_date, end_date, workers, force))
+    thread.start()
+    
+    return jsonify({"status": "started", "message": f"后台开始回填 {start_date} ~ {end_date}"})
+
+@app.route('/api/backfill-progress')
+def api_backfill_progress():
+    """获取回填进度"""
+    return jsonify(backfill_progress)
+
+@app.route('/api/llm-stats')
+def api_llm_stats():
+    """LLM 调用统计: /api/llm-stats[?days=7][&caller=extract_v3]，含 p50/p95 延迟、吞吐与每日 token"""
+    import llm_telemetry
+    days = request.args.get('days', default=llm_telemetry.DEFAULT_REPORT_DAYS, type=int)
+    return jsonify(llm_telemetry.summarize(days, request.args.get('caller')))
+
 @app.route('/api/refresh-cookie')
 def api_refresh_cookie():
     """手动刷新Cookie"""
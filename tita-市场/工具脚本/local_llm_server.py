@@ -0,0 +1,293 @@
+"""
+本地 OpenAI 兼容模型替身
+不访问火山引擎，用于离线验证前缀缓存、并发、重试与流式解析，也可以在笔记本上压测分析流程。
+
+    python 工具脚本/local_llm_server.py --port 8089
+    python 工具脚本/local_llm_server.py --latency 800 --jitter 400 --error-rate 0.05
+
+然后在 config.json（tita-市场 与根目录周报脚本的配置均可）中设置：
+    "llm": { "base_url": "http://127.0.0.1:8089/api/v3" }
+
+支持的接口：
+  POST /api/v3/chat/completions           普通对话；模拟隐式前缀缓存（见过的 system 消息计为 cached_tokens）
+  POST /api/v3/context/create             创建 common_prefix 上下文，返回 id
+  POST /api/v3/context/chat/completions   带 context_id 的对话；上下文部分全部计为 cached_tokens
+请求带 "stream": true 时以 SSE 分段返回，stream_options.include_usage 为 true 时最后一段附带 usage。
+
+回复按提示词类型生成，同样的输入总是得到同样的输出，且符合调用方的 schema：
+  - 日报分类（单篇 / 批量 / 补问缺失类别）：各类别为字符串，正文按句轮流分到各类别
+  - v3 事件抽取（「JSON数组」）：每个提到学校的句子一个事件，字段与置信度齐全
+  - 合并分析：{"analysis": {...}, "events": [...]}
+  - 事件字段补全、流式续写：按请求的 index / 字段补齐，续写返回 []
+  - 其他（如周报）：固定格式的 Markdown 文本
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_seen_prefixes = set()
+_contexts = {}
+_lock = threading.Lock()
+# 错误注入用独立的随机数生成器，--seed 固定后可复现
+_random = random.Random()
+
+
+def estimate_tokens(messages):
+    """粗略估算 token 数（与 daily_log_aggregator.estimate_tokens 口径一致），每条消息另加 4 个"""
+    total = 0
+    for m in messages:
+        text = m.get('content') or ''
+        cjk = sum(1 for ch in text if '\u2e80' <= ch <= '\u9fff' or '\uac00' <= ch <= '\ud7af')
+        total += cjk + (len(text) - cjk) // 4 + 4
+    return total
+
+
+_SENTENCE_RE = re.compile(r'[^。；;！!？?\n]+')
+_SCHOOL_RE = re.compile(r'([\u4e00-\u9fa5]{2,12}?(?:大学|学院|中学|小学|学校|幼儿园|附中|[一二三四五六七八九十\d]+中))')
+# 学校名前面常连着时间、动作词，截掉
+_SCHOOL_LEAD_RE = re.compile(r'.*(?:上午|下午|拜访|走访|沟通|电话|联系|前往|去|到|和|与|跟)')
+_ACTIONS = [('签约', '签约'), ('演示', '产品演示'), ('试用', '试用'), ('报价', '报价'),
+            ('拜访', '拜访'), ('走访', '拜访'), ('电话', '电话沟通')]
+
+
+def _sentences(text):
+    return [s.strip() for s in _SENTENCE_RE.findall(text or '') if s.strip() and not s.strip().startswith('**')]
+
+
+def _log_text(text):
+    """去掉提示词部分，只留日志原文"""
+    for marker in ('日志原文：', '日报内容：'):
+        if marker in text:
+            return text.split(marker, 1)[1]
+    return text
+
+
+def category_answer(content, categories):
+    """按句轮流分到各类别，句子不够的类别为空串"""
+    answer = {cat: [] for cat in categories}
+    for idx, sentence in enumerate(_sentences(content)):
+        if categories:
+            answer[categories[idx % len(categories)]].append(sentence)
+    return {cat: '；'.join(parts) for cat, parts in answer.items()}
+
+
+def event_answer(content):
+    """每个提到学校的句子一个事件"""
+    events = []
+    for sentence in _sentences(content):
+        match = _SCHOOL_RE.search(sentence)
+        if not match:
+            continue
+        school = _SCHOOL_LEAD_RE.sub('', match.group(1)) or match.group(1)
+        action = next((label for word, label in _ACTIONS if word in sentence), '沟通')
+        events.append({
+            'raw_span': sentence,
+            'school_raw': school, 'school_norm': school, 'school_conf': 0.9,
+            'product_raw': '', 'product_norm': '', 'product_conf': 0.5,
+            'action_type': action, 'action_type_conf': 0.8,
+            'blocker': '', 'blocker_conf': 0.5,
+            'outcome': '', 'outcome_conf': 0.5,
+            # 长句按不确定处理，便于验证自适应双跑与分级路由
+            'event_conf': 0.9 if len(sentence) <= 60 else 0.7,
+        })
+    return events
+
+
+def _category_list(text, pattern):
+    match = re.search(pattern, text)
+    return [c.strip() for c in match.group(1).split(',') if c.strip()] if match else []
+
+
+def fake_answer(messages):
+    system = ''.join(m.get('content') or '' for m in messages if m.get('role') == 'system')
+    user = next((m.get('content') or '' for m in reversed(messages) if m.get('role') == 'user'), '')
+
+    if '"analysis"' in system and '"events"' in system:
+        categories = _category_list(system, r'归类到以下类别：(.+?)。')
+        content = _log_text(user)
+        result = {'analysis': category_answer(content, categories), 'events': event_answer(content)}
+    elif '需要补充的字段：' in user:
+        todo_text = user.split('需要补充的字段：', 1)[1].split('日报内容：', 1)[0]
+        try:
+            todo = json.loads(todo_text.strip())
+        except ValueError:
+            todo = []
+        defaults = {'raw_span': '', 'school_raw': '', 'action_type': '沟通', 'event_conf': 0.7}
+        result = [dict({'index': t.get('index')}, **{f: defaults.get(f, 0.5 if f.endswith('_conf') else '')
+                                                     for f in t.get('fields', [])}) for t in todo]
+    elif '中断了' in user:
+        result = []
+    elif 'JSON数组' in system:
+        result = event_answer(_log_text(user))
+    elif '<<<' in user and '键为日志ID' in user:
+        categories = _category_list(user, r'类别中：\s*\n\s*(.+)')
+        docs = re.findall(r'<<<(.+?)>>>\n(.*?)(?=\n\n<<<|\Z)', user.rsplit('解释语。', 1)[-1], re.S)
+        result = {doc_id: category_answer(content.strip(), categories) for doc_id, content in docs}
+    elif '类别中：' in user or '相关的信息：' in user:
+        categories = _category_list(user, r'(?:类别中|相关的信息)：\s*\n\s*(.+)')
+        result = category_answer(_log_text(user), categories)
+    else:
+        lines = _sentences(_log_text(user))
+        return '# 周报（本地替身）\n\n' + '\n'.join(f'- {line}' for line in lines[:20])
+    return json.dumps(result, ensure_ascii=False)
+
+
+def _usage(content, prompt_tokens, cached_tokens):
+    return {
+        'prompt_tokens': prompt_tokens,
+        'completion_tokens': len(content),
+        'total_tokens': prompt_tokens + len(content),
+        'prompt_tokens_details': {'cached_tokens': cached_tokens},
+    }
+
+
+def completion(model, content, prompt_tokens, cached_tokens):
+    return {
+        'id': f'chatcmpl-{uuid.uuid4().hex[:12]}',
+        'object': 'chat.completion',
+        'created': int(time.time()),
+        'model': model,
+        'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+        'usage': _usage(content, prompt_tokens, cached_tokens),
+    }
+
+
+def stream_chunks(model, content, prompt_tokens, cached_tokens, chunk_size, include_usage):
+    """SSE 分段：每段 chunk_size 个字符，最后一段带 finish_reason，include_usage 时再附一段 usage"""
+    chunk_id = f'chatcmpl-{uuid.uuid4().hex[:12]}'
+
+    def chunk(delta, finish_reason=None, usage=None):
+        data = {'id': chunk_id, 'object': 'chat.completion.chunk', 'created': int(time.time()), 'model': model,
+                'choices': [] if usage else [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}]}
+        if usage:
+            data['usage'] = usage
+        return data
+
+    for i in range(0, len(content), chunk_size):
+        yield chunk({'content': content[i:i + chunk_size]})
+    yield chunk({}, 'stop')
+    if include_usage:
+        yield chunk(None, usage=_usage(content, prompt_tokens, cached_tokens))
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    def _send(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _reply(self, body, model, content, prompt_tokens, cached_tokens):
+        options = self.server.options
+        delay = max(0.0, random.gauss(options.latency, options.jitter) / 1000) if options.jitter else \
+            options.latency / 1000
+        if not body.get('stream'):
+            time.sleep(delay)
+            return self._send(200, completion(model, content, prompt_tokens, cached_tokens))
+
+        # 流式：首段前等待一半延迟，其余均摊到各段之间
+        chunks = list(stream_chunks(model, content, prompt_tokens, cached_tokens, options.chunk_size,
+                                    (body.get('stream_options') or {}).get('include_usage', False)))
+        time.sleep(delay / 2)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream; charset=utf-8')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        for chunk in chunks:
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+            time.sleep(delay / 2 / len(chunks))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.close_connection = True
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            return self._send(400, {'error': {'message': 'invalid json'}})
+
+        model = body.get('model', 'local')
+        messages = body.get('messages') or []
+        path = self.path.rstrip('/')
+
+        if path.endswith('/context/create'):
+            context_id = f'ctx-{uuid.uuid4().hex[:12]}'
+            with _lock:
+                _contexts[context_id] = messages
+            return self._send(200, {'id': context_id, 'model': model, 'mode': body.get('mode'),
+                                    'ttl': body.get('ttl'),
+                                    'usage': {'prompt_tokens': estimate_tokens(messages)}})
+
+        if path.endswith('/chat/completions') and self.server.options.error_rate:
+            with _lock:
+                failed = _random.random() < self.server.options.error_rate
+            if failed:
+                time.sleep(self.server.options.latency / 1000 / 2)
+                status = self.server.options.error_status
+                return self._send(status, {'error': {'message': f'injected error {status}'}})
+
+        if path.endswith('/context/chat/completions'):
+            with _lock:
+                prefix = _contexts.get(body.get('context_id'))
+            if prefix is None:
+                return self._send(404, {'error': {'message': 'context not found'}})
+            cached = estimate_tokens(prefix)
+            return self._reply(body, model, fake_answer(prefix + messages), cached + estimate_tokens(messages),
+                               cached)
+
+        if path.endswith('/chat/completions'):
+            # 隐式前缀缓存：开头的 system 消息与之前某次请求完全相同即视为命中
+            prefix = []
+            for m in messages:
+                if m.get('role') != 'system':
+                    break
+                prefix.append(m)
+            key = json.dumps([model, prefix], ensure_ascii=False, sort_keys=True)
+            with _lock:
+                hit = bool(prefix) and key in _seen_prefixes
+                _seen_prefixes.add(key)
+            cached = estimate_tokens(prefix) if hit else 0
+            return self._reply(body, model, fake_answer(messages), estimate_tokens(messages), cached)
+
+        self._send(404, {'error': {'message': f'unknown path {self.path}'}})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地 OpenAI 兼容模型替身')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--latency', type=float, default=0, help='每次回复的平均延迟（毫秒）')
+    parser.add_argument('--jitter', type=float, default=0, help='延迟的标准差（毫秒），0 为固定延迟')
+    parser.add_argument('--error-rate', type=float, default=0, help='对话请求随机失败的比例（0~1）')
+    parser.add_argument('--error-status', type=int, default=500, help='注入失败时返回的状态码，如 429 / 500 / 503')
+    parser.add_argument('--chunk-size', type=int, default=16, help='流式回复每段的字符数')
+    parser.add_argument('--seed', type=int, default=None, help='错误注入的随机种子，固定后可复现')
+    args = parser.parse_args()
+    _random.seed(args.seed)
+
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    server.options = args
+    print(f"本地模型替身已启动: http://{args.host}:{args.port}/api/v3 "
+          f"(延迟 {args.latency:.0f}±{args.jitter:.0f}ms, 错误率 {args.error_rate:.0%})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -6,12 +6,15 @@
 
 import json
 import sqlite3
-import requests
+import sys
 from datetime import datetime
 from pathlib import Path
 
 # 项目根目录
 BASE_DIR = Path(__file__).parent.parent
+sys.path.insert(0, str(BASE_DIR))
+
+from http_client import get_session
 
 def load_config():
     """加载配置文件"""
@@ -26,7 +29,7 @@ def get_tenant_access_token(app_id: str, app_secret: str) -> str:
         "app_id": app_id,
         "app_secret": app_secret
     }
-    resp = requests.post(url, json=payload)
+    resp = get_session('feishu').post(url, json=payload)
     resp.raise_for_status()
     data = resp.json()
     if data.get("code") != 0:
@@ -39,7 +42,7 @@ def get_wiki_node_info(token: str, wiki_token: str) -> dict:
     headers = {"Authorization": f"Bearer {token}"}
     params = {"token": wiki_token}
     
-    resp = requests.get(url, headers=headers, params=params)
+    resp = get_session('feishu').get(url, headers=headers, params=params)
     resp.raise_for_status()
     data = resp.json()
     
@@ -67,7 +70,7 @@ def get_existing_records(token: str, app_token: str, table_id: str) -> set:
         if page_token:
             params["page_token"] = page_token
         
-        resp = requests.get(url, headers=headers, params=params)
+        resp = get_session('feishu').get(url, headers=headers, params=params)
         resp.raise_for_status()
         data = resp.json()
         
@@ -229,7 +232,7 @@ def sync_logs_to_feishu():
         payload = {"records": records}
         
         try:
-            resp = requests.post(url, headers=headers, json=payload)
+            resp = get_session('feishu').post(url, headers=headers, json=payload)
             resp.raise_for_status()
             data = resp.json()
             
@@ -1,5 +1,6 @@
 
 import os
+import sys
 import json
 import time
 import requests
@@ -7,6 +8,11 @@ import datetime
 import webbrowser
 from datetime import timedelta
 
+# 复用 tita-市场 的共享连接池与 LLM 响应缓存
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "tita-市场"))
+from http_client import get_session
+from llm_client import DEFAULT_SUMMARY_TIMEOUT, chat_completion
+
 # 配置文件路径
 CONFIG_PATH = "config.json"
 SHARED_COOKIE_FILE = r'f:\共享配置\tita_cookie.json'  # 共享Cookie文件
@@ -66,7 +72,7 @@ def check_cookie_valid(config):
     payload = config.get("payload_template", {}).copy()
     
     try:
-        response = requests.post(url, headers=headers, json=payload, timeout=10)
+        response = get_session('tita').post(url, headers=headers, json=payload, timeout=10)
         data = response.json()
         
         # 检查返回码 - Code=1 表示成功
@@ -169,7 +175,7 @@ def fetch_daily_reports(start_date, end_date, config):
     payload = config.get("payload_template", {}).copy()
     
     try:
-        response = requests.post(url, headers=headers, json=payload)
+        response = get_session('tita').post(url, headers=headers, json=payload)
         response.raise_for_status()
         data = response.json()
         
@@ -218,36 +224,26 @@ def generate_summary(reports_text, prompt_template, config):
     api_url = config.get("ai_api_url")
     api_key = config.get("ai_api_key")
     model_id = config.get("ai_model_id")
+    # 配置了 llm.base_url（其他 OpenAI 兼容服务，如本地替身）时优先使用
+    base_url = config.get("llm", {}).get("base_url")
+    if base_url:
+        api_url = base_url.rstrip("/") + "/chat/completions"
 
     messages = [
         {"role": "system", "content": prompt_template},
         {"role": "user", "content": f"以下是本周的日报记录，请汇总生成周报：\n\n{reports_text}"}
     ]
     
-    payload = {
-        "model": model_id,
-        "messages": messages,
-        "temperature": 0.3
-    }
-    
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {api_key}"
-    }
-    
     try:
         print("(INFO) 正在发送请求给 AI 模型，请稍候...")
-        response = requests.post(api_url, headers=headers, json=payload)
-        response.raise_for_status()
-        result = response.json()
-        
-        # 检查响应
-        if "choices" in result and len(result["choices"]) > 0:
-            return result["choices"][0]["message"]["content"]
-        else:
-            print(f"(WARNING) AI 响应格式异常: {result}")
-            return None
+        # 同一批日报与提示词的结果会被缓存，重复生成时不再请求
+        return chat_completion(messages, model=model_id, api_key=api_key, config=config,
+                               temperature=0.3, timeout=DEFAULT_SUMMARY_TIMEOUT, url=api_url,
+                               caller='weekly_summary')
             
+    except (KeyError, IndexError) as e:
+        print(f"(WARNING) AI 响应格式异常: {e}")
+        return None
     except Exception as e:
         print(f"(ERROR) 调用 AI 接口失败: {e}")
         return None